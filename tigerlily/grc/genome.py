@@ -23,7 +23,7 @@ import hashlib
 import os
 import tempfile
 
-from tigerlily.sequences import parseFASTA, NucleicSequence
+from tigerlily.sequences import parseFASTABinary, NucleicSequence
 from tigerlily.utility.download import ConsoleDownloader, make_filename
 from tigerlily.utility.archive import Archive
 
@@ -95,6 +95,9 @@ class GRCGenome:
     def sequences(self):
         """Generates each sequence in the genome as a FASTASequence
 
+        The FASTA files are parsed as bytes, without being decoded, so each
+        sequence is a ``BinaryFASTASequence`` whose ``data`` holds its bases.
+
         >>> from tigerlily.sequences import PolymerSequence
         >>> refgen = GRCGenome.download('test1')
         >>> for seq in refgen.sequences():
@@ -106,8 +109,8 @@ class GRCGenome:
         if self._archive is None:
             raise ValueError('Empty reference genome, no archive loaded')
 
-        for fasta_file in self._archive.getfasta():
-            for seq in  parseFASTA(file=fasta_file):
+        for fasta_file in self._archive.getfasta(binary=True):
+            for seq in parseFASTABinary(file=fasta_file):
                 yield seq
             
 
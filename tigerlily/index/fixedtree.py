@@ -24,13 +24,25 @@ import os
 import struct
 import bz2
 import io
+import sys
+import array
+import gc
+import itertools
+import multiprocessing
+import re
+from bisect import bisect_left
 
 from tigerlily.index.index import GroupIndex
-from tigerlily.sequences import reverse_complement
+from tigerlily.sequences import reverse_complement, IUPAC_CODES
 from tigerlily.utility import hamming_distance, greatest_common_prefix
 
+# Stored FixedTree files start with this, followed by the format version.
+# Version 2 stores the children of each node in slot order.
+STORE_MAGIC = b'TLFX'
+STORE_VERSION = 2
+
 class FixedTree(GroupIndex):
-    def __init__(self, width, genome=None, reverse=False):
+    def __init__(self, width, genome=None, reverse=False, workers=None):
         """``FixedTree`` objects support alignment of fixed-width reads.
 
         *width* is the fixed width of reads that can be aligned to this index.
@@ -41,8 +53,10 @@ class FixedTree(GroupIndex):
         aligned.
 
         If *genome* is set, it must be a member of
-        ``tigerlily.grc.genome.GRCGenome``. The index will load every sequence
-        in that genome. (You may omit this and then simply add sequences later.)
+        ``tigerlily.grc.genome.GRCGenome`` or a
+        ``tigerlily.sequences.PolymerSequenceGroup``. The index will load every
+        sequence in that genome. (You may omit this and then simply add
+        sequences later.)
 
         If *reverse* is set to ``True``, then each input sequence's reverse
         complement is also processed. Alignments on these strands are reported
@@ -51,6 +65,10 @@ class FixedTree(GroupIndex):
         Note that the reported position of a reverse strand alignment will be
         the same position as the given sequence's reverse complement's position.
 
+        If *workers* is set to an integer greater than 0, *genome* is loaded
+        with ``FixedTree.build`` using that many worker processes instead of
+        being added one sequence at a time. The result is identical.
+
         Other than this function, you may also create a new ``FixedTree``
         object by using ``FixedTree.load()`` to load a stored index.
         """
@@ -58,8 +76,11 @@ class FixedTree(GroupIndex):
         self.root = FixedTreeNode()
         self.width = width
         self.sequence_name_table = {}
+        self._seed_table = None
         
-        if genome:
+        if genome and workers:
+            self._bulk_load(genome, reverse, workers)
+        elif genome:
             for sequence in genome.sequences():
                 self.add_sequence(sequence, reverse)
 
@@ -72,7 +93,8 @@ class FixedTree(GroupIndex):
             raise EnvironmentError('File {} already exists.'.format(filename))
 
         buffer = bz2.BZ2File(filename,mode='w')
-        buffer.write(struct.pack('<II',self.width,
+        buffer.write(STORE_MAGIC)
+        buffer.write(struct.pack('<III',STORE_VERSION,self.width,
                                        len(self.sequence_name_table)))
 
         for i in sorted(self.sequence_name_table.keys()):
@@ -82,14 +104,28 @@ class FixedTree(GroupIndex):
                 ident.encode('utf-8')))
 
         self.root.store(buffer)
+        buffer.close()
 
     @classmethod
     def load(cls, filename):
-        """Create a new FixedTree from the named file."""
+        """Create a new FixedTree from the named file.
+
+        Files written before the format carried a version (version 1) are
+        still accepted.
+        """
 
         buffer = bz2.BZ2File(filename)
-        
-        width, num_seqs = _unpack_buffer('<II',buffer)
+
+        magic = buffer.read(len(STORE_MAGIC))
+        if magic == STORE_MAGIC:
+            version, width, num_seqs = _unpack_buffer('<III',buffer)
+            if version > STORE_VERSION:
+                raise ValueError('Unsupported FixedTree version {}'.format(
+                                                                   version))
+        else:
+            # Version 1 files start directly with the width
+            (num_seqs,) = _unpack_buffer('<I',buffer)
+            (width,) = struct.unpack('<I',magic)
 
         newtree = FixedTree(width)
         newtree.width=width
@@ -107,6 +143,128 @@ class FixedTree(GroupIndex):
         return newtree
 
 
+    @classmethod
+    def build(cls, genome, width, reverse=False, workers=None):
+        """Create a new ``FixedTree`` from *genome* in one bulk pass.
+
+        The result is the same index that ``FixedTree(width, genome, reverse)``
+        would produce, but instead of inserting every window one at a time
+        this gathers a (window, sequence, position, strand) record for every
+        window in the genome, sorts them, and then emits the compressed tree
+        in a single linear pass over the sorted records. This is much faster
+        for large genomes because no window ever has to search its way down
+        from the root.
+
+        *genome* may be anything with a ``sequences()`` method, such as a
+        ``tigerlily.grc.genome.GRCGenome``. *width* and *reverse* have the
+        same meaning as in ``FixedTree()``.
+
+        If *workers* is an integer greater than 0, the windows are instead
+        partitioned by their first ``BUILD_PREFIX_LENGTH`` bases, across every
+        sequence, and a pool of that many processes builds the subtree of
+        each partition (windows whose prefix is not all A, C, G and T form
+        one more partition). The subtrees are then grafted together under
+        the root, so the result (including the ``sequence_name_table``) is
+        identical to a serial build. Grafted subtrees are kept as flat arrays
+        and only turned in to nodes as they are visited. Where processes
+        cannot be forked, the tree is built serially.
+        """
+        tree = cls(width)
+        tree._bulk_load(genome, reverse, workers)
+        return tree
+
+    # The length of the prefix by which a parallel build partitions windows.
+    BUILD_PREFIX_LENGTH = 3
+
+    def _bulk_load(self, genome, reverse, workers=None):
+        """Replace this tree's contents with every window in *genome*.
+
+        See ``FixedTree.build``.
+        """
+        self.root = FixedTreeNode()
+        self.sequence_name_table = {}
+        self._seed_table = None
+        # The tree holds no reference cycles, but while millions of nodes are
+        # created the cyclic collector would keep rescanning all of them.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            if workers:
+                self._parallel_load(genome, reverse, workers)
+            else:
+                self._serial_load(genome, reverse)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _serial_load(self, genome, reverse):
+        """Sort the records of every window and emit the tree from them."""
+        ids = []
+        records = []
+        for sequence in genome.sequences():
+            ids.append(self._get_id(sequence.identifier))
+            records.extend(_window_records(sequence.sequence, len(ids)-1,
+                                           self.width, reverse))
+        records.sort()
+        self.root = _build_root(records, ids, self.width)
+
+    def _parallel_load(self, genome, reverse, workers):
+        """Build the subtree of each prefix partition in a pool of *workers*
+        processes and graft them together.
+
+        Without the 'fork' start method (on Windows, for instance) the
+        sequences would have to be pickled to every worker, so the tree is
+        built serially instead.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self._serial_load(genome, reverse)
+            return
+
+        ids = []
+        strands = []
+        for sequence in genome.sequences():
+            ids.append(self._get_id(sequence.identifier))
+            seq = sequence.sequence
+            strands.append((seq, reverse_complement(seq) if reverse else None))
+
+        length = min(self.BUILD_PREFIX_LENGTH, self.width)
+        prefixes = [''.join(prefix) for prefix in
+                    itertools.product('ACGT', repeat=length)]
+        # The workers are forked, so they share the sequences instead of
+        # having them pickled. Each subtree comes back as a few flat arrays,
+        # which are far cheaper to pickle than the nodes themselves, and its
+        # nodes are only created from them when they are first visited.
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_start_build_worker,
+                          initargs=(strands, ids, self.width)) as pool:
+            for arrays in pool.imap_unordered(_build_partition,
+                                              prefixes + [length]):
+                for child in list(_FlatSubtree(arrays, 0).children()):
+                    _graft(self.root, child)
+
+    def compact(self):
+        """Return a compact, read-only copy of this index.
+
+        The copy is a ``tigerlily.index.flattree.FlatTree``, which holds the
+        whole tree in a few flat arrays (a node table, an edge label pool and
+        packed alignment arrays) instead of one Python object per node. It
+        answers ``alignments()``, ``align_batch()`` and ``in`` exactly like
+        this index and can be stored and memory-mapped, but no more sequences
+        can be added to it.
+        """
+        from tigerlily.index.flattree import FlatTree
+        return FlatTree(self)
+
+    def memory_usage(self):
+        """Return ``(bytes, bytes_per_base)`` for the memory used by the index.
+
+        *bytes* approximates the memory held by every node of the tree, and
+        *bytes_per_base* divides it by the number of indexed base positions
+        (one per stored alignment, so each strand counts separately).
+        """
+        return _memory_report(self.root.memory_usage(),
+                              _count_alignments(self.root))
+
     def add_sequence(self, sequence,reverse):
         """Add the given sequence to this index. 
 
@@ -117,18 +275,24 @@ class FixedTree(GroupIndex):
         """
         seq = sequence.sequence
         id = self._get_id(sequence.identifier)
-        for i in range(len(seq)-self.width+1):
-            subseq = seq[i:i+self.width]
-            # This loop will generate each overlapping subsequence
+        self._seed_table = None
+        width = self.width
+        insert = self.root.insert
+        if reverse:
+            # The reverse complement of the window at i is the window of the
+            # reverse complemented sequence ending len(seq)-i from its start.
+            rc_seq = reverse_complement(seq)
+            rc_end = len(seq)
+        for i in range(len(seq)-width+1):
+            # This loop will insert each overlapping window by its offsets,
+            # without slicing it out of the sequence.
             # Keep in mind that in the common use case, this loop will be
             # executed as much as 250 million times. So, keep it light.
 
-            alignment = (id,i,True)
-            self.root.insert(subseq,alignment)
+            insert(seq,(id,i,True),i,i+width)
 
             if reverse:
-                alignment = (id,i,False)
-                self.root.insert(reverse_complement(subseq),alignment)
+                insert(rc_seq,(id,i,False),rc_end-i-width,rc_end-i)
 
     def _get_id(self,identifier):
         """Assign a unique integer to this identifier, to be shared amongst
@@ -150,11 +314,16 @@ class FixedTree(GroupIndex):
         The alignment is performed as if alignments() was called with all
         optional arguments left at their default.
         """
-        return len(self.alignments(sequence)) > 0
+        if self.width != len(sequence):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+        node = self.root.find(sequence)
+        return node is not None and bool(node._alignments)
 
     def alignments(self, sequence, mismatches=0,
             maximum_alignments=None,
             best_alignments=False,
+            strategy='exhaustive',
         ):
         """Returns a list of all alignments produced by the given input.
 
@@ -182,34 +351,523 @@ class FixedTree(GroupIndex):
         performed and the search can end as soon maximum_alignments has been
         reached.
 
+        *strategy* chooses how mismatches are searched for. 'exhaustive'
+        follows every edge that fits in the remaining mismatches, which slows
+        down sharply as mismatches grows. 'pigeonhole' splits the read in to
+        mismatches+1 segments, at least one of which must match exactly, looks
+        up the windows sharing each segment and keeps those within mismatches
+        of the read. It is much faster for 2 or more mismatches, and returns
+        exactly the same list, but the first such search for each number of
+        mismatches builds a table of every segment of every window in the
+        index (see ``seed_table``).
+
         This will raise ValueError if the given sequence does not match the
-        pre-specified width of the index.
+        pre-specified width of the index, or if *strategy* is not known.
         """
 
         if self.width != len(sequence):
             raise ValueError('aligned read is not the right width for this '
                              'index')
-        
-        alignments = self.root.alignments(sequence,mismatches,
-            remaining_mismatches=mismatches,
-            maximum_alignments= None if best_alignments else maximum_alignments,
-        )
+        _check_strategy(strategy)
 
-        # Sort the alignments if best_alignments is on.
-        if best_alignments:
-            alignments.sort(key=_extract_result_mismatch)
+        limit = None if best_alignments else maximum_alignments
+        if strategy == 'pigeonhole' and mismatches:
+            alignments = self._seed_alignments(sequence, mismatches, limit)
+        else:
+            alignments = self.root.alignments(sequence,mismatches,
+                remaining_mismatches=mismatches,
+                maximum_alignments=limit,
+            )
 
-        # Truncate the result to maximum_alignments if not done already.
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def align_batch(self, reads, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+            strategy='exhaustive',
+        ):
+        """Align every read in *reads* at once, returning a list of results.
+
+        The result has one entry per read, in the same order as *reads*, and
+        each entry is exactly the list that ``alignments()`` would return for
+        that read with the same arguments. Each read may be a ``str`` or any
+        ``PolymerSequence``.
+
+        This is much faster than calling ``alignments()`` once per read when
+        many of the reads share prefixes, as real sequencing runs do. The reads
+        are sorted and walked down the tree together, so the comparison (or
+        Hamming distance) of each edge against a shared prefix is computed once
+        for all of the reads that have it, and identical reads are only aligned
+        once. With the 'pigeonhole' *strategy* the distinct reads are instead
+        looked up one at a time.
+
+        This will raise ValueError if any read does not match the
+        pre-specified width of the index.
+        """
+        reads = [str(read) for read in reads]
+        for read in reads:
+            if self.width != len(read):
+                raise ValueError('aligned read is not the right width for '
+                                 'this index')
+        _check_strategy(strategy)
+
+        distinct = sorted(set(reads))
+        found = [[] for read in distinct]
+        if strategy == 'pigeonhole' and mismatches:
+            limit = None if best_alignments else maximum_alignments
+            for i, read in enumerate(distinct):
+                found[i] = self._seed_alignments(read, mismatches, limit)
+        elif distinct:
+            self.root.batch_alignments(distinct,
+                [(i,mismatches) for i in range(len(distinct))],
+                0, mismatches, found,
+                None if best_alignments else maximum_alignments,
+            )
+
+        results = {}
+        for read, alignments in zip(distinct, found):
+            results[read] = _finish_alignments(alignments,
+                self.sequence_name_table, maximum_alignments, best_alignments)
+
+        return [list(results[read]) for read in reads]
+
+    def degenerate_alignments(self, query, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+        ):
+        """Return the alignments of every window compatible with *query*, in
+        the same form as ``alignments()``.
+
+        Each position of a degenerate *query* allows a set of bases. *query*
+        may be:
+
+            * a ``str`` of IUPAC nucleotide codes, such as 'ACNNRT';
+            * a sequence of per-position sets of bases, such as
+              ``['A', 'CT', {'G', 'T'}]``;
+            * an ``AminoSequence`` or ``BackTranslations``, each amino acid
+              allowing the codons that code for it. Codons are matched as a
+              whole, so only the windows which really translate to the
+              peptide are found, not every mix of their bases.
+
+        The tree is walked once, following only the edges that fit the
+        allowed bases, instead of aligning every sequence *query* stands for.
+        Up to *mismatches* positions (or, for amino acid queries, codons) may
+        fall outside their sets. *maximum_alignments* and *best_alignments*
+        are as for ``alignments()``.
+
+        This will raise ValueError if *query* does not cover exactly the
+        width of the index.
+        """
+        steps = _degenerate_steps(query)
+        if self.width != len(steps):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+
+        limit = None if best_alignments else maximum_alignments
+        alignments = self.root.degenerate_alignments(steps, 0, None,
+            mismatches, remaining_mismatches=mismatches,
+            maximum_alignments=limit,
+        )
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def seed_table(self, mismatches, cache=True):
+        """Return the table used by 'pigeonhole' searches for *mismatches*.
+
+        The result is ``(bounds, windows, nodes, seeds)``. *bounds* lists the
+        (start, end) of each of the mismatches+1 segments of a read. *windows*
+        is every distinct window of the index joined in to one ``str``, and
+        *nodes* the node storing the alignments of each, in the order an
+        exhaustive search reaches them. ``seeds[j]`` indexes segment j of
+        every window as ``(keys, starts, numbers, others)``: *keys* is a
+        sorted ``array('Q')`` of the distinct segments coded 2 bits per base
+        (only the first 32 bases of longer segments), and the windows having
+        ``keys[i]`` are ``numbers[starts[i]:starts[i+1]]``. Segments with
+        anything but A, C, G or T are instead looked up by their text in the
+        dict *others*.
+
+        The table costs at most about ``8 + width + 20 * (mismatches+1)``
+        bytes per distinct window (about 15MB for both strands of 100,000
+        bases at width 24) and takes far longer to build than a search. The
+        last table built is kept (until the index is changed) and reused for
+        the same number of mismatches; if *cache* is False the table is not
+        kept, and any kept table is released. If the width is too
+        short to give every segment at least one base, None is returned.
+        Searches build the table they need on first use; call this before
+        forking worker processes so that they share one table rather than
+        each building its own.
+        """
+        bounds = _seed_bounds(self.width, mismatches)
+        if bounds is None:
+            return None
+        table = self._seed_table
+        if table is None or table[0] != bounds:
+            table = _build_seed_table(_stored_windows(self.root), bounds)
+        self._seed_table = table if cache else None
+        return table
+
+    def _seed_alignments(self, read, mismatches, maximum_alignments):
+        """Pigeonhole equivalent of ``FixedTreeNode.alignments`` (see
+        ``_seed_matches``)."""
+        table = self.seed_table(mismatches)
+        if table is None:
+            return self.root.alignments(read,mismatches,
+                remaining_mismatches=mismatches,
+                maximum_alignments=maximum_alignments,
+            )
+        return _seed_matches(table, read, mismatches, maximum_alignments,
+                             FixedTreeNode.stored_alignments)
+
+# The mismatch search strategies of FixedTree.alignments
+STRATEGIES = ('exhaustive', 'pigeonhole')
+
+def _degenerate_steps(query):
+    """Turn a query for ``FixedTree.degenerate_alignments`` in to one
+    (allowed prefixes, starts unit) pair per base.
+
+    The query is split in to units - single bases, or codons for amino acid
+    queries - each allowing a set of strings. *allowed prefixes* holds every
+    prefix of an allowed string of the unit, ending at this base, and *starts
+    unit* is True for the first base of a unit.
+    """
+    if hasattr(query, 'back_translations'):
+        query = query.back_translations()
+    if hasattr(query, 'codon_sets'):
+        units = query.codon_sets
+    elif isinstance(query, str):
+        try:
+            units = [IUPAC_CODES[code] for code in query.upper()]
+        except KeyError as error:
+            raise ValueError('Unknown IUPAC code {}'.format(error)) from None
+    else:
+        units = [''.join(bases).upper() for bases in query]
+
+    steps = []
+    for unit in units:
+        size = len(unit[0])
+        for i in range(size):
+            steps.append(({allowed[:i+1] for allowed in unit}, i == 0))
+    return steps
+
+def _check_strategy(strategy):
+    """Raise ValueError unless *strategy* is in ``STRATEGIES``."""
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown alignment strategy {}'.format(strategy))
+
+# Turns A, C, G and T in to the base 4 digits of a seed key
+_SEED_DIGITS = str.maketrans('ACGT', '0123')
+
+# The most bases of a segment that fit in a seed key
+_SEED_BASES = 32
+
+def _seed_bounds(width, mismatches):
+    """Return the (start, end) of each of the mismatches+1 segments of a read
+    of *width* bases, or None if some segment would be empty."""
+    segments = mismatches + 1
+    if segments > width:
+        return None
+    return [(width*j // segments, width*(j+1) // segments)
+            for j in range(segments)]
+
+def _build_seed_table(stored, bounds):
+    """Return the ``FixedTree.seed_table`` for the segment *bounds* of the
+    (window, node) pairs generated by *stored*."""
+    windows = []
+    nodes = []
+    # The key and window number of every ordinary segment, for each bound
+    codes = [(array.array('Q'), array.array('I')) for bound in bounds]
+    others = [{} for bound in bounds]
+    for window, node in stored:
+        for (keys, numbers), other, (start, end) in zip(codes, others,
+                                                        bounds):
+            segment = window[start:end]
+            if _NON_ACGT.search(segment):
+                other.setdefault(segment, array.array('I')).append(
+                                                           len(windows))
+            else:
+                keys.append(int(segment[:_SEED_BASES].translate(
+                                                    _SEED_DIGITS), 4))
+                numbers.append(len(windows))
+        windows.append(window)
+        nodes.append(node)
+
+    seeds = []
+    for (keys, numbers), other in zip(codes, others):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        distinct = array.array('Q')
+        starts = array.array('Q')
+        for i, j in enumerate(order):
+            if not distinct or distinct[-1] != keys[j]:
+                distinct.append(keys[j])
+                starts.append(i)
+        starts.append(len(order))
+        seeds.append((distinct, starts,
+                      array.array('I', [numbers[j] for j in order]), other))
+    return bounds, ''.join(windows), nodes, seeds
+
+def _seed_windows(seed, segment):
+    """Return the numbers of the windows whose segment in *seed* (one entry
+    of ``seeds`` from ``FixedTree.seed_table``) is *segment*."""
+    keys, starts, numbers, others = seed
+    if _NON_ACGT.search(segment):
+        return others.get(segment, ())
+    key = int(segment[:_SEED_BASES].translate(_SEED_DIGITS), 4)
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        return numbers[starts[i]:starts[i+1]]
+    return ()
+
+def _seed_matches(table, read, mismatches, maximum_alignments, stored):
+    """Return the raw (mismatches, id, position, strand) alignments of *read*
+    found with the seed *table*, as ``FixedTreeNode.alignments`` would.
+
+    Any window within *mismatches* of *read* matches at least one of its
+    mismatches+1 segments exactly, so only the windows sharing a segment
+    with the read are compared against it. They are visited in the order
+    of the exhaustive search, so the results are identical. *stored* returns
+    the (id, position, strand) alignments of one of the table's nodes.
+    """
+    bounds, windows, nodes, seeds = table
+    width = len(read)
+
+    candidates = set()
+    for seed, (start, end) in zip(seeds, bounds):
+        candidates.update(_seed_windows(seed, read[start:end]))
+
+    alignments = []
+    for number in sorted(candidates):
+        hd = hamming_distance(read, windows[number*width:(number+1)*width])
+        if hd > mismatches:
+            continue
+        alignments += [(hd,v[0],v[1],v[2]) for v in stored(nodes[number])]
         if maximum_alignments and len(alignments) > maximum_alignments:
-            alignments = alignments[:maximum_alignments]
+            break
+    return alignments
+
+def _stored_windows(root):
+    """Generate (window, node) for every node under *root* that stores
+    alignments, in the order ``FixedTreeNode.alignments`` visits them."""
+    stack = [(root, '')]
+    while stack:
+        node, window = stack.pop()
+        if node._alignments:
+            yield window, node
+        stack.extend((child, window + child.label)
+                     for child in reversed(list(node.children())))
+
+def _count_alignments(root):
+    """Return the number of alignments stored beneath *root*."""
+    total = 0
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        if node._alignments:
+            total += len(node._alignments)
+        nodes.extend(node.children())
+    return total
+
+def _memory_report(total, positions):
+    """Return ``(total, total / positions)``, or zero per base if empty."""
+    return total, (total / positions if positions else 0.0)
+
+def _finish_alignments(alignments, sequence_name_table, maximum_alignments,
+                       best_alignments):
+    """Turn raw (mismatches, id, position, strand) search results in to the
+    final result of ``alignments()``.
+    """
+    # Sort the alignments if best_alignments is on.
+    if best_alignments:
+        alignments.sort(key=_extract_result_mismatch)
 
-        # Format the results for their final return
-        alignments = [(self.sequence_name_table[v[1]],v[2],v[3])
-                      for v in alignments]
+    # Truncate the result to maximum_alignments if not done already.
+    if maximum_alignments and len(alignments) > maximum_alignments:
+        alignments = alignments[:maximum_alignments]
 
-        # And we are done!
-        return alignments
-        
+    # Format the results for their final return
+    return [(sequence_name_table[v[1]],v[2],v[3]) for v in alignments]
+
+def _window_records(seq, ordinal, width, reverse, offset=0):
+    """Return a sortable record for every window of *seq*.
+
+    Each record is (window, ordinal, position, flag), where *flag* is 0 for
+    the reported strand and 1 for the opposing strand. Sorting the records
+    orders the alignments of each window exactly as ``FixedTree.add_sequence``
+    would have inserted them. *offset* is added to every position, for when
+    *seq* is only a piece of the original sequence.
+    """
+    records = [(seq[i:i+width], ordinal, i+offset, 0)
+               for i in range(len(seq)-width+1)]
+    if reverse:
+        records.extend([(reverse_complement(seq[i:i+width]), ordinal,
+                         i+offset, 1)
+                        for i in range(len(seq)-width+1)])
+    return records
+
+# The sequences of a parallel build, as set in each worker process by
+# _start_build_worker.
+_build_state = None
+
+# Runs of characters that partition windows by their prefix
+_NON_ACGT = re.compile('[^ACGT]+')
+
+def _start_build_worker(strands, ids, width):
+    """Pool initializer for parallel builds: keep the (sequence, reverse
+    complement or None) *strands*, *ids* and *width* for _build_partition."""
+    global _build_state
+    _build_state = (strands, ids, width)
+
+def _build_partition(prefix):
+    """Worker for parallel builds: return the ``_flatten_subtree`` arrays of
+    the tree of every window starting with *prefix*. If *prefix* is an int it
+    is instead the prefix length, and the windows with anything but A, C, G or
+    T in their prefix are used."""
+    strands, ids, width = _build_state
+    # As in FixedTree._bulk_load, nothing built here forms a cycle
+    gc.disable()
+    records = []
+    for ordinal, (seq, complement) in enumerate(strands):
+        last = len(seq) - width
+        for text, flag in ((seq, 0), (complement, 1)):
+            if text is None:
+                continue
+            if isinstance(prefix, int):
+                starts = _unusual_starts(text, prefix, last)
+            else:
+                starts = _prefix_starts(text, prefix, last)
+            # The window of the reverse complement starting at j is the
+            # reverse complement of the window at last-j.
+            records.extend((text[i:i+width], ordinal, last-i if flag else i,
+                            flag) for i in starts)
+    records.sort()
+    return _flatten_subtree(_build_root(records, ids, width))
+
+def _flatten_subtree(root):
+    """Return (labels, label starts, alignment starts, subtree ends,
+    alignments) describing every node under *root* in depth-first order, as
+    read by ``_FlatSubtree``.
+
+    The label and alignments of node *i* are ``labels[label_starts[i]:
+    label_starts[i+1]]`` and likewise for alignments, and the nodes of its
+    subtree are numbered from *i* to ``ends[i]``.
+    """
+    labels = []
+    label_starts = array.array('Q', [0])
+    alignment_starts = array.array('Q', [0])
+    ends = array.array('Q')
+    alignments = array.array('Q')
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, int):
+            ends[node] = len(ends)
+            continue
+        labels.append(node.label)
+        label_starts.append(label_starts[-1] + len(node.label))
+        if node._alignments:
+            alignments.extend(node._alignments)
+        alignment_starts.append(len(alignments))
+        # Mark the end of this node's subtree once its children are done
+        stack.append(len(ends))
+        ends.append(0)
+        stack.extend(reversed(list(node.children())))
+    return ''.join(labels), label_starts, alignment_starts, ends, alignments
+
+def _prefix_starts(text, prefix, last):
+    """Generate each start of *prefix* in *text*, up to *last*."""
+    start = text.find(prefix, 0, last + len(prefix))
+    while start >= 0:
+        yield start
+        start = text.find(prefix, start + 1, last + len(prefix))
+
+def _unusual_starts(text, length, last):
+    """Generate, in order and up to *last*, each start of a window of *text*
+    with anything but A, C, G or T in its first *length* characters."""
+    done = 0
+    for run in _NON_ACGT.finditer(text):
+        first = max(run.start() - length + 1, done)
+        done = min(run.end(), last + 1)
+        yield from range(first, done)
+
+def _graft(node, subtree):
+    """Merge *subtree*, whose label leads from *node*, in to the tree under
+    *node*. The windows under *subtree* must not already be in the tree."""
+    while True:
+        existing = node.child(subtree.label[0])
+        if existing is None:
+            node.set_child(subtree)
+            return
+        label = existing.label
+        common = greatest_common_prefix(label, subtree.label)
+        if common == len(label) == len(subtree.label):
+            for child in list(subtree.children()):
+                _graft(existing, child)
+            return
+        if common == len(label):
+            subtree.label = subtree.label[common:]
+            node = existing
+        elif common == len(subtree.label):
+            existing.label = label[common:]
+            node.set_child(subtree)
+            node, subtree = subtree, existing
+        else:
+            middle = FixedTreeNode(label[:common])
+            existing.label = label[common:]
+            subtree.label = subtree.label[common:]
+            middle.set_child(existing)
+            middle.set_child(subtree)
+            node.set_child(middle)
+            return
+
+def _build_root(records, ids, width):
+    """Emit a compressed tree from sorted window records in one pass.
+
+    *records* must be sorted and come from ``_window_records``, and *ids*
+    maps each record's ordinal to its sequence id. Returns the root node.
+
+    Because every window has the same width, no window is a prefix of another
+    and each distinct window ends on its own leaf. The stack holds the path
+    from the root to the most recent leaf as (node, depth) pairs, so each new
+    window only has to pop back to its common prefix with the previous window
+    and (at most) split one edge before hanging a new leaf.
+    """
+    root = FixedTreeNode()
+    stack = [(root, 0)]
+    previous = None
+    leaf = None
+
+    for window, ordinal, position, flag in records:
+        alignment = (ids[ordinal], position, flag == 0)
+
+        if window == previous:
+            leaf.add_alignment(alignment)
+            continue
+
+        common = (greatest_common_prefix(previous, window)
+                  if previous is not None else 0)
+
+        last = None
+        while stack[-1][1] > common:
+            last = stack.pop()
+        parent, depth = stack[-1]
+
+        if depth < common:
+            # The previous window's edge out of parent shares a prefix with
+            # this window, so split it at the common prefix.
+            child = last[0]
+            middle = FixedTreeNode(child.label[:common-depth])
+            child.label = child.label[common-depth:]
+            middle.set_child(child)
+            parent.set_child(middle)
+            stack.append((middle, common))
+            parent = middle
+
+        leaf = FixedTreeNode(window[common:], alignment)
+        parent.set_child(leaf)
+        stack.append((leaf, width))
+        previous = window
+
+    return root
 
 def _extract_result_mismatch(alignment):
     "Helper function to return the mismatch value in an alignments() lookup."
@@ -224,8 +882,8 @@ class FixedTreeNode:
     gaurunteed to not store any alignments). Any input sequence that lands on
     a node with a set of alignments may report those alignments.
 
-    Each node in the graph may contain a dictionary that maps strings to other
-    nodes - these strings represent labeled edges. Moving along an edge consumes
+    Each node in the graph may have children, and each child carries the label
+    of the edge leading to it from its parent. Moving along an edge consumes
     the corresponding prefix from the input sequence.
 
     Hamming distance may be used to move along an edge that doesn't exactly
@@ -249,14 +907,85 @@ class FixedTreeNode:
     Because of this property, we can be sure of correctness and optimality.
 
     Well, I'm mostly hoping about the optimality part. I haven't done the math.
+
+    A consequence of the first property is that no two edges of a node start
+    with the same character. Children are therefore kept in a small list with
+    one slot per base (see ``BASE_SLOTS``), so following the edge for the next
+    base of a sequence is a single lookup rather than a scan of every edge.
+    Edges starting with any other character (lowercase or ambiguous bases, for
+    instance) are kept in an overflow dictionary. Children are always visited
+    in slot order, followed by any overflow edges in sorted order.
     """
 
-    def __init__(self,alignment=None):
-        self.edges = {}
-        self._alignments = []
+    __slots__ = ('label', '_children', '_extra', '_alignments')
+
+    def __init__(self,label='',alignment=None):
+        self.label = label
+        self._children = None
+        self._extra = None
+        self._alignments = None
 
         if alignment is not None:
-            self._alignments.append(alignment)
+            self.add_alignment(alignment)
+
+    def add_alignment(self,alignment):
+        """Store the (id, position, strand) *alignment* on this node.
+
+        Alignments are packed in to a single 64-bit word each (see
+        ``_pack_alignment``), so positions must be less than 2**31.
+        """
+        if self._alignments is None:
+            self._alignments = array.array('Q')
+        self._alignments.append(_pack_alignment(*alignment))
+
+    def stored_alignments(self):
+        """Return this node's alignments as a list of (id, position, strand).
+        """
+        return [(v >> 32, (v >> 1) & _POSITION_MASK, v & 1 == 1)
+                for v in self._alignments or ()]
+
+    def child(self,base):
+        """Return the child whose edge starts with *base*, or None."""
+        slot = BASE_SLOTS.get(base)
+        if slot is not None:
+            return self._children[slot] if self._children else None
+        return self._extra.get(base) if self._extra else None
+
+    def children(self):
+        """Generate every child of this node, in a fixed order."""
+        if self._children:
+            for child in self._children:
+                if child is not None:
+                    yield child
+        if self._extra:
+            for base in sorted(self._extra):
+                yield self._extra[base]
+
+    def set_child(self,node):
+        """Make *node* a child of this node, replacing any child whose edge
+        starts with the same character."""
+        base = node.label[0]
+        slot = BASE_SLOTS.get(base)
+        if slot is not None:
+            if self._children is None:
+                self._children = [None] * len(BASE_SLOTS)
+            self._children[slot] = node
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[base] = node
+
+    def find(self,sequence,depth=0):
+        """Return the node reached by following *sequence* (from its *depth*
+        character on) exactly, or None.
+        """
+        node = self
+        while depth < len(sequence):
+            node = node.child(sequence[depth])
+            if node is None or not sequence.startswith(node.label,depth):
+                return None
+            depth += len(node.label)
+        return node
 
     def store(self,buffer):
         """Copy this node in to *buffer*, and then recursively (but in a fixed
@@ -264,29 +993,30 @@ class FixedTreeNode:
         """
 
         # save alignments
-        buffer.write(struct.pack('<I',len(self._alignments)))
-        for alignment in self._alignments:
+        alignments = self.stored_alignments()
+        buffer.write(struct.pack('<I',len(alignments)))
+        for alignment in alignments:
             buffer.write(struct.pack('<II?',*alignment))
 
         # save edges
-        buffer.write(struct.pack('<I',len(self.edges)))
-        for label,node in self.edges.items():
-            length = len(label)
-            buffer.write(struct.pack('<I',length))
-            buffer.write(struct.pack('<{}s'.format(length),
-                                     label.encode('utf-8')))
+        children = list(self.children())
+        buffer.write(struct.pack('<I',len(children)))
+        for node in children:
+            label = node.label.encode('utf-8')
+            buffer.write(struct.pack('<I',len(label)))
+            buffer.write(label)
             node.store(buffer)
 
     @classmethod
-    def load(cls,buffer):
+    def load(cls,buffer,label=''):
         """Return a new node by reading it from buffer, recursively"""
-        newnode = FixedTreeNode()        
+        newnode = FixedTreeNode(label)
 
         # load alignments
         (num_alignments,) = _unpack_buffer('<I',buffer)
         for i in range(num_alignments):
             alignment = _unpack_buffer('<II?',buffer)
-            newnode._alignments.append(alignment)
+            newnode.add_alignment(alignment)
 
         # load edges
         (num_edges,) = _unpack_buffer('<I',buffer)
@@ -294,66 +1024,204 @@ class FixedTreeNode:
             (label_len,) = _unpack_buffer('<I',buffer)
             (label,) = _unpack_buffer('<{}s'.format(label_len),buffer)
             label = label.decode('utf-8')
-            newnode.edges[label] = FixedTreeNode.load(buffer)
+            newnode.set_child(FixedTreeNode.load(buffer,label))
 
         return newnode
 
-    def insert(self,sequence,alignment):
+    def insert(self,sequence,alignment,start=0,end=None):
+        """Insert *sequence*, or just characters *start* to *end* of it, with
+        *alignment*.
+
+        Giving the offsets of a window instead of slicing it out means that
+        only the labels of new nodes are ever copied from *sequence*.
+        """
         # The goal is to create the maximum possible length edge without
         # violating the rules listed in the class definition documentation.
+        if end is None:
+            end = len(sequence)
 
-        if not sequence:
-            self._alignments.append(alignment)
-            return
-
-        for edge_label in self.edges:
+        node = self
+        while start < end:
+            child = node.child(sequence[start])
 
-            # If the given edge_label is an exact prefix, just follow the link.
-            if sequence.startswith(edge_label):
-                self.edges[edge_label].insert(sequence[len(edge_label):],
-                                                     alignment)
+            # Nothing starts with this base - just use the rest of the
+            # sequence as an edge to a leaf node.
+            if child is None:
+                node.set_child(FixedTreeNode(sequence[start:end],alignment))
                 return
 
-            # If the given edge_label shares a prefix, we have to split.
-            gsc = greatest_common_prefix(edge_label,sequence)
-            if gsc > 0:
-                # SPLIT!!!!
-
-                # First create the new intermediate node, and point it at the
-                # current (soon to no longer be a child) node.
-                old_child = self.edges[edge_label]
-                new_child = FixedTreeNode()
-                new_child.edges[edge_label[gsc:]] = old_child
+            # If the child's label is an exact prefix, just follow the link.
+            label = child.label
+            if sequence.startswith(label,start,end):
+                node = child
+                start += len(label)
+                continue
 
-                # Make the old node no longer be a child of the active node.
-                del self.edges[edge_label]
-                # Link the active node to the new intermediate node.
-                self.edges[edge_label[:gsc]] = new_child
+            # Otherwise the label shares a prefix, so we have to split.
+            gsc = 1
+            limit = min(len(label), end - start)
+            while gsc < limit and label[gsc] == sequence[start+gsc]:
+                gsc += 1
+            middle = FixedTreeNode(label[:gsc])
+            child.label = label[gsc:]
+            middle.set_child(child)
+            node.set_child(middle)
 
-                # Start over the insertion process at the new node.
-                new_child.insert(sequence[gsc:],alignment)
-                return
-            
+            # Carry on the insertion process at the new node.
+            node = middle
+            start += gsc
 
-        # Finally we use the catch-all - just use the rest of the sequence as
-        # an edge to a leaf node.
-        self.edges[sequence] = FixedTreeNode(alignment)
+        node.add_alignment(alignment)
 
     def alignments(self,sequence,original_mismatches,
                    remaining_mismatches=0,maximum_alignments=None):
 
         if not sequence:
             return [(original_mismatches - remaining_mismatches,
-                     v[0],v[1],v[2]) for v in self._alignments]
+                     v[0],v[1],v[2]) for v in self.stored_alignments()]
+
+        # Without mismatches at most one path can match, so follow it directly
+        if remaining_mismatches == 0:
+            node = self.find(sequence)
+            if node is None:
+                return []
+            return node.alignments('',original_mismatches)
 
         alignments = []
 
-        for edge_label in self.edges:
+        for child in self.children():
+            edge_label = child.label
             # Perfect prefix match
             if sequence.startswith(edge_label):
-                alignments += self.edges[edge_label].alignments(
-                    sequence[len(edge_label):], original_mismatches,
-                    remaining_mismatches = remaining_mismatches,
+                hd = 0
+            else:
+                # Edit distance, if mismatches allow
+                hd = hamming_distance(edge_label, sequence[:len(edge_label)])
+                if hd > remaining_mismatches:
+                    continue
+
+            alignments += child.alignments(
+                sequence[len(edge_label):], original_mismatches,
+                remaining_mismatches = remaining_mismatches - hd,
+                maximum_alignments = (maximum_alignments - len(alignments)
+                                        if maximum_alignments else None
+                                     ),
+            )
+            # Shortcut exit if maximum_alignments is exceeded
+            if maximum_alignments and len(alignments) > maximum_alignments:
+                return alignments
+
+        return alignments
+
+    def batch_alignments(self,reads,group,depth,original_mismatches,found,
+                         maximum_alignments=None):
+        """Batched equivalent of ``alignments`` for ``FixedTree.align_batch``.
+
+        *reads* is the sorted list of distinct reads and *group* is a list of
+        (read index, remaining mismatches) pairs for the reads that reached
+        this node, which sits *depth* bases in to each of them. The raw
+        alignments of each read are appended to its list in *found*, in the
+        same order ``alignments`` would produce them.
+
+        Reads with no mismatches left can follow only one path, so each is
+        looked up with ``find``. The rest are partitioned by their next base:
+        the first base of an edge then costs a whole partition either nothing
+        or one mismatch, and only the remainder of longer edges is compared
+        read by read (once per distinct segment).
+        """
+        if depth == len(reads[group[0][0]]):
+            alignments = self.stored_alignments()
+            for index, remaining_mismatches in group:
+                found[index] += [(original_mismatches - remaining_mismatches,
+                                  v[0],v[1],v[2]) for v in alignments]
+            return
+
+        partitions = {}
+        for index, remaining_mismatches in group:
+            read = reads[index]
+            if remaining_mismatches:
+                partitions.setdefault(read[depth], []).append(
+                    (index, remaining_mismatches))
+                continue
+            node = self.find(read, depth)
+            if node is not None and node._alignments:
+                found[index] += [(original_mismatches,v[0],v[1],v[2])
+                                 for v in node.stored_alignments()]
+        if not partitions:
+            return
+
+        for child in self.children():
+            edge_label = child.label
+            rest = edge_label[1:]
+            start = depth + 1
+            end = depth + len(edge_label)
+            distances = {}
+            subgroup = []
+
+            for base, members in partitions.items():
+                cost = 0 if base == edge_label[0] else 1
+                for index, remaining_mismatches in members:
+                    # Reads that already have enough alignments stop here
+                    if maximum_alignments and (
+                       len(found[index]) > maximum_alignments):
+                        continue
+
+                    read = reads[index]
+                    if read.startswith(rest, start):
+                        hd = cost
+                    elif remaining_mismatches == cost:
+                        continue
+                    else:
+                        segment = read[start:end]
+                        hd = distances.get(segment)
+                        if hd is None:
+                            hd = distances[segment] = hamming_distance(
+                                                          rest, segment)
+                        hd += cost
+                        if hd > remaining_mismatches:
+                            continue
+                    subgroup.append((index, remaining_mismatches - hd))
+
+            if subgroup:
+                child.batch_alignments(reads,subgroup,end,original_mismatches,
+                                       found,maximum_alignments)
+
+    def degenerate_alignments(self,steps,depth,prefix,original_mismatches,
+                              remaining_mismatches=0,maximum_alignments=None):
+        """Degenerate equivalent of ``alignments`` for
+        ``FixedTree.degenerate_alignments``.
+
+        *steps* comes from ``_degenerate_steps`` and this node sits *depth*
+        bases in to it. *prefix* is the part of the current unit matched so
+        far, or None if the unit has already been counted as a mismatch.
+        """
+        if depth == len(steps):
+            return [(original_mismatches - remaining_mismatches,
+                     v[0],v[1],v[2]) for v in self.stored_alignments()]
+
+        alignments = []
+
+        for child in self.children():
+            position = depth
+            matched = prefix
+            remaining = remaining_mismatches
+            for base in child.label:
+                allowed, starts_unit = steps[position]
+                if starts_unit:
+                    matched = ''
+                if matched is not None:
+                    matched += base
+                    if matched not in allowed:
+                        # The rest of a mismatched unit may be anything
+                        if not remaining:
+                            break
+                        remaining -= 1
+                        matched = None
+                position += 1
+            else:
+                alignments += child.degenerate_alignments(steps, position,
+                    matched, original_mismatches,
+                    remaining_mismatches = remaining,
                     maximum_alignments = (maximum_alignments - len(alignments)
                                             if maximum_alignments else None
                                          ),
@@ -361,28 +1229,81 @@ class FixedTreeNode:
                 # Shortcut exit if maximum_alignments is exceeded
                 if maximum_alignments and len(alignments) > maximum_alignments:
                     return alignments
-                continue
-
-            # Edit distance, if mismatches allow
-            if remaining_mismatches > 0:
-                hd = hamming_distance(edge_label, sequence[:len(edge_label)])
-                if hd <= remaining_mismatches:
-                    alignments += self.edges[edge_label].alignments(
-                        sequence[len(edge_label):], original_mismatches,
-                        remaining_mismatches = remaining_mismatches - hd,
-                        maximum_alignments = (maximum_alignmets -
-                                              len(alignments) if
-                                              maximum_alignments else None
-                                             ),
-                    )
-                    # Shortcut exit if maximum_alignments is exceeded
-                    if maximum_alignments and (
-                       len(alignments) > maximum_alignments):
-                        return alignments
-                    continue
 
         return alignments
-        
+
+    def memory_usage(self):
+        """Return the approximate number of bytes used by this node and every
+        node beneath it."""
+        total = 0
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            total += sys.getsizeof(node) + sys.getsizeof(node.label)
+            if node._children is not None:
+                total += sys.getsizeof(node._children)
+            if node._extra is not None:
+                total += sys.getsizeof(node._extra)
+            if node._alignments is not None:
+                total += sys.getsizeof(node._alignments)
+            nodes.extend(node.children())
+        return total
+
+class _FlatSubtree(FixedTreeNode):
+    """A ``FixedTreeNode`` whose subtree is still in the arrays returned by
+    ``_flatten_subtree``.
+
+    Only the label is set when the node is created. The first time anything
+    else is read, the node's alignments are copied out and its children are
+    created, as more ``_FlatSubtree`` nodes. A parallel build therefore
+    grafts whole partitions in to the tree without creating their nodes one
+    at a time; only the nodes that are searched or changed ever are.
+    """
+
+    __slots__ = ('_flat', '_index')
+
+    def __init__(self, flat, index):
+        labels, label_starts = flat[0], flat[1]
+        self.label = labels[label_starts[index]:label_starts[index+1]]
+        self._flat = flat
+        self._index = index
+
+    def __getattr__(self, name):
+        # Only called for slots that have not been set yet
+        if name not in ('_children', '_extra', '_alignments'):
+            raise AttributeError(name)
+        self._expand()
+        return getattr(self, name)
+
+    def _expand(self):
+        """Set this node's alignments and children from the arrays."""
+        flat, index = self._flat, self._index
+        labels, label_starts, alignment_starts, ends, alignments = flat
+        self._children = None
+        self._extra = None
+        self._alignments = None
+        start, end = alignment_starts[index], alignment_starts[index+1]
+        if end > start:
+            self._alignments = alignments[start:end]
+        child = index + 1
+        while child < ends[index]:
+            self.set_child(_FlatSubtree(flat, child))
+            child = ends[child]
+        self._flat = None
+
+# The child slot of each base in a FixedTreeNode
+BASE_SLOTS = {'A': 0, 'C': 1, 'G': 2, 'T': 3, 'N': 4}
+
+_POSITION_MASK = 2**31 - 1
+
+def _pack_alignment(id, position, strand):
+    """Pack an alignment in to one word: the sequence id in the high 32 bits,
+    then 31 bits of position, then the strand bit."""
+    if position > _POSITION_MASK or id >> 32:
+        raise ValueError('alignment ({}, {}) is too large to '
+                         'store'.format(id, position))
+    return (id << 32) | (position << 1) | (1 if strand else 0)
+
 def _unpack_buffer(format,buffer):
     """Helper function that should be in stdlib to unpack from a file-like"""
     this = struct.Struct(format)
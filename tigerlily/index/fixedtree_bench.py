@@ -0,0 +1,125 @@
+# fixedtree_bench.py - Compare the mismatch search strategies of FixedTree.
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmark of the 'exhaustive' and 'pigeonhole' strategies of
+``FixedTree.alignments``.
+
+A random genome is indexed, and reads are drawn from it with up to the given
+number of substitutions. Each strategy then aligns every read for 1 to 4
+mismatches, and the results are checked to be identical. Run it with::
+
+    python3 -m tigerlily.index.fixedtree_bench --bases 100000 --reads 200
+
+The first 'pigeonhole' search for each number of mismatches builds a seed
+table, which is timed separately: it is paid once per index, so the speedup
+compares the searches alone.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from tigerlily.sequences import NucleicSequence
+from tigerlily.index.fixedtree import FixedTree
+
+
+class RandomGenome:
+    """A genome of one random sequence, for use as an index's *genome*."""
+    def __init__(self, bases, seed):
+        generator = random.Random(seed)
+        self.sequence = ''.join(generator.choice('ACGT')
+                                for i in range(bases))
+
+    def sequences(self):
+        yield NucleicSequence(self.sequence, identifier='random')
+
+
+def sample_reads(sequence, width, count, mismatches, seed):
+    """Return *count* windows of *sequence*, each with up to *mismatches*
+    random substitutions."""
+    generator = random.Random(seed)
+    reads = []
+    for i in range(count):
+        start = generator.randrange(len(sequence) - width + 1)
+        read = list(sequence[start:start+width])
+        for position in generator.sample(range(width),
+                                         generator.randint(0, mismatches)):
+            read[position] = generator.choice('ACGT'.replace(read[position],
+                                                             ''))
+        reads.append(''.join(read))
+    return reads
+
+
+def run(bases, width, count, max_mismatches, seed, out=sys.stdout):
+    """Run the benchmark, writing one line per number of mismatches."""
+    genome = RandomGenome(bases, seed)
+    start = time.perf_counter()
+    index = FixedTree.build(genome, width, reverse=True)
+    out.write('Indexed {} bases at width {} in {:.2f}s\n'.format(
+        bases, width, time.perf_counter() - start))
+    out.write('mismatches  exhaustive  pigeonhole  seed table  speedup\n')
+
+    for mismatches in range(1, max_mismatches+1):
+        reads = sample_reads(genome.sequence, width, count, mismatches, seed)
+
+        start = time.perf_counter()
+        expected = [index.alignments(read, mismatches) for read in reads]
+        exhaustive = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index.seed_table(mismatches)
+        table = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = [index.alignments(read, mismatches, strategy='pigeonhole')
+                 for read in reads]
+        pigeonhole = time.perf_counter() - start
+
+        if found != expected:
+            raise AssertionError('strategies disagree at {} mismatches'.format(
+                                                                 mismatches))
+        out.write('{:10d}  {:9.2f}s  {:9.2f}s  {:9.2f}s  {:6.1f}x\n'.format(
+            mismatches, exhaustive, pigeonhole, table,
+            exhaustive / pigeonhole if pigeonhole else float('inf')))
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Compare FixedTree mismatch search strategies')
+    parser.add_argument('--bases', type=int, default=100000,
+                        help='Length of the random genome.')
+    parser.add_argument('--width', type=int, default=24,
+                        help='Index width (and read length).')
+    parser.add_argument('--reads', type=int, default=200,
+                        help='Number of reads aligned per mismatch count.')
+    parser.add_argument('--mismatches', type=int, default=4,
+                        help='Largest number of mismatches to try.')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed.')
+    options = parser.parse_args(args)
+    run(options.bases, options.width, options.reads, options.mismatches,
+        options.seed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -32,8 +32,13 @@ import unittest
 import tempfile
 import os
 import shutil
+import itertools
+import bz2
+import struct
+import pickle
 
-from tigerlily.sequences import NucleicSequence
+from tigerlily.sequences import (NucleicSequence, AminoSequence, IUPAC_CODES,
+    FASTASequence, PolymerSequenceGroup, createGenomicSequenceGroup)
 from tigerlily.grc.genome import GRCGenome
 import tigerlily.index.fixedtree as ft
 
@@ -74,6 +79,199 @@ class FixedTreeTests(unittest.TestCase):
         index = ft.FixedTree(self.index_width,self.test_genome)
         self._search_index_subtest(index)
     
+    def test_build_index(self):
+        "fixedtree.py: Test bulk FixedTree.build against incremental creation"
+        for reverse in (False, True):
+            index = ft.FixedTree(self.index_width,self.test_genome,reverse)
+            built = ft.FixedTree.build(self.test_genome,self.index_width,
+                                       reverse)
+            self.assertEqual(built.sequence_name_table,
+                             index.sequence_name_table)
+            for read in self._all_reads():
+                self.assertEqual(built.alignments(read),
+                                 index.alignments(read))
+                self.assertEqual(built.alignments(read,mismatches=1),
+                                 index.alignments(read,mismatches=1))
+
+        built = ft.FixedTree.build(self.test_genome,self.index_width)
+        self._search_index_subtest(built)
+
+    def test_parallel_build(self):
+        "fixedtree.py: Test parallel FixedTree.build against a serial build"
+        genome = PolymerSequenceGroup(self.test_genome.sequences())
+        genome.append(FASTASequence('ACNNGTNACGTTN',identifier='gaps'))
+        serial = ft.FixedTree.build(genome,self.index_width,True)
+        prefix = ft.FixedTree.BUILD_PREFIX_LENGTH
+        try:
+            # Partitions of one base, of several and longer than the width
+            for length in (1, 2, 7):
+                ft.FixedTree.BUILD_PREFIX_LENGTH = length
+                parallel = ft.FixedTree(self.index_width,genome,True,
+                                        workers=2)
+                self.assertEqual(parallel.sequence_name_table,
+                                 serial.sequence_name_table)
+                self.assertEqual(
+                    [(w, n.stored_alignments())
+                     for w, n in ft._stored_windows(parallel.root)],
+                    [(w, n.stored_alignments())
+                     for w, n in ft._stored_windows(serial.root)])
+        finally:
+            ft.FixedTree.BUILD_PREFIX_LENGTH = prefix
+        for read in self._all_reads():
+            self.assertEqual(parallel.alignments(read,mismatches=1),
+                             serial.alignments(read,mismatches=1))
+
+    def test_parallel_build_changes(self):
+        "fixedtree.py: Test adding to and falling back from a parallel build"
+        extra = NucleicSequence('GATTACAGATTACAGATTACA',identifier='extra')
+        serial = ft.FixedTree.build(self.test_genome,self.index_width,True)
+        parallel = ft.FixedTree.build(self.test_genome,self.index_width,True,
+                                      workers=2)
+        serial.add_sequence(extra,True)
+        parallel.add_sequence(extra,True)
+        self.assertEqual(
+            [(w, n.stored_alignments())
+             for w, n in ft._stored_windows(parallel.root)],
+            [(w, n.stored_alignments())
+             for w, n in ft._stored_windows(serial.root)])
+
+        start_methods = ft.multiprocessing.get_all_start_methods
+        ft.multiprocessing.get_all_start_methods = lambda: ['spawn']
+        try:
+            fallback = ft.FixedTree.build(self.test_genome,self.index_width,
+                                          True,workers=2)
+        finally:
+            ft.multiprocessing.get_all_start_methods = start_methods
+        fallback.add_sequence(extra,True)
+        for read in self._all_reads():
+            self.assertEqual(fallback.alignments(read,mismatches=1),
+                             parallel.alignments(read,mismatches=1))
+
+    def test_align_batch(self):
+        "fixedtree.py: Test batched alignment against single alignments"
+        index = ft.FixedTree(self.index_width,self.test_genome,True)
+        reads = self._all_reads()
+        reads = reads[::-1] + reads[:50]
+        for options in ({}, {'mismatches':1}, {'mismatches':2},
+                        {'mismatches':1,'maximum_alignments':3},
+                        {'mismatches':2,'best_alignments':True}):
+            self.assertEqual(index.align_batch(reads,**options),
+                             [index.alignments(r,**options) for r in reads])
+        self.assertEqual(index.align_batch([]),[])
+        self.assertRaises(ValueError,index.align_batch,['ACGTAC'])
+
+    def test_pigeonhole(self):
+        "fixedtree.py: Test pigeonhole mismatch search against exhaustive"
+        index = ft.FixedTree(self.index_width,self.test_genome,True)
+        reads = self._all_reads()
+        for options in ({'mismatches':1}, {'mismatches':2},
+                        {'mismatches':3}, {'mismatches':5},
+                        {'mismatches':2,'maximum_alignments':3},
+                        {'mismatches':2,'best_alignments':True,
+                         'maximum_alignments':2}):
+            for read in reads[::7]:
+                self.assertEqual(
+                    index.alignments(read,strategy='pigeonhole',**options),
+                    index.alignments(read,**options))
+            self.assertEqual(
+                index.align_batch(reads[:60],strategy='pigeonhole',**options),
+                index.align_batch(reads[:60],**options))
+        self.assertEqual(index.seed_table(1)[0],[(0,2),(2,5)])
+        self.assertIsNone(index.seed_table(5))
+        # One table is kept, unless the caller asks for it to be dropped
+        table = index.seed_table(2)
+        self.assertIs(index.seed_table(2),table)
+        self.assertIs(index.seed_table(2,cache=False),table)
+        self.assertIsNot(index.seed_table(2),table)
+
+        # Segments longer than a seed key, and segments with N in them
+        wide = ft.FixedTree(70,PolymerSequenceGroup([FASTASequence(
+            'ACGT'*30 + 'N' + 'GATTACA'*10,identifier='wide')]))
+        for read in ('ACGT'*17 + 'AC', 'CGT'*23 + 'C', 'GT' + 'ACGT'*17,
+                     'ACGT'*12 + 'N' + 'GATTACA'*3):
+            for mismatches in range(4):
+                self.assertEqual(
+                    wide.alignments(read,mismatches,strategy='pigeonhole'),
+                    wide.alignments(read,mismatches))
+
+        # Adding a sequence must not leave stale tables behind
+        index.add_sequence(NucleicSequence('CCCCCC',identifier='new'),False)
+        self.assertEqual(index.alignments('CCCCA',1,strategy='pigeonhole'),
+                         index.alignments('CCCCA',1))
+        self.assertRaises(ValueError,index.alignments,'ACGTA',
+                          strategy='seeded')
+
+    def test_degenerate(self):
+        "fixedtree.py: Test degenerate queries against expanded reads"
+        index = ft.FixedTree(self.index_width,self.test_genome,True)
+        reads = self._all_reads()
+        for query in ('ACGTA', 'NNNNN', 'ARYTN', 'SWKMB', 'DHVNA'):
+            sets = [IUPAC_CODES[code] for code in query]
+            for mismatches in range(3):
+                expected = set()
+                for read in reads:
+                    misses = sum(base not in allowed
+                                 for base, allowed in zip(read, sets))
+                    if misses <= mismatches:
+                        expected.update(index.alignments(read))
+                found = index.degenerate_alignments(query,mismatches)
+                self.assertEqual(len(found),len(expected))
+                self.assertEqual(set(found),expected)
+                self.assertEqual(
+                    index.degenerate_alignments(sets,mismatches),found)
+
+        limited = index.degenerate_alignments('NNNNN',maximum_alignments=4)
+        self.assertEqual(len(limited),4)
+        self.assertRaises(ValueError,index.degenerate_alignments,'ACGT')
+        self.assertRaises(ValueError,index.degenerate_alignments,'ACGTJ')
+
+        # Amino acid queries match whole codons
+        index = ft.FixedTree(6,self.test_genome,True)
+        for peptide in ('LS', 'MK', 'R*', 'XW'):
+            amino = AminoSequence(peptide)
+            for mismatches in range(2):
+                expected = set()
+                for read in itertools.product('ACGT',repeat=6):
+                    read = ''.join(read)
+                    misses = sum(read[i:i+3] not in codons for i, codons in
+                        zip((0,3),amino.back_translations().codon_sets))
+                    if misses <= mismatches:
+                        expected.update(index.alignments(read))
+                found = index.degenerate_alignments(amino,mismatches)
+                self.assertEqual(len(found),len(expected))
+                self.assertEqual(set(found),expected)
+
+    def test_sequence_group(self):
+        "fixedtree.py: Test building from in-memory and stored groups"
+        group = createGenomicSequenceGroup(self.test_genome)
+        group.store('genome.group')
+        stored = PolymerSequenceGroup.load('genome.group')
+        index = ft.FixedTree(self.index_width,self.test_genome,True)
+        for genome in (group, stored):
+            built = ft.FixedTree.build(genome,self.index_width,True)
+            self.assertEqual(built.sequence_name_table,
+                             index.sequence_name_table)
+            for read in self._all_reads():
+                self.assertEqual(built.alignments(read,mismatches=1),
+                                 index.alignments(read,mismatches=1))
+        self.assertEqual(pickle.loads(pickle.dumps(stored)).strings(),
+                         group.strings())
+
+    def test_compact(self):
+        "fixedtree.py: Test the compact copy and memory reports of an index"
+        index = ft.FixedTree(self.index_width,self.test_genome,True)
+        compact = index.compact()
+        for read in self._all_reads():
+            self.assertEqual(compact.alignments(read,mismatches=1),
+                             index.alignments(read,mismatches=1))
+
+        size, per_base = index.memory_usage()
+        compact_size, compact_per_base = compact.memory_usage()
+        self.assertTrue(0 < compact_size < size)
+        self.assertTrue(0 < compact_per_base < per_base)
+
+        self.assertRaises(ValueError,index.root.add_alignment,(1,2**31,True))
+
     def test_store_index(self):
         "fixedtree.py: Test writing FixedTree to disk"
         index = ft.FixedTree(self.index_width,self.test_genome)
@@ -84,6 +282,28 @@ class FixedTreeTests(unittest.TestCase):
         self._search_index_subtest(index)
         self._search_index_subtest(index2)
 
+    def test_load_version1(self):
+        "fixedtree.py: Test loading a FixedTree stored without a version"
+        index = ft.FixedTree(self.index_width,self.test_genome)
+        buffer = bz2.BZ2File('test_v1.idx',mode='w')
+        buffer.write(struct.pack('<II',index.width,
+                                 len(index.sequence_name_table)))
+        for i in sorted(index.sequence_name_table.keys()):
+            ident = index.sequence_name_table[i].encode('utf-8')
+            buffer.write(struct.pack('<I',len(ident)))
+            buffer.write(ident)
+        index.root.store(buffer)
+        buffer.close()
+
+        index2 = ft.FixedTree.load('test_v1.idx')
+        self.assertEqual(index2.width,index.width)
+        self._search_index_subtest(index2)
+
+    def _all_reads(self):
+        "every possible read of the index width"
+        return [''.join(read) for read in
+                itertools.product('ACGT',repeat=self.index_width)]
+
     def _search_index_subtest(self, index):
         "subtest to test the given tree index"
     
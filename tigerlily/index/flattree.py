@@ -0,0 +1,475 @@
+# flattree.py - Flat, memory-mappable layout for FixedTree indexes.
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""A read-only ``FixedTree`` stored as flat arrays instead of node objects.
+
+``FixedTree.load`` has to decompress its whole file and rebuild every node
+before it can answer a query. A ``FlatTree`` holds the same tree as a handful
+of arrays - a node table, a pool of edge label bytes and the alignment arrays -
+which ``FlatTree.load`` maps straight from disk with ``mmap``. Opening an index
+is then nearly instant, queries only touch the pages they walk through, and
+any number of processes can share one copy of the index.
+
+Nodes are numbered breadth-first with the root as node 0, so the children of
+every node are a contiguous run of node numbers. For node *n*:
+
+    child_start[n], child_count[n] - the run of child node numbers
+    label_start[n], label_length[n] - the edge label leading in to *n*, as a
+                                      slice of the label pool
+    alignment_start[n], alignment_count[n] - the run of *n*'s alignments in
+                                      the alignment_id, alignment_position and
+                                      alignment_strand arrays
+
+Children keep the edge order of the ``FixedTree`` they came from, so searches
+report alignments in the same order. Every search of a ``FixedTree`` is
+supported, including both mismatch strategies and degenerate queries.
+"""
+
+import array
+
+from tigerlily.index.index import GroupIndex
+from tigerlily.index.fixedtree import (_finish_alignments,
+    _memory_report, _check_strategy, _degenerate_steps, _seed_bounds,
+    _build_seed_table, _seed_matches)
+from tigerlily.utility.mapped import (store_arrays, load_arrays,
+    pack_strings, unpack_strings)
+
+FLAT_MAGIC = b'TLFT'
+FLAT_VERSION = 1
+
+class FlatTree(GroupIndex):
+    def __init__(self, tree=None):
+        """Create a ``FlatTree`` holding the same index as ``FixedTree`` *tree*.
+
+        The result answers ``alignments()``, ``align_batch()``,
+        ``degenerate_alignments()`` and ``in`` exactly like *tree*, but
+        cannot have sequences added to it. Usually you will want to
+        ``store()`` it and later open it with ``FlatTree.load()``.
+        """
+        self.width = 0
+        self.sequence_name_table = {}
+        self._arrays = [array.array(code) for code in _ARRAY_TYPES]
+        self._arrays[_LABELS] = b''
+        self._seed_table = None
+        self._bind()
+
+        if tree is not None:
+            self.width = tree.width
+            self.sequence_name_table = dict(tree.sequence_name_table)
+            self._arrays = _flatten(tree.root)
+            self._bind()
+
+    def _bind(self):
+        """Cache the individual arrays as attributes for fast access."""
+        (self._child_start, self._child_count, self._label_start,
+         self._label_length, self._alignment_start, self._alignment_count,
+         self._alignment_id, self._alignment_position,
+         self._alignment_strand, self._labels) = self._arrays
+
+    def store(self, filename):
+        """Save the FlatTree to the file named by *filename*.
+
+        If *filename* already exists, EnvironmentError will be raised.
+        """
+        name_ends, names = pack_strings([self.sequence_name_table[i]
+                            for i in sorted(self.sequence_name_table.keys())])
+
+        store_arrays(filename, FLAT_MAGIC, [FLAT_VERSION, self.width],
+                     self._arrays + [name_ends, names])
+
+    @classmethod
+    def load(cls, filename):
+        """Open the FlatTree stored in the named file.
+
+        The file is mapped in to memory rather than read, so this returns
+        almost immediately regardless of the size of the index.
+        """
+        (version, width), arrays = load_arrays(filename, FLAT_MAGIC)
+        if version != FLAT_VERSION:
+            raise ValueError('Unsupported FlatTree version {}'.format(version))
+
+        newtree = FlatTree()
+        newtree.width = width
+
+        names = arrays.pop()
+        name_ends = arrays.pop()
+        for i, name in enumerate(unpack_strings(name_ends, names)):
+            newtree.sequence_name_table[i+1] = name
+
+        newtree._arrays = arrays
+        newtree._bind()
+        return newtree
+
+    def memory_usage(self):
+        """Return ``(bytes, bytes_per_base)`` for the memory used by the index.
+
+        See ``FixedTree.memory_usage``. For a loaded index the arrays are
+        mapped from disk, so this is the size of the mapping rather than
+        private memory.
+        """
+        total = sum(memoryview(data).nbytes for data in self._arrays)
+        return _memory_report(total, len(self._alignment_id))
+
+    def __contains__(self, sequence):
+        """Return true if the sequence is in the index.
+
+        See ``FixedTree.__contains__``.
+        """
+        return len(self.alignments(sequence)) > 0
+
+    def alignments(self, sequence, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+            strategy='exhaustive',
+        ):
+        """Returns a list of all alignments produced by the given input.
+
+        The arguments and results are exactly those of
+        ``FixedTree.alignments``.
+        """
+
+        if self.width != len(sequence):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+        _check_strategy(strategy)
+
+        limit = None if best_alignments else maximum_alignments
+        if strategy == 'pigeonhole' and mismatches:
+            alignments = self._seed_alignments(sequence, mismatches, limit)
+        else:
+            alignments = self._alignments(0, sequence.encode('ascii'), 0,
+                mismatches, mismatches, limit,
+            )
+
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def align_batch(self, reads, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+            strategy='exhaustive',
+        ):
+        """Align every read in *reads* at once, returning a list of results.
+
+        The arguments and results are exactly those of
+        ``FixedTree.align_batch``.
+        """
+        reads = [str(read) for read in reads]
+        for read in reads:
+            if self.width != len(read):
+                raise ValueError('aligned read is not the right width for '
+                                 'this index')
+        _check_strategy(strategy)
+
+        distinct = sorted(set(reads))
+        found = [[] for read in distinct]
+        if strategy == 'pigeonhole' and mismatches:
+            limit = None if best_alignments else maximum_alignments
+            for i, read in enumerate(distinct):
+                found[i] = self._seed_alignments(read, mismatches, limit)
+        elif distinct:
+            self._batch_alignments(0,
+                [read.encode('ascii') for read in distinct],
+                [(i,mismatches) for i in range(len(distinct))],
+                0, mismatches, found,
+                None if best_alignments else maximum_alignments,
+            )
+
+        results = {}
+        for read, alignments in zip(distinct, found):
+            results[read] = _finish_alignments(alignments,
+                self.sequence_name_table, maximum_alignments, best_alignments)
+
+        return [list(results[read]) for read in reads]
+
+    def degenerate_alignments(self, query, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+        ):
+        """Return the alignments of every window compatible with *query*.
+
+        The arguments and results are exactly those of
+        ``FixedTree.degenerate_alignments``.
+        """
+        steps = _degenerate_steps(query)
+        if self.width != len(steps):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+
+        alignments = self._degenerate_alignments(0, steps, 0, None,
+            mismatches, mismatches,
+            None if best_alignments else maximum_alignments,
+        )
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def seed_table(self, mismatches, cache=True):
+        """Return the table used by 'pigeonhole' searches for *mismatches*.
+
+        See ``FixedTree.seed_table``; here *nodes* holds node numbers.
+        """
+        bounds = _seed_bounds(self.width, mismatches)
+        if bounds is None:
+            return None
+        table = self._seed_table
+        if table is None or table[0] != bounds:
+            table = _build_seed_table(self._stored_windows(), bounds)
+        self._seed_table = table if cache else None
+        return table
+
+    def _seed_alignments(self, read, mismatches, maximum_alignments):
+        """Pigeonhole equivalent of ``_alignments``."""
+        table = self.seed_table(mismatches)
+        if table is None:
+            return self._alignments(0, read.encode('ascii'), 0,
+                mismatches, mismatches, maximum_alignments)
+        return _seed_matches(table, read, mismatches, maximum_alignments,
+                             self._stored_alignments)
+
+    def _stored_windows(self):
+        """Generate (window, node) for every node that stores alignments, in
+        the order ``_alignments`` visits them."""
+        labels = self._labels
+        stack = [(0, '')]
+        while stack:
+            node, window = stack.pop()
+            if self._alignment_count[node]:
+                yield window, node
+            first = self._child_start[node]
+            for child in reversed(range(first,
+                                        first+self._child_count[node])):
+                start = self._label_start[child]
+                label = labels[start:start+self._label_length[child]]
+                stack.append((child, window + bytes(label).decode('ascii')))
+
+    def _stored_alignments(self, node):
+        """Return the alignments of *node* as a list of (id, position,
+        strand)."""
+        start = self._alignment_start[node]
+        return [(self._alignment_id[i], self._alignment_position[i],
+                 self._alignment_strand[i] == 1)
+                for i in range(start, start+self._alignment_count[node])]
+
+    def _alignments(self, node, read, depth, original_mismatches,
+                    remaining_mismatches, maximum_alignments):
+        """Walk the flat tree from *node*, which sits *depth* bases in to
+        *read*. This mirrors ``FixedTreeNode.alignments``.
+        """
+        if depth == len(read):
+            start = self._alignment_start[node]
+            found = original_mismatches - remaining_mismatches
+            ids = self._alignment_id
+            positions = self._alignment_position
+            strands = self._alignment_strand
+            return [(found, ids[i], positions[i], strands[i] == 1)
+                    for i in range(start, start+self._alignment_count[node])]
+
+        alignments = []
+        labels = self._labels
+        first = self._child_start[node]
+
+        for child in range(first, first+self._child_count[node]):
+            label_start = self._label_start[child]
+            length = self._label_length[child]
+            label = labels[label_start:label_start+length]
+            segment = read[depth:depth+length]
+
+            if segment == label:
+                hd = 0
+            elif remaining_mismatches > 0:
+                hd = sum(a != b for a,b in zip(segment,label))
+                if hd > remaining_mismatches:
+                    continue
+            else:
+                continue
+
+            alignments += self._alignments(child, read, depth+length,
+                original_mismatches, remaining_mismatches - hd,
+                (maximum_alignments - len(alignments)
+                    if maximum_alignments else None),
+            )
+            # Shortcut exit if maximum_alignments is exceeded
+            if maximum_alignments and len(alignments) > maximum_alignments:
+                return alignments
+
+        return alignments
+
+    def _batch_alignments(self, node, reads, group, depth,
+                          original_mismatches, found, maximum_alignments):
+        """Walk the flat tree from *node* with a group of reads at once.
+        This mirrors ``FixedTreeNode.batch_alignments``: reads with no
+        mismatches left are walked alone and the rest are partitioned by
+        their next base.
+        """
+        if depth == len(reads[group[0][0]]):
+            start = self._alignment_start[node]
+            end = start + self._alignment_count[node]
+            ids = self._alignment_id
+            positions = self._alignment_position
+            strands = self._alignment_strand
+            for index, remaining_mismatches in group:
+                mismatches = original_mismatches - remaining_mismatches
+                found[index] += [(mismatches, ids[i], positions[i],
+                                  strands[i] == 1) for i in range(start, end)]
+            return
+
+        partitions = {}
+        for index, remaining_mismatches in group:
+            read = reads[index]
+            if remaining_mismatches:
+                partitions.setdefault(read[depth], []).append(
+                    (index, remaining_mismatches))
+            else:
+                found[index] += self._alignments(node, read, depth,
+                    original_mismatches, 0, None)
+        if not partitions:
+            return
+
+        labels = self._labels
+        first = self._child_start[node]
+
+        for child in range(first, first+self._child_count[node]):
+            label_start = self._label_start[child]
+            start = depth + 1
+            end = depth + self._label_length[child]
+            label = bytes(labels[label_start:label_start+end-depth])
+            rest = label[1:]
+            distances = {}
+            subgroup = []
+
+            for base, members in partitions.items():
+                cost = 0 if base == label[0] else 1
+                for index, remaining_mismatches in members:
+                    if maximum_alignments and (
+                       len(found[index]) > maximum_alignments):
+                        continue
+
+                    read = reads[index]
+                    if read.startswith(rest, start):
+                        hd = cost
+                    elif remaining_mismatches == cost:
+                        continue
+                    else:
+                        segment = read[start:end]
+                        hd = distances.get(segment)
+                        if hd is None:
+                            hd = distances[segment] = sum(
+                                a != b for a,b in zip(segment,rest))
+                        hd += cost
+                        if hd > remaining_mismatches:
+                            continue
+                    subgroup.append((index, remaining_mismatches - hd))
+
+            if subgroup:
+                self._batch_alignments(child, reads, subgroup, end,
+                    original_mismatches, found, maximum_alignments)
+
+    def _degenerate_alignments(self, node, steps, depth, prefix,
+                               original_mismatches, remaining_mismatches,
+                               maximum_alignments):
+        """Walk the flat tree from *node* with a degenerate query. This
+        mirrors ``FixedTreeNode.degenerate_alignments``.
+        """
+        if depth == len(steps):
+            found = original_mismatches - remaining_mismatches
+            return [(found, id, position, strand) for id, position, strand
+                    in self._stored_alignments(node)]
+
+        alignments = []
+        labels = self._labels
+        first = self._child_start[node]
+
+        for child in range(first, first+self._child_count[node]):
+            label_start = self._label_start[child]
+            label = bytes(labels[label_start:
+                                 label_start+self._label_length[child]])
+            position = depth
+            matched = prefix
+            remaining = remaining_mismatches
+            for base in label.decode('ascii'):
+                allowed, starts_unit = steps[position]
+                if starts_unit:
+                    matched = ''
+                if matched is not None:
+                    matched += base
+                    if matched not in allowed:
+                        # The rest of a mismatched unit may be anything
+                        if not remaining:
+                            break
+                        remaining -= 1
+                        matched = None
+                position += 1
+            else:
+                alignments += self._degenerate_alignments(child, steps,
+                    position, matched, original_mismatches, remaining,
+                    (maximum_alignments - len(alignments)
+                        if maximum_alignments else None),
+                )
+                # Shortcut exit if maximum_alignments is exceeded
+                if maximum_alignments and len(alignments) > maximum_alignments:
+                    return alignments
+
+        return alignments
+
+# The type of each array in FlatTree._arrays, in order. The 'Q' arrays are
+# narrowed to 'I' whenever their values allow it.
+_ARRAY_TYPES = ('Q', 'H', 'Q', 'I', 'Q', 'I', 'I', 'I', 'B', 'B')
+_LABELS = 9
+
+def _flatten(root):
+    """Return the list of FlatTree arrays describing the tree under *root*."""
+    arrays = [array.array(code) for code in _ARRAY_TYPES]
+    (child_start, child_count, label_start, label_length, alignment_start,
+     alignment_count, alignment_id, alignment_position, alignment_strand,
+     labels) = arrays
+    labels = bytearray()
+
+    order = [root]
+    label_start.append(0)
+    label_length.append(0)
+    for node in order:
+        child_start.append(len(order))
+        children = list(node.children())
+        child_count.append(len(children))
+        for child in children:
+            order.append(child)
+            label_start.append(len(labels))
+            label_length.append(len(child.label))
+            labels.extend(child.label.encode('ascii'))
+
+        alignments = node.stored_alignments()
+        alignment_start.append(len(alignment_id))
+        alignment_count.append(len(alignments))
+        for id, position, strand in alignments:
+            alignment_id.append(id)
+            alignment_position.append(position)
+            alignment_strand.append(1 if strand else 0)
+
+    arrays[_LABELS] = bytes(labels)
+
+    # Offsets only need 64 bits for very large trees
+    for i, data in enumerate(arrays):
+        if (isinstance(data, array.array) and data.typecode == 'Q' and
+                (not data or max(data) < 2**32)):
+            arrays[i] = array.array('I', data)
+
+    return arrays
@@ -0,0 +1,130 @@
+# flattree_test.py - unit tests for flattree.py
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This module provides unit tests for the ``tigerlily.index.flattree``
+module.
+
+As with all unit test modules, the tests it contains can be executed in many
+ways, but most easily by going to the project root dir and executing
+``python3 setup.py nosetests``.
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import itertools
+
+from tigerlily.grc.genome import GRCGenome
+import tigerlily.index.fixedtree as ft
+import tigerlily.index.flattree as flat
+
+class FlatTreeTests(unittest.TestCase):
+    """Test harness for ``tigerlily.index.flattree.FlatTree`` class.
+    """
+
+    def setUp(self):
+        """Create the testing environment"""
+        self.test_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.test_dir)
+
+        self.test_genome = GRCGenome.download('test1')
+        self.index_width = 5
+        self.tree = ft.FixedTree(self.index_width,self.test_genome,True)
+
+    def tearDown(self):
+        """Remove the testing environment"""
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_flatten(self):
+        "flattree.py: Test FlatTree created from a FixedTree"
+        self._compare_subtest(flat.FlatTree(self.tree))
+
+    def test_store_load(self):
+        "flattree.py: Test storing and mapping a FlatTree from disk"
+        flat.FlatTree(self.tree).store('test_save.flat')
+        self.assertTrue(os.path.isfile('test_save.flat'))
+        with self.assertRaises(EnvironmentError):
+            flat.FlatTree(self.tree).store('test_save.flat')
+
+        index = flat.FlatTree.load('test_save.flat')
+        self.assertEqual(index.width,self.index_width)
+        self.assertEqual(index.sequence_name_table,
+                         self.tree.sequence_name_table)
+        self._compare_subtest(index)
+
+    def test_align_batch(self):
+        "flattree.py: Test batched alignment against the FixedTree"
+        index = flat.FlatTree(self.tree)
+        reads = [''.join(read) for read in
+                 itertools.product('ACGT',repeat=self.index_width)]
+        for options in ({}, {'mismatches':2},
+                        {'mismatches':1,'maximum_alignments':2}):
+            self.assertEqual(index.align_batch(reads,**options),
+                             self.tree.align_batch(reads,**options))
+
+    def test_strategies(self):
+        "flattree.py: Test pigeonhole and degenerate searches"
+        index = flat.FlatTree(self.tree)
+        reads = [''.join(read) for read in
+                 itertools.product('ACGT',repeat=self.index_width)]
+        for options in ({'mismatches':1}, {'mismatches':2},
+                        {'mismatches':2,'maximum_alignments':2}):
+            for read in reads[::5]:
+                self.assertEqual(
+                    index.alignments(read,strategy='pigeonhole',**options),
+                    self.tree.alignments(read,**options))
+            self.assertEqual(
+                index.align_batch(reads[:40],strategy='pigeonhole',**options),
+                self.tree.align_batch(reads[:40],**options))
+        self.assertRaises(ValueError,index.alignments,'ACGTA',
+                          strategy='seeded')
+
+        for query in ('ACGTA', 'NNNNN', 'ARYTN', 'SWKMB'):
+            for mismatches in range(3):
+                self.assertEqual(
+                    index.degenerate_alignments(query,mismatches),
+                    self.tree.degenerate_alignments(query,mismatches))
+        self.assertEqual(index.degenerate_alignments('NNNNN',
+                                                     maximum_alignments=3),
+                         self.tree.degenerate_alignments('NNNNN',
+                                                     maximum_alignments=3))
+
+    def test_wrong_width(self):
+        "flattree.py: Test that reads of the wrong width are rejected"
+        with self.assertRaises(ValueError):
+            flat.FlatTree(self.tree).alignments('ACGT')
+
+    def _compare_subtest(self, index):
+        "subtest checking that index answers exactly like self.tree"
+        self.assertTrue('GGGGG' not in index)
+        self.assertTrue('AAAAA' in index)
+        for read in itertools.product('ACGT',repeat=self.index_width):
+            read = ''.join(read)
+            for mismatches in (0,1,2):
+                self.assertEqual(index.alignments(read,mismatches=mismatches),
+                        self.tree.alignments(read,mismatches=mismatches))
+            self.assertEqual(
+                index.alignments(read,mismatches=1,best_alignments=True),
+                self.tree.alignments(read,mismatches=1,best_alignments=True))
@@ -0,0 +1,526 @@
+# fmindex.py - FM-index (compressed suffix array) for nucleic sequences.
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""An FM-index supporting alignment of reads of any length.
+
+A tree of every window of a genome grows with the genome times the window
+width. An FM-index instead keeps the Burrows-Wheeler transform (BWT) of the
+whole genome plus a little bookkeeping:
+
+    * the BWT itself, packed 4 bases to a byte as in
+      ``tigerlily.sequences.packed``. Runs of any other symbol (N, or the
+      ``$`` separators) are kept in a separate table of (start, end, symbol)
+      runs, with code 0 in their place;
+    * occurrence checkpoints: the number of times each symbol appears in the
+      BWT before every ``checkpoint``-th row, so the rank of a symbol at any
+      row is a checkpoint plus a count over a few packed bytes;
+    * a sampled suffix array: the text position of every row whose position
+      is a multiple of ``sample_rate`` (and of every row starting a sequence),
+      with a bit vector marking which rows are sampled.
+
+Every sequence is followed by a ``$`` separator. Reads are found by backward
+search, which needs no fixed read width, and mismatches are found by
+backtracking over the symbols of the genome. Everything is stored in flat
+arrays which can be written with ``store()`` and memory-mapped by ``load()``.
+
+>>> from tigerlily.sequences import NucleicSequence
+>>> class Genome:
+...     def sequences(self):
+...         yield NucleicSequence('GATTACAGATTACA', identifier='chr1')
+...         yield NucleicSequence('CCTACAGG', identifier='chr2')
+>>> index = FMIndex(Genome())
+>>> index.alignments('TACA')
+[('chr1', 3, True), ('chr1', 10, True), ('chr2', 2, True)]
+>>> index.alignments('GATTAG', mismatches=1)
+[('chr1', 0, True), ('chr1', 7, True)]
+>>> 'ACAGA' in index
+True
+"""
+
+import array
+import re
+from bisect import bisect_right
+
+from tigerlily.index.index import GroupIndex
+from tigerlily.index.fixedtree import _finish_alignments, _memory_report
+from tigerlily.sequences import reverse_complement
+from tigerlily.sequences.packed import _pack, _unpack
+from tigerlily.utility.mapped import (store_arrays, load_arrays,
+    pack_strings, unpack_strings)
+
+FM_MAGIC = b'TLFM'
+# Version 2 packs the BWT in to 2-bit codes.
+FM_VERSION = 2
+
+SEPARATOR = ord('$')
+
+# Marked rows are ranked in blocks of this many bits.
+_RANK_BLOCK = 512
+
+# The 2-bit code of each BWT byte. Anything but A, C, G and T gets code 0 and
+# an entry in the run table.
+_BWT_CODES = bytes(b'ACGT'.find(bytes([c])) if c in b'ACGT' else 0
+                   for c in range(256))
+_BASE_CODES = {byte: code for code, byte in enumerate(b'ACGT')}
+_RUNS = re.compile(rb'([^ACGT])\1*')
+
+# The number of BWT bases packed at a time while building.
+_PACK_BLOCK = 2**16
+
+# Suffixes are sorted in buckets sharing a prefix long enough that a bucket
+# of a uniformly random genome holds about this many suffixes...
+_BUCKET_SIZE = 2**16
+# ...and within a bucket, first by this many bytes each.
+_SORT_PREFIX = 32
+
+class FMIndex(GroupIndex):
+    def __init__(self, genome=None, reverse=False, sample_rate=32,
+                 checkpoint=128):
+        """Create an FM-index of every sequence in *genome*.
+
+        *genome* may be anything with a ``sequences()`` method. If *reverse*
+        is True, reads are also aligned against the opposing strand, and are
+        reported as ``FixedTree`` would report them.
+
+        *sample_rate* and *checkpoint* trade memory for speed: one suffix array
+        entry is kept per *sample_rate* bases, and one count per symbol per
+        *checkpoint* bases. Smaller values make locating and counting faster.
+
+        You may also create an ``FMIndex`` with ``FMIndex.load()``.
+        """
+        self.reverse = reverse
+        self.sample_rate = sample_rate
+        self.checkpoint = checkpoint
+        self.sequence_name_table = {}
+
+        self._length = 0
+        self._bwt = b''
+        self._run_starts = array.array('Q')
+        self._run_ends = array.array('Q')
+        self._run_symbols = b''
+        self._symbols = b''
+        self._counts = array.array('Q')
+        self._occurrences = array.array('Q')
+        self._marks = b''
+        self._mark_ranks = array.array('Q', [0])
+        self._samples = array.array('Q')
+        self._starts = array.array('Q')
+
+        if genome:
+            self._build(genome)
+
+    def _build(self, genome):
+        """Construct the index arrays for every sequence in *genome*."""
+        text = bytearray()
+        names = []
+        for sequence in genome.sequences():
+            self._starts.append(len(text))
+            names.append(sequence.identifier)
+            text += _sequence_bytes(sequence)
+            text.append(SEPARATOR)
+        for i, name in enumerate(names):
+            self.sequence_name_table[i+1] = name
+        text = bytes(text)
+        n = len(text)
+        self._length = n
+
+        suffixes = _suffix_array(text)
+
+        self._symbols = bytes(sorted(set(text)))
+        total = 0
+        for symbol in self._symbols:
+            self._counts.append(total)
+            total += text.count(symbol)
+
+        # The BWT is generated, counted, scanned for runs and packed one
+        # checkpoint at a time, so it is never held unpacked.
+        step = self.checkpoint
+        occurrences = [array.array('Q') for symbol in self._symbols]
+        running = [0] * len(self._symbols)
+        packed = bytearray()
+        codes = bytearray()
+        run_starts, run_ends = self._run_starts, self._run_ends
+        run_symbols = bytearray()
+        marks = bytearray((n+7) // 8)
+        samples = self._samples
+        for start in range(0, n+1, step):
+            rows = suffixes[start:start+step]
+            block = bytes(text[p-1] for p in rows)
+            for i, symbol in enumerate(self._symbols):
+                occurrences[i].append(running[i])
+                running[i] += block.count(symbol)
+
+            for run in _RUNS.finditer(block):
+                symbol = block[run.start()]
+                if (run_ends and run_ends[-1] == run.start() + start
+                    and run_symbols[-1] == symbol):
+                    run_ends[-1] = run.end() + start
+                else:
+                    run_starts.append(run.start() + start)
+                    run_ends.append(run.end() + start)
+                    run_symbols.append(symbol)
+
+            codes += block.translate(_BWT_CODES)
+            if len(codes) >= _PACK_BLOCK:
+                size = len(codes) // 4 * 4
+                packed += _pack(bytes(codes[:size]))
+                del codes[:size]
+
+            for row, position in enumerate(rows, start):
+                if (position % self.sample_rate == 0
+                    or text[position-1] == SEPARATOR):
+                    marks[row >> 3] |= 1 << (row & 7)
+                    samples.append(position)
+        packed += _pack(bytes(codes))
+        del suffixes
+
+        for found in occurrences:
+            self._occurrences.extend(found)
+        self._run_symbols = bytes(run_symbols)
+
+        ranks = self._mark_ranks
+        ranks.pop()
+        running = 0
+        for start in range(0, len(marks)+1, _RANK_BLOCK // 8):
+            ranks.append(running)
+            running += _popcount(marks[start:start + _RANK_BLOCK//8])
+
+        self._bwt = bytes(packed)
+        self._marks = bytes(marks)
+
+        # Offsets only need 64 bits for very large genomes
+        if n < 2**32:
+            for name in ('_counts', '_occurrences', '_mark_ranks',
+                         '_samples', '_starts', '_run_starts', '_run_ends'):
+                setattr(self, name, array.array('I', getattr(self, name)))
+
+    def store(self, filename):
+        """Save the FMIndex to the file named by *filename*.
+
+        If *filename* already exists, EnvironmentError will be raised.
+        """
+        name_ends, names = pack_strings([self.sequence_name_table[i]
+                            for i in sorted(self.sequence_name_table.keys())])
+        store_arrays(filename, FM_MAGIC,
+                     [FM_VERSION, int(self.reverse), self.sample_rate,
+                      self.checkpoint, self._length],
+                     [self._bwt, self._run_starts, self._run_ends,
+                      self._run_symbols, self._symbols, self._counts,
+                      self._occurrences, self._marks, self._mark_ranks,
+                      self._samples, self._starts, name_ends, names])
+
+    @classmethod
+    def load(cls, filename):
+        """Open the FMIndex stored in the named file.
+
+        As with ``FlatTree.load``, the arrays are memory-mapped, not read.
+        """
+        header, arrays = load_arrays(filename, FM_MAGIC)
+        version = header[0]
+        if version != FM_VERSION:
+            raise ValueError('Unsupported FMIndex version {}'.format(version))
+        reverse, sample_rate, checkpoint, length = header[1:]
+
+        newindex = FMIndex(reverse=bool(reverse), sample_rate=sample_rate,
+                           checkpoint=checkpoint)
+        newindex._length = length
+        (newindex._bwt, newindex._run_starts, newindex._run_ends,
+         newindex._run_symbols, symbols, newindex._counts,
+         newindex._occurrences, newindex._marks, newindex._mark_ranks,
+         newindex._samples, newindex._starts) = arrays[:11]
+        newindex._symbols = bytes(symbols)
+        for i, name in enumerate(unpack_strings(*arrays[11:])):
+            newindex.sequence_name_table[i+1] = name
+        return newindex
+
+    def memory_usage(self):
+        """Return ``(bytes, bytes_per_base)`` for the memory used by the index.
+
+        See ``FixedTree.memory_usage``. Here the bases are those of the
+        genome, plus one separator per sequence.
+        """
+        total = sum(memoryview(data).nbytes for data in (self._bwt,
+                    self._run_starts, self._run_ends, self._run_symbols,
+                    self._counts, self._occurrences, self._marks,
+                    self._mark_ranks, self._samples, self._starts))
+        return _memory_report(total, self._length)
+
+    def __contains__(self, sequence):
+        """Return true if the sequence is in the index.
+
+        See ``FixedTree.__contains__``.
+        """
+        top, bottom = self._search(sequence.encode('ascii'))
+        if top < bottom:
+            return True
+        if self.reverse:
+            top, bottom = self._search(
+                    reverse_complement(sequence).encode('ascii'))
+            return top < bottom
+        return False
+
+    def alignments(self, sequence, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+        ):
+        """Returns a list of all alignments produced by the given input.
+
+        The arguments and results are those of ``FixedTree.alignments``, but
+        *sequence* may be of any length. Alignments never span two sequences
+        of the genome.
+        """
+        strands = [(sequence, True)]
+        if self.reverse:
+            strands.append((reverse_complement(sequence), False))
+
+        ranges = []
+        for read, strand in strands:
+            read = read.encode('ascii')
+            for distance, top, bottom in self._approximate(read, mismatches):
+                ranges.append((distance, top, bottom, strand))
+        ranges.sort(key=lambda found: found[0])
+
+        limit = None if best_alignments else maximum_alignments
+        alignments = []
+        for distance, top, bottom, strand in ranges:
+            for row in range(top, bottom):
+                id, position = self._position(self._locate(row))
+                alignments.append((distance, id, position, strand))
+            if limit and len(alignments) > limit:
+                break
+
+        alignments.sort(key=lambda v: (v[0], v[1], v[2], not v[3]))
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def align_batch(self, reads, mismatches=0, **kwargs):
+        """Align every read in *reads*, returning a list of results.
+
+        See ``FixedTree.align_batch``. Identical reads are only searched once.
+        """
+        reads = [str(read) for read in reads]
+        results = {}
+        for read in reads:
+            if read not in results:
+                results[read] = self.alignments(read, mismatches, **kwargs)
+        return [list(results[read]) for read in reads]
+
+    def _occurrence(self, symbol, row):
+        """Return the number of times *symbol* appears in the BWT before
+        *row*. *symbol* is an index in to the alphabet."""
+        step = self.checkpoint
+        block = row // step
+        start = block * step
+        found = self._occurrences[symbol * (self._length//step + 1) + block]
+        if start == row:
+            return found
+        byte = self._symbols[symbol]
+        code = _BASE_CODES.get(byte)
+        if code is None:
+            return found + self._run_count(start, row, byte)
+        found += _unpack(self._bwt, start, row).count(code)
+        if code == 0:
+            # Rows in runs hold code 0 too
+            found -= self._run_count(start, row)
+        return found
+
+    def _run_count(self, start, end, byte=None):
+        """Return the number of rows from *start* to *end* that are in runs
+        (of *byte*, if it is given)."""
+        starts, ends, symbols = (self._run_starts, self._run_ends,
+                                 self._run_symbols)
+        total = 0
+        i = bisect_right(ends, start)
+        while i < len(starts) and starts[i] < end:
+            if byte is None or symbols[i] == byte:
+                total += min(ends[i], end) - max(starts[i], start)
+            i += 1
+        return total
+
+    def _bwt_byte(self, row):
+        """Return the byte of the BWT in *row*."""
+        i = bisect_right(self._run_ends, row)
+        if i < len(self._run_starts) and self._run_starts[i] <= row:
+            return self._run_symbols[i]
+        return b'ACGT'[_unpack(self._bwt, row, row+1)[0]]
+
+    def _search(self, read):
+        """Backward search for *read*, returning its range of rows."""
+        top, bottom = 0, self._length
+        symbols = self._symbols
+        for byte in reversed(read):
+            symbol = symbols.find(bytes([byte]))
+            if symbol == -1 or byte == SEPARATOR:
+                return 0, 0
+            top = self._counts[symbol] + self._occurrence(symbol, top)
+            bottom = self._counts[symbol] + self._occurrence(symbol, bottom)
+            if top >= bottom:
+                return 0, 0
+        return top, bottom
+
+    def _approximate(self, read, mismatches):
+        """Backtracking search allowing up to *mismatches* substitutions.
+
+        Generates (distance, top, bottom) for every distinct reference string
+        within *mismatches* of *read*. Each is a disjoint range of rows.
+        """
+        symbols = [(i, byte) for i, byte in enumerate(self._symbols)
+                   if byte != SEPARATOR]
+        stack = [(len(read), 0, self._length, 0)]
+        while stack:
+            depth, top, bottom, distance = stack.pop()
+            if depth == 0:
+                yield distance, top, bottom
+                continue
+            wanted = read[depth-1]
+            for symbol, byte in symbols:
+                cost = distance + (byte != wanted)
+                if cost > mismatches:
+                    continue
+                new_top = self._counts[symbol] + self._occurrence(symbol, top)
+                new_bottom = (self._counts[symbol] +
+                              self._occurrence(symbol, bottom))
+                if new_top < new_bottom:
+                    stack.append((depth-1, new_top, new_bottom, cost))
+
+    def _locate(self, row):
+        """Return the text position of the suffix in *row*."""
+        steps = 0
+        marks = self._marks
+        while not marks[row >> 3] & (1 << (row & 7)):
+            byte = self._bwt_byte(row)
+            symbol = self._symbols.find(bytes([byte]))
+            row = self._counts[symbol] + self._occurrence(symbol, row)
+            steps += 1
+        return self._samples[self._mark_rank(row)] + steps
+
+    def _mark_rank(self, row):
+        """Return the number of marked rows before *row*."""
+        bytes_per_block = _RANK_BLOCK // 8
+        block = row // _RANK_BLOCK
+        start = block * bytes_per_block
+        found = self._mark_ranks[block] + _popcount(
+                                        self._marks[start:row >> 3])
+        partial = self._marks[row >> 3] & ((1 << (row & 7)) - 1)
+        return found + _popcount(bytes([partial]))
+
+    def _position(self, offset):
+        """Convert a text offset in to (sequence id, position)."""
+        i = bisect_right(self._starts, offset) - 1
+        return i+1, offset - self._starts[i]
+
+
+def _sequence_bytes(sequence):
+    """Return the bases of *sequence* as ASCII bytes, using the undecoded
+    ``data`` of a ``BinaryFASTASequence`` when there is one."""
+    data = getattr(sequence, 'data', None)
+    if data is not None:
+        return data
+    return sequence.sequence.encode('ascii')
+
+def _popcount(data):
+    """Return the number of set bits in the bytes-like *data*."""
+    return bin(int.from_bytes(bytes(data), 'little')).count('1')
+
+def _suffix_array(text):
+    """Return the suffix array of the bytes *text* as an ``array``.
+
+    Suffixes are sorted one bucket at a time, each bucket holding those that
+    share their first few bytes, by their first ``_SORT_PREFIX`` bytes. Only
+    one bucket's sort keys exist at once. Suffixes still tied after that (in
+    repeats) are separated by prefix doubling: each round sorts a tied group
+    by the rank of the suffix *h* bytes further on, doubling *h*. Positions
+    and ranks are kept in compact arrays rather than lists.
+    """
+    n = len(text)
+    typecode = 'I' if n < 2**32 else 'Q'
+    order = array.array(typecode)
+    if n == 0:
+        return order
+
+    length = 1
+    symbols = len(set(text))
+    while symbols ** length * _BUCKET_SIZE < n and length < _SORT_PREFIX:
+        length += 1
+    buckets = {}
+    for position in range(n):
+        key = text[position:position+length]
+        if key not in buckets:
+            buckets[key] = array.array(typecode)
+        buckets[key].append(position)
+
+    group_starts = array.array(typecode)
+    group_ends = array.array(typecode)
+    for key in sorted(buckets):
+        bucket = sorted(buckets.pop(key),
+                        key=lambda p: text[p:p+_SORT_PREFIX])
+        _tied_groups(bucket, len(order), group_starts, group_ends,
+                     lambda p: text[p:p+_SORT_PREFIX], _SORT_PREFIX)
+        order.extend(bucket)
+
+    # The rank of each suffix is the first row of its group
+    rank = array.array(typecode, bytes(order.itemsize * n))
+    for row, position in enumerate(order):
+        rank[position] = row
+    for start, end in zip(group_starts, group_ends):
+        for row in range(start, end):
+            rank[order[row]] = start
+
+    h = _SORT_PREFIX
+    while group_starts:
+        starts = array.array(typecode)
+        ends = array.array(typecode)
+        moved = array.array(typecode)
+        moved_ranks = array.array(typecode)
+        for start, end in zip(group_starts, group_ends):
+            keyed = sorted((rank[p+h] if p+h < n else -1, p)
+                           for p in order[start:end])
+            first, previous = start, None
+            for row, (key, position) in enumerate(keyed, start):
+                if key != previous:
+                    if row - first > 1:
+                        starts.append(first)
+                        ends.append(row)
+                    first, previous = row, key
+                order[row] = position
+                moved.append(position)
+                moved_ranks.append(first)
+            if end - first > 1:
+                starts.append(first)
+                ends.append(end)
+        # Ranks change only once the round is over, as they are its keys
+        for position, new_rank in zip(moved, moved_ranks):
+            rank[position] = new_rank
+        group_starts, group_ends = starts, ends
+        h *= 2
+    return order
+
+def _tied_groups(members, offset, starts, ends, key, length):
+    """Append to *starts* and *ends* the rows (from *offset*) of each run of
+    the sorted *members* whose *key* is the same and *length* long."""
+    first = 0
+    for i in range(1, len(members)+1):
+        if i == len(members) or key(members[i]) != key(members[first]):
+            if i - first > 1 and len(key(members[first])) == length:
+                starts.append(offset+first)
+                ends.append(offset+i)
+            first = i
@@ -0,0 +1,116 @@
+# fmindex_test.py - unit tests for fmindex.py
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This module provides unit tests for the ``tigerlily.index.fmindex``
+module.
+
+As with all unit test modules, the tests it contains can be executed in many
+ways, but most easily by going to the project root dir and executing
+``python3 setup.py nosetests``.
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import itertools
+
+from tigerlily.sequences import NucleicSequence, FASTASequence
+from tigerlily.grc.genome import GRCGenome
+import tigerlily.index.fixedtree as ft
+import tigerlily.index.fmindex as fm
+
+class FMIndexTests(unittest.TestCase):
+    """Test harness for ``tigerlily.index.fmindex.FMIndex`` class.
+    """
+
+    def setUp(self):
+        """Create the testing environment"""
+        self.test_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.test_dir)
+
+        self.test_genome = GRCGenome.download('test1')
+        self.index_width = 5
+
+    def tearDown(self):
+        """Remove the testing environment"""
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_against_fixedtree(self):
+        "fmindex.py: Test FMIndex alignments against a FixedTree"
+        for reverse in (False, True):
+            tree = ft.FixedTree(self.index_width,self.test_genome,reverse)
+            index = fm.FMIndex(self.test_genome,reverse,sample_rate=4,
+                               checkpoint=16)
+            self._compare_subtest(index, tree)
+
+    def test_store_load(self):
+        "fmindex.py: Test storing and mapping an FMIndex from disk"
+        tree = ft.FixedTree(self.index_width,self.test_genome,True)
+        fm.FMIndex(self.test_genome,True).store('f.idx')
+        with self.assertRaises(EnvironmentError):
+            fm.FMIndex().store('f.idx')
+        index = fm.FMIndex.load('f.idx')
+        self.assertEqual(index.sequence_name_table,tree.sequence_name_table)
+        self._compare_subtest(index, tree)
+
+    def test_read_lengths(self):
+        "fmindex.py: Test reads of any length against a brute force search"
+        class Genome:
+            def sequences(self):
+                yield NucleicSequence('GATTACAGATTACACCAGT',identifier='a')
+                yield FASTASequence('TTANCAGATTA',identifier='b')
+        sequences = {'a':'GATTACAGATTACACCAGT', 'b':'TTANCAGATTA'}
+        index = fm.FMIndex(Genome(),sample_rate=3,checkpoint=4)
+        for read in ('G','ATTA','CAGATTAC','GATTACAGATTACACCAGT','TTANC',
+                     'GATTACAGATTACACCAGTT','CCCCCCC'):
+            for mismatches in (0,1,2):
+                expected = sorted(
+                    (name, i, True) for name, seq in sequences.items()
+                    for i in range(len(seq)-len(read)+1)
+                    if sum(a != b for a,b in zip(read,seq[i:])) <= mismatches)
+                self.assertEqual(sorted(index.alignments(read,mismatches)),
+                                 expected)
+        self.assertFalse('A$G' in index)
+        self.assertFalse('AXG' in index)
+
+    def _compare_subtest(self, index, tree):
+        "subtest checking that index finds the same alignments as tree"
+        reads = [''.join(read) for read in
+                 itertools.product('ACGT',repeat=self.index_width)]
+        for read in reads:
+            self.assertEqual(read in index, read in tree)
+            for mismatches in (0,1,2):
+                self.assertEqual(
+                    sorted(index.alignments(read,mismatches=mismatches)),
+                    sorted(tree.alignments(read,mismatches=mismatches)))
+            best = index.alignments(read,mismatches=2,best_alignments=True,
+                                    maximum_alignments=3)
+            self.assertEqual(len(best),
+                             len(tree.alignments(read,mismatches=2,
+                                                 best_alignments=True,
+                                                 maximum_alignments=3)))
+        self.assertEqual(index.align_batch(reads[:40],mismatches=1),
+                         [index.alignments(r,mismatches=1)
+                          for r in reads[:40]])
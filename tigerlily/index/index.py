@@ -32,15 +32,16 @@ class GroupIndex(metaclass=abc.ABCMeta):
         """Initialize a genomic index.
 
         No type checking should be performed on sequence_group by the
-        implementing subclass, but in general you want sequence_group to be
-        at *least* a tigerlily.sequences.PolymerSequenceGroup object. In
-        practical terms you will actually probably want to use GenomicSequence
-        sequences, in a MixedSequenceGroup sequence group.
+        implementing subclass, beyond requiring a ``sequences()`` method. In
+        general you want sequence_group to be a
+        tigerlily.sequences.PolymerSequenceGroup object (or a GRCGenome, which
+        is read again each time its sequences are generated).
 
         A helper method exists called 
             tigerlily.sequences.createGenomicSequenceGroup()
-        which will convert any SequenceGroup in to a MixedSequenceGroup with
-        only GenomicSequence objects. This is suitable for creating an index.
+        which will gather any sequences in to a PolymerSequenceGroup, checking
+        that they are all nucleic sequences. This is suitable for creating an
+        index.
 
         As with all implementing subclasses, each subclass may add additional
         required or optional arguments to this method.
@@ -0,0 +1,490 @@
+# kmer.py - 2-bit packed k-mer hash index for nucleic sequences.
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""A fixed-width index that maps packed k-mers to their positions.
+
+Each window of *width* bases (up to 32) is encoded as an integer with 2 bits
+per base (A=0, C=1, G=2, T=3). The index keeps the distinct codes in one sorted
+array and, CSR-style, an offsets array pointing in to a third array holding the
+packed alignments of every window. An exact lookup is then a binary search
+instead of a walk down a tree, and the three arrays can be stored and
+memory-mapped like a ``FlatTree``.
+
+Windows containing anything other than uppercase A, C, G or T (such as N) can
+not be encoded and are not indexed. Unlike a ``FixedTree``, ``FlatTree`` or
+``FMIndex``, a ``KmerIndex`` therefore never reports alignments to them, even
+for reads that would match them within the mismatches allowed.
+
+>>> from tigerlily.sequences import NucleicSequence
+>>> class Genome:
+...     def sequences(self):
+...         yield NucleicSequence('GATTACAGATTACA', identifier='chr1')
+>>> index = KmerIndex(4, Genome())
+>>> index.alignments('TACA')
+[('chr1', 3, True), ('chr1', 10, True)]
+>>> index.alignments('TACT', mismatches=1)
+[('chr1', 3, True), ('chr1', 10, True)]
+>>> 'CCCC' in index
+False
+"""
+
+import array
+import heapq
+import itertools
+import operator
+import re
+import sys
+from bisect import bisect_left
+
+from tigerlily.index.index import GroupIndex
+from tigerlily.index.fixedtree import (_finish_alignments, _memory_report,
+    _POSITION_MASK)
+from tigerlily.index.fmindex import _sequence_bytes
+from tigerlily.utility.mapped import (store_arrays, load_arrays,
+    pack_strings, unpack_strings)
+
+KMER_MAGIC = b'TLKM'
+KMER_VERSION = 1
+
+# Maps each byte to its 2-bit code, or 4 if it can not be encoded.
+_CODES = bytes(b'ACGT'.find(bytes([c])) if c in b'ACGT' else 4
+               for c in range(256))
+
+# Complements 2-bit codes, leaving 4 alone
+_COMPLEMENT_CODES = bytes.maketrans(b'\x00\x01\x02\x03', b'\x03\x02\x01\x00')
+
+# Replaces 4 with 0, so that codes can be combined without carrying
+_LOW_BITS = bytes(c if c < 4 else 0 for c in range(256))
+
+# Runs of bases that can not be encoded
+_UNENCODABLE = re.compile(b'\x04+')
+
+# The most windows whose codes are computed at once
+WINDOW_CHUNK = 1 << 20
+
+# The most windows sorted at once while building an index
+SORT_BLOCK = 1 << 20
+
+class KmerIndex(GroupIndex):
+    def __init__(self, width, genome=None, reverse=False):
+        """``KmerIndex`` objects support alignment of fixed-width reads.
+
+        *width*, *genome* and *reverse* have the same meaning as for
+        ``tigerlily.index.fixedtree.FixedTree``, except that *width* may be at
+        most 32 and all of *genome* must be given up front: sequences can not
+        be added later.
+
+        You may also create a ``KmerIndex`` with ``KmerIndex.load()``.
+        """
+        if not 0 < width <= 32:
+            raise ValueError('KmerIndex width must be between 1 and 32')
+
+        self.width = width
+        self.sequence_name_table = {}
+        self._keys = array.array('Q')
+        self._starts = array.array('Q', [0])
+        self._values = array.array('Q')
+
+        if genome:
+            self._build(genome, reverse)
+
+    def _build(self, genome, reverse):
+        """Index every window of every sequence in *genome*.
+
+        The code and packed alignment of every window are gathered in two
+        ``array('Q')``, in the order ``FixedTree`` would store them. Blocks of
+        at most ``SORT_BLOCK`` windows are sorted by code (keeping that order
+        within each code), so that only one block's sort keys are ever held as
+        Python objects, and the blocks are then merged in to the CSR arrays.
+        """
+        blocks = []
+        codes = array.array('Q')
+        values = array.array('Q')
+        for sequence in genome.sequences():
+            id = self._get_id(sequence.identifier)
+            sequence_codes, sequence_values = _window_keys(
+                _sequence_codes(sequence), id, self.width, reverse)
+            codes += sequence_codes
+            values += sequence_values
+            del sequence_codes, sequence_values
+
+            first = 0
+            while len(codes) - first >= SORT_BLOCK:
+                blocks.append(_sort_block(codes, values, first,
+                                          first + SORT_BLOCK))
+                first += SORT_BLOCK
+            del codes[:first], values[:first]
+        if codes:
+            blocks.append(_sort_block(codes, values, 0, len(codes)))
+        del codes, values
+
+        # heapq.merge takes equal codes from earlier blocks first
+        windows = heapq.merge(*(zip(*block) for block in blocks),
+                              key=operator.itemgetter(0))
+        keys = self._keys
+        starts = self._starts
+        self._values = values = array.array('Q')
+        previous = None
+        for i, (code, value) in enumerate(windows):
+            if code != previous:
+                if previous is not None:
+                    starts.append(i)
+                keys.append(code)
+                previous = code
+            values.append(value)
+        if previous is not None:
+            starts.append(len(values))
+
+    def _get_id(self,identifier):
+        """Assign a unique integer to this identifier, to be shared amongst
+        all members claiming the same identifier."""
+        tab = self.sequence_name_table
+        val = 0
+        for val in tab:
+            if identifier == tab[val]:
+                return val
+        tab[val+1] = identifier
+        return val+1
+
+    def store(self, filename):
+        """Save the KmerIndex to the file named by *filename*.
+
+        If *filename* already exists, EnvironmentError will be raised.
+        """
+        name_ends, names = pack_strings([self.sequence_name_table[i]
+                            for i in sorted(self.sequence_name_table.keys())])
+        store_arrays(filename, KMER_MAGIC, [KMER_VERSION, self.width],
+                     [self._keys, self._starts, self._values,
+                      name_ends, names])
+
+    @classmethod
+    def load(cls, filename):
+        """Open the KmerIndex stored in the named file.
+
+        As with ``FlatTree.load``, the arrays are memory-mapped, not read.
+        """
+        (version, width), arrays = load_arrays(filename, KMER_MAGIC)
+        if version != KMER_VERSION:
+            raise ValueError('Unsupported KmerIndex version {}'.format(version))
+
+        newindex = KmerIndex(width)
+        newindex._keys, newindex._starts, newindex._values = arrays[:3]
+        for i, name in enumerate(unpack_strings(*arrays[3:])):
+            newindex.sequence_name_table[i+1] = name
+        return newindex
+
+    def memory_usage(self):
+        """Return ``(bytes, bytes_per_base)`` for the memory used by the index.
+
+        See ``FixedTree.memory_usage``.
+        """
+        total = sum(memoryview(data).nbytes
+                    for data in (self._keys, self._starts, self._values))
+        return _memory_report(total, len(self._values))
+
+    def __contains__(self, sequence):
+        """Return true if the sequence is in the index.
+
+        See ``FixedTree.__contains__``.
+        """
+        if self.width != len(sequence):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+        code = _encode(sequence)
+        return code is not None and self._lookup(code) is not None
+
+    def alignments(self, sequence, mismatches=0,
+            maximum_alignments=None,
+            best_alignments=False,
+        ):
+        """Returns a list of all alignments produced by the given input.
+
+        The arguments and results are those of ``FixedTree.alignments``.
+        Mismatches are found by splitting the read in to mismatches+1
+        segments, one of which must match exactly (see ``_seed_codes``), and
+        the codes found are reported closest first. This is best suited to
+        small numbers of mismatches. Windows that were not indexed (see the
+        module documentation) are never reported.
+        """
+        if self.width != len(sequence):
+            raise ValueError('aligned read is not the right width for this '
+                             'index')
+
+        limit = None if best_alignments else maximum_alignments
+        alignments = []
+        for distance, code in self._seed_codes(sequence, mismatches):
+            found = self._lookup(code)
+            if found is None:
+                continue
+            alignments += [(distance, v >> 32, (v >> 1) & _POSITION_MASK,
+                            v & 1 == 1) for v in found]
+            if limit and len(alignments) > limit:
+                break
+
+        return _finish_alignments(alignments, self.sequence_name_table,
+                                  maximum_alignments, best_alignments)
+
+    def align_batch(self, reads, mismatches=0, **kwargs):
+        """Align every read in *reads*, returning a list of results.
+
+        See ``FixedTree.align_batch``. Identical reads are only looked up once.
+        """
+        reads = [str(read) for read in reads]
+        results = {}
+        for read in reads:
+            if read not in results:
+                results[read] = self.alignments(read, mismatches, **kwargs)
+        return [list(results[read]) for read in reads]
+
+    def _seed_codes(self, sequence, mismatches):
+        """Return (distance, code) for every indexed code within *mismatches*
+        substitutions of *sequence*, closest first.
+
+        The read is split in to mismatches+1 segments. Any code close enough
+        to it matches at least one segment exactly, and its segments before
+        the first exact one each have at least one substitution. So the
+        segments are walked in order, each either kept exactly (after which
+        the rest of the read may be anything) or replaced by one of its
+        neighbours with at least one substitution. Since the keys are sorted,
+        the codes starting with each such prefix are one range of them,
+        narrowed down a segment at a time. A range is searched directly,
+        comparing every code in it with the whole read, as soon as that is
+        cheaper than narrowing it further, so far fewer codes are enumerated
+        than every neighbour of the read.
+        """
+        width = self.width
+        if not mismatches or mismatches >= width:
+            return [(distance, code) for distance, code
+                    in _neighbours(sequence, mismatches)
+                    if self._lookup(code) is not None]
+
+        codes = sequence.encode('ascii', 'replace').translate(_CODES)
+        read = 0
+        unencodable = 0
+        for base in codes:
+            read = (read << 2) | (base if base <= 3 else 0)
+            unencodable = (unencodable << 2) | (base > 3)
+        low = int('01' * width, 2)
+
+        segments = mismatches + 1
+        bounds = [(width*j // segments, width*(j+1) // segments)
+                  for j in range(segments)]
+        # The code of each segment kept exactly (or None if it can't be),
+        # and of its neighbours by number of substitutions. Segment k is only
+        # changed when each segment before it was, so it can have at most
+        # mismatches-k substitutions, and the last is never changed.
+        exact = []
+        changed = []
+        for k, (start, end) in enumerate(bounds):
+            if max(codes[start:end]) <= 3:
+                exact.append((read >> 2*(width-end)) &
+                             ((1 << 2*(end-start)) - 1))
+            else:
+                exact.append(None)
+            neighbours = [[] for distance in range(mismatches+1)]
+            if k < segments - 1:
+                for distance, code in _neighbours(sequence[start:end],
+                                                  mismatches - k):
+                    neighbours[distance].append(code)
+            changed.append(neighbours)
+
+        keys = self._keys
+        found = {}
+        # (segment, substitutions so far, prefix, range of keys, whether a
+        # segment has been kept exactly)
+        stack = [(0, 0, 0, 0, len(keys), False)]
+        while stack:
+            k, used, prefix, first, last, seeded = stack.pop()
+            options = []
+            if k < segments:
+                if exact[k] is not None:
+                    options.append((0, exact[k]))
+                if not seeded and k < segments - 1:
+                    # A later segment is left to be kept exactly
+                    for distance in range(1, mismatches - used + 1):
+                        options += [(distance, code)
+                                    for code in changed[k][distance]]
+                # Past the seed every option must be tried anyway
+                elif used < mismatches:
+                    options = []
+            if not options or last - first <= len(options):
+                for code in keys[first:last]:
+                    difference = code ^ read
+                    distance = bin((difference | difference >> 1 |
+                                    unencodable) & low).count('1')
+                    if distance <= mismatches:
+                        found[code] = distance
+                continue
+            start, end = bounds[k]
+            shift = 2*(width-end)
+            prefix <<= 2*(end-start)
+            for distance, code in options:
+                code |= prefix
+                upper = (code + 1) << shift
+                i = bisect_left(keys, code << shift, first, last)
+                if i == last or keys[i] >= upper:
+                    continue
+                stack.append((k+1, used + distance, code, i,
+                              bisect_left(keys, upper, i, last),
+                              seeded or not distance))
+        return sorted((distance, code) for code, distance in found.items())
+
+    def _lookup(self, code):
+        """Return the packed alignments of *code*, or None if it is absent."""
+        keys = self._keys
+        i = bisect_left(keys, code)
+        if i == len(keys) or keys[i] != code:
+            return None
+        return self._values[self._starts[i]:self._starts[i+1]]
+
+
+def _encode(sequence):
+    """Return the 2-bit code of *sequence*, or None if it can't be encoded."""
+    code = 0
+    for base in sequence.encode('ascii', 'replace').translate(_CODES):
+        if base > 3:
+            return None
+        code = (code << 2) | base
+    return code
+
+def _sequence_codes(sequence):
+    """Return the 2-bit code of each base of *sequence* as ``bytes``, with 4
+    for any base that can not be encoded.
+
+    A ``PackedNucleicSequence`` already holds its bases in this encoding, so
+    its codes are unpacked directly rather than decoded to letters first.
+    """
+    codes = getattr(sequence, 'codes', None)
+    if codes is not None:
+        return codes()
+    return _sequence_bytes(sequence).translate(_CODES)
+
+def _window_keys(codes, id, width, reverse):
+    """Return ``(codes, values)``, two ``array('Q')`` holding the code and
+    packed alignment (see ``_pack_alignment``) of every encodable window of
+    *codes*, the ``bytes`` returned by ``_sequence_codes``.
+
+    The windows are in order of position, and when *reverse* is set the
+    window of each position on the opposing strand follows the one on the
+    reported strand, as ``FixedTree`` orders them.
+    """
+    count = len(codes) - width + 1
+    if count <= 0:
+        return array.array('Q'), array.array('Q')
+    if count - 1 > _POSITION_MASK or id >> 32:
+        raise ValueError('alignment ({}, {}) is too large to '
+                         'store'.format(id, count - 1))
+
+    strands = [(_window_codes(codes, width),
+                array.array('Q', range((id << 32) | 1,
+                                       (id << 32) + 2*count, 2)))]
+    if reverse:
+        # The reverse complement of the window at i is the window of the
+        # reverse complemented codes at count-1-i.
+        complement = codes[::-1].translate(_COMPLEMENT_CODES)
+        strands.append((_window_codes(complement, width)[::-1],
+                        array.array('Q', range(id << 32,
+                                               (id << 32) + 2*count, 2))))
+
+    # Leave out the windows containing anything but A, C, G or T
+    unencodable = bytearray(count)
+    for run in _UNENCODABLE.finditer(codes):
+        first = max(run.start() - width + 1, 0)
+        last = min(run.end(), count)
+        unencodable[first:last] = b'\x01' * (last - first)
+    if any(unencodable):
+        encodable = [not flag for flag in unencodable]
+        strands = [tuple(array.array('Q', itertools.compress(data, encodable))
+                         for data in strand) for strand in strands]
+
+    if len(strands) == 1:
+        return strands[0]
+    return tuple(_interleave(forward, opposing)
+                 for forward, opposing in zip(*strands))
+
+def _window_codes(codes, width):
+    """Return an ``array('Q')`` of the 2-bit code of every window of *codes*,
+    with any code of 4 read as 0.
+
+    Each window code is a 64-bit lane of one big-endian integer. Adding the
+    k-th base of every window at once is then a shift and an OR of that
+    integer, as in ``tigerlily.sequences.packed``: no lane ever exceeds 64
+    bits, so nothing carries between lanes. Codes are computed for
+    ``WINDOW_CHUNK`` windows at a time to bound the size of the integers.
+    """
+    codes = codes.translate(_LOW_BITS)
+    count = len(codes) - width + 1
+    windows = array.array('Q')
+    for first in range(0, count, WINDOW_CHUNK):
+        size = min(WINDOW_CHUNK, count - first)
+        lanes = bytearray(8 * size)
+        value = 0
+        for k in range(width):
+            lanes[7::8] = codes[first+k:first+k+size]
+            value |= int.from_bytes(lanes, 'big') << 2*(width-1-k)
+        chunk = array.array('Q', value.to_bytes(8 * size, 'big'))
+        if sys.byteorder == 'little':
+            chunk.byteswap()
+        windows += chunk
+    return windows
+
+def _interleave(first, second):
+    """Return an ``array('Q')`` alternating the items of *first* and
+    *second*, which must be the same length."""
+    merged = array.array('Q', bytes(8 * (len(first) + len(second))))
+    view = memoryview(merged)
+    view[0::2] = memoryview(first)
+    view[1::2] = memoryview(second)
+    return merged
+
+def _sort_block(codes, values, start, end):
+    """Return ``(codes, values)``, two ``array('Q')`` holding windows *start*
+    to *end* of *codes* and *values* sorted by code, keeping the order of
+    windows with the same code."""
+    order = sorted(range(start, end), key=codes.__getitem__)
+    return (array.array('Q', map(codes.__getitem__, order)),
+            array.array('Q', map(values.__getitem__, order)))
+
+def _neighbours(sequence, mismatches):
+    """Generate (distance, code) for every code within *mismatches*
+    substitutions of *sequence*, in increasing order of distance.
+
+    Bases that can not be encoded must be substituted, so they always count
+    as a mismatch.
+    """
+    width = len(sequence)
+    codes = sequence.encode('ascii', 'replace').translate(_CODES)
+    forced = [p for p in range(width) if codes[p] > 3]
+    free = [p for p in range(width) if codes[p] <= 3]
+
+    base = 0
+    for c in codes:
+        base = (base << 2) | (c if c <= 3 else 0)
+
+    for extra in range(mismatches - len(forced) + 1):
+        for chosen in itertools.combinations(free, extra):
+            options = [range(4)] * len(forced) + [range(1,4)] * extra
+            for choice in itertools.product(*options):
+                code = base
+                for p, value in zip(forced + list(chosen), choice):
+                    code ^= value << 2*(width-1-p)
+                yield len(forced) + extra, code
@@ -0,0 +1,124 @@
+# kmer_test.py - unit tests for kmer.py
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This module provides unit tests for the ``tigerlily.index.kmer``
+module.
+
+As with all unit test modules, the tests it contains can be executed in many
+ways, but most easily by going to the project root dir and executing
+``python3 setup.py nosetests``.
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+import itertools
+
+from tigerlily.sequences import NucleicSequence, FASTASequence
+from tigerlily.grc.genome import GRCGenome
+import tigerlily.index.fixedtree as ft
+import tigerlily.index.kmer as km
+
+class KmerIndexTests(unittest.TestCase):
+    """Test harness for ``tigerlily.index.kmer.KmerIndex`` class.
+    """
+
+    def setUp(self):
+        """Create the testing environment"""
+        self.test_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.test_dir)
+
+        self.test_genome = GRCGenome.download('test1')
+        self.index_width = 5
+
+    def tearDown(self):
+        """Remove the testing environment"""
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_against_fixedtree(self):
+        "kmer.py: Test KmerIndex alignments against a FixedTree"
+        for reverse in (False, True):
+            tree = ft.FixedTree(self.index_width,self.test_genome,reverse)
+            index = km.KmerIndex(self.index_width,self.test_genome,reverse)
+            self._compare_subtest(index, tree)
+
+            # Window codes computed, and windows sorted, a few at a time
+            # give the same index
+            chunk, block = km.WINDOW_CHUNK, km.SORT_BLOCK
+            km.WINDOW_CHUNK, km.SORT_BLOCK = 3, 7
+            try:
+                chunked = km.KmerIndex(self.index_width,self.test_genome,
+                                       reverse)
+            finally:
+                km.WINDOW_CHUNK, km.SORT_BLOCK = chunk, block
+            self.assertEqual((chunked._keys,chunked._starts,chunked._values),
+                             (index._keys,index._starts,index._values))
+
+    def test_store_load(self):
+        "kmer.py: Test storing and mapping a KmerIndex from disk"
+        tree = ft.FixedTree(self.index_width,self.test_genome,True)
+        km.KmerIndex(self.index_width,self.test_genome,True).store('k.idx')
+        with self.assertRaises(EnvironmentError):
+            km.KmerIndex(self.index_width).store('k.idx')
+        index = km.KmerIndex.load('k.idx')
+        self.assertEqual(index.sequence_name_table,tree.sequence_name_table)
+        self._compare_subtest(index, tree)
+
+    def test_unencodable(self):
+        "kmer.py: Test windows and reads containing N"
+        class Genome:
+            def sequences(self):
+                yield NucleicSequence('ACGTACGT',identifier='a')
+                yield NucleicSequence('TTTTT',identifier='b')
+                yield FASTASequence('ACNACGTA',identifier='c')
+        index = km.KmerIndex(4,Genome())
+        self.assertEqual(index.alignments('ACGT'),
+                         [('a',0,True),('a',4,True),('c',3,True)])
+        self.assertEqual(index.alignments('ACNT'),[])
+        self.assertEqual(sorted(index.alignments('ACNT',mismatches=1)),
+                         [('a',0,True),('a',4,True),('c',3,True)])
+        self.assertFalse('ACNT' in index)
+        self.assertRaises(ValueError,km.KmerIndex,33)
+        self.assertRaises(ValueError,index.alignments,'ACG')
+
+    def _compare_subtest(self, index, tree):
+        "subtest checking that index finds the same alignments as tree"
+        reads = [''.join(read) for read in
+                 itertools.product('ACGT',repeat=self.index_width)]
+        for read in reads:
+            self.assertEqual(read in index, read in tree)
+            for mismatches in (0,1,2,3):
+                self.assertEqual(
+                    sorted(index.alignments(read,mismatches=mismatches)),
+                    sorted(tree.alignments(read,mismatches=mismatches)))
+            best = index.alignments(read,mismatches=2,best_alignments=True,
+                                    maximum_alignments=3)
+            self.assertEqual(len(best),
+                             len(tree.alignments(read,mismatches=2,
+                                                 best_alignments=True,
+                                                 maximum_alignments=3)))
+        self.assertEqual(index.align_batch(reads[:40],mismatches=1),
+                         [index.alignments(r,mismatches=1)
+                          for r in reads[:40]])
@@ -30,13 +30,33 @@ the sequence to some file format.
 """
 
 from tigerlily.sequences.sequence import ( PolymerSequence, FormattedSequence,
+    SequenceView,
 )
 
-from tigerlily.sequences.fasta import ( FASTASequence, parseFASTA, writeFASTA)
+from tigerlily.sequences.fasta import ( FASTASequence, parseFASTA, writeFASTA,
+    BinaryFASTASequence, parseFASTABinary, parseFASTAParallel,
+)
+
+from tigerlily.sequences.faidx import FASTAIndex
+
+from tigerlily.sequences.fastq import ( FASTQSequence, parseFASTQ,
+    parseFASTQBatches, writeFASTQ,
+)
 
 from tigerlily.sequences.raw import ( RawSequence, parseRaw)
 
 from tigerlily.sequences.genomic import ( NucleicSequence, AminoSequence,
+    BackTranslations, IUPAC_CODES,
     reverse_complement,
 )
 
+from tigerlily.sequences.packed import PackedNucleicSequence
+
+from tigerlily.sequences.orf import findORFs
+
+from tigerlily.sequences.batch import ReadBatch
+
+from tigerlily.sequences.group import ( PolymerSequenceGroup,
+    createGenomicSequenceGroup,
+)
+
@@ -0,0 +1,235 @@
+# batch.py - Many reads stored in shared buffers
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Columnar storage for large numbers of short reads.
+
+Tens of millions of reads held as separate sequence objects cost more in
+object overhead than in bases. A ``ReadBatch`` instead keeps the bases of all
+of its reads in one ``str``, their qualities (if any) in another, the end of
+each read in an ``array`` and the identifiers in a list. Individual reads are
+handed out as ``SequenceView`` objects, which share the batch's buffer.
+"""
+
+import array
+import itertools
+import sys
+
+from tigerlily.sequences.sequence import PolymerSequence, SequenceView
+
+class ReadBatch:
+    """A sequence of reads stored as one buffer of bases plus offsets.
+
+    *reads* may contain any ``PolymerSequence`` objects (whose identifiers,
+    and qualities if they have them, are kept) or plain ``str`` bases. Either
+    every read has a quality string or none does. If *intern* is True each
+    identifier is interned with ``sys.intern``, so that batches repeating the
+    same few identifiers share one copy of each.
+
+    Bases are stored as given, without validation. Reads appended since the
+    buffers were last joined are kept as they are, and the buffers are only
+    joined again once those reads hold as many bases as the buffers already
+    do, so appending and reading reads in turn stays cheap.
+
+    >>> from tigerlily.sequences import FASTQSequence
+    >>> batch = ReadBatch([FASTQSequence('GATTACA', 'r1', 'IIIII#!'),
+    ...                    FASTQSequence('CAT', 'r2', '!!I')])
+    >>> len(batch), batch.sequence(1), batch.quality(0)
+    (2, 'CAT', 'IIIII#!')
+    >>> read = batch[0]
+    >>> read.identifier, read.sequence, read[2:5].sequence
+    ('r1', 'GATTACA', 'TTA')
+    >>> batch.strings()
+    ['GATTACA', 'CAT']
+    >>> reads = ReadBatch()
+    >>> for bases in ('AC', 'GTA', 'TT'):
+    ...     reads.append(bases)
+    ...     print(reads[-1].sequence, reads.sequence(0))
+    AC AC
+    GTA AC
+    TT AC
+    """
+
+    def __init__(self, reads=(), intern=False):
+        self._bases = ''
+        self._qualities = None
+        self._pending = []
+        self._pending_qualities = []
+        self._pending_size = 0
+        self._ends = array.array('Q')
+        self._identifiers = []
+        self._intern = intern
+        self.extend(reads)
+
+    @classmethod
+    def from_columns(cls, sequences, identifiers=None, qualities=None,
+                     intern=False):
+        """Create a batch straight from lists of bases, identifiers and
+        qualities, without making a sequence object per read. This is how
+        ``parseFASTQBatches`` builds columnar batches."""
+        batch = cls(intern=intern)
+        batch._bases = ''.join(sequences)
+        batch._ends.extend(itertools.accumulate(map(len, sequences)))
+        if identifiers is None:
+            identifiers = [None] * len(sequences)
+        elif intern:
+            identifiers = [sys.intern(i) if i is not None else None
+                           for i in identifiers]
+        batch._identifiers = list(identifiers)
+        if qualities is not None:
+            batch._qualities = ''.join(qualities)
+            if len(batch._qualities) != len(batch._bases):
+                raise ValueError('Every read needs one quality per base')
+        return batch
+
+    def append(self, read, identifier=None, quality=None):
+        """Add *read* (a ``PolymerSequence`` or ``str``) to the batch.
+
+        *identifier* and *quality* default to those of *read*.
+        """
+        if isinstance(read, PolymerSequence):
+            if identifier is None:
+                identifier = read.identifier
+            if quality is None:
+                quality = getattr(read, 'quality', None)
+            read = read.sequence
+        if quality is not None and len(quality) != len(read):
+            raise ValueError('Every read needs one quality per base')
+        if self._ends and (quality is None) != (self._qualities is None):
+            raise ValueError('Either every read in a batch has qualities or '
+                             'none does')
+        if quality is not None:
+            if self._qualities is None:
+                self._qualities = ''
+            self._pending_qualities.append(quality)
+        if self._intern and identifier is not None:
+            identifier = sys.intern(identifier)
+
+        self._pending.append(read)
+        self._ends.append((self._ends[-1] if self._ends else 0) + len(read))
+        self._identifiers.append(identifier)
+        self._pending_size += len(read)
+        if self._pending_size >= len(self._bases):
+            self._flush()
+
+    def extend(self, reads):
+        """Add every read of the iterable *reads* to the batch."""
+        for read in reads:
+            self.append(read)
+
+    def _flush(self):
+        """Join any reads appended since the buffers were last used."""
+        if self._pending:
+            self._bases += ''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+        if self._pending_qualities:
+            self._qualities += ''.join(self._pending_qualities)
+            self._pending_qualities = []
+
+    def _span(self, index):
+        """Return the (start, end) of read *index* in the buffers."""
+        if index < 0:
+            index += len(self._ends)
+        if not 0 <= index < len(self._ends):
+            raise IndexError('read index out of range')
+        self._flush()
+        return (self._ends[index-1] if index else 0), self._ends[index]
+
+    def _locate(self, index):
+        """Return (bases, qualities, start, end), where read *index* is
+        characters *start* to *end* of *bases* and *qualities* (which is
+        None if the batch has no qualities).
+
+        Unlike ``_span`` this never joins the buffers: a read appended since
+        they were last joined is returned as its own string.
+        """
+        if index < 0:
+            index += len(self._ends)
+        if not 0 <= index < len(self._ends):
+            raise IndexError('read index out of range')
+        pending = index - (len(self._ends) - len(self._pending))
+        if pending >= 0:
+            bases = self._pending[pending]
+            qualities = (self._pending_qualities[pending]
+                         if self._qualities is not None else None)
+            return bases, qualities, 0, len(bases)
+        return (self._bases, self._qualities,
+                (self._ends[index-1] if index else 0), self._ends[index])
+
+    def __len__(self):
+        return len(self._ends)
+
+    def __getitem__(self, index):
+        """Return read *index* as a ``SequenceView`` of the batch buffer."""
+        bases, qualities, start, end = self._locate(index)
+        return SequenceView(bases, identifier=self._identifiers[index],
+                            start=start, end=end)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def sequences(self):
+        """Generate every read, so that a batch can be used wherever a
+        genome is expected."""
+        return iter(self)
+
+    def sequence(self, index):
+        """Return the bases of read *index* as a ``str``."""
+        bases, qualities, start, end = self._locate(index)
+        return _text(bases, start, end)
+
+    def identifier(self, index):
+        """Return the identifier of read *index* (which may be None)."""
+        return self._identifiers[index]
+
+    def quality(self, index):
+        """Return the quality string of read *index*, or None if the batch
+        has no qualities."""
+        bases, qualities, start, end = self._locate(index)
+        if qualities is None:
+            return None
+        return _text(qualities, start, end)
+
+    def strings(self):
+        """Return the bases of every read as a list of ``str``, as taken by
+        the ``align_batch`` method of the indexes."""
+        self._flush()
+        bases = self._bases
+        return [_text(bases, start, end) for start, end in
+                zip(itertools.chain((0,), self._ends), self._ends)]
+
+    def memory_usage(self):
+        """Return the approximate number of bytes used by the batch."""
+        self._flush()
+        return (sys.getsizeof(self._bases) + sys.getsizeof(self._qualities)
+                + sys.getsizeof(self._ends) + sys.getsizeof(self._identifiers)
+                + sum(sys.getsizeof(i) for i in set(self._identifiers)))
+
+
+def _text(buffer, start, end):
+    """Return characters *start* to *end* of *buffer* - a ``str``, or the
+    ASCII bytes of a stored batch - as a ``str``."""
+    if isinstance(buffer, str):
+        return buffer[start:end]
+    return bytes(buffer[start:end]).decode('ascii')
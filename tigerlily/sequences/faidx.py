@@ -0,0 +1,243 @@
+# faidx.py - Random access to FASTA files through .fai indexes
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r"""Random access to regions of FASTA files, using samtools-style indexes.
+
+A ``.fai`` index has one tab-separated line per sequence in a FASTA file:
+
+    NAME  LENGTH  OFFSET  LINEBASES  LINEWIDTH
+
+*OFFSET* is the byte offset of the first base of the sequence, *LINEBASES* the
+number of bases on each full line and *LINEWIDTH* the number of bytes on each
+full line (including the line terminator). Because every line but the last of
+a sequence must be full, the byte offset of any base can be computed directly,
+so fetching a region reads only that region from disk. Files written by
+``samtools faidx`` and by ``FASTAIndex.build`` are interchangeable.
+
+As with ``samtools``, a sequence is named by the first word of its header.
+
+>>> import os, tempfile
+>>> filename = os.path.join(tempfile.mkdtemp(), 'example.fa')
+>>> with open(filename, 'w') as out:
+...     size = out.write('>chr1 first\nGATTACAGAT\nTACAGA\n>chr2\nCCGG\n')
+>>> index = FASTAIndex.build(filename)
+>>> open(filename + '.fai').read()
+'chr1\t16\t12\t10\t11\nchr2\t4\t36\t4\t5\n'
+>>> index.fetch('chr1', 8, 13).sequence
+'ATTAC'
+>>> index.region('chr1:9-13').identifier
+'chr1:9-13'
+>>> index.close()
+"""
+
+import os
+
+from tigerlily.sequences.fasta import FASTASequence
+
+
+class FASTAIndex:
+    """A FASTA file opened for random access through its ``.fai`` index.
+
+    Create one with ``FASTAIndex.build`` (which writes a new index),
+    ``FASTAIndex.load`` (which reads an existing one) or ``FASTAIndex.open``
+    (which does whichever is needed). The FASTA file stays open until
+    ``close()`` is called, or the ``with`` block using the index ends.
+    """
+
+    def __init__(self, filename, entries):
+        """Do not call this directly - see the class documentation.
+
+        *entries* is a list of (name, length, offset, linebases, linewidth).
+        """
+        self.filename = filename
+        self._entries = {}
+        self._names = []
+        for entry in entries:
+            self._entries[entry[0]] = entry[1:]
+            self._names.append(entry[0])
+        self._file = open(filename, 'rb')
+
+    @classmethod
+    def build(cls, filename, index_filename=None):
+        """Index the FASTA file *filename* and return a ``FASTAIndex``.
+
+        The index is written to *index_filename*, which defaults to
+        *filename* with '.fai' appended (replacing any file already there).
+        ValueError is raised if a sequence has lines of differing lengths
+        anywhere but its last line, since it could then not be indexed.
+        """
+        entries = _scan(filename)
+        with open(index_filename or filename + '.fai', 'w') as out:
+            for entry in entries:
+                out.write('\t'.join(str(value) for value in entry) + '\n')
+        return cls(filename, entries)
+
+    @classmethod
+    def load(cls, filename, index_filename=None):
+        """Open the FASTA file *filename* using its existing index.
+
+        *index_filename* defaults to *filename* with '.fai' appended.
+        """
+        entries = []
+        with open(index_filename or filename + '.fai') as infile:
+            for line in infile:
+                fields = line.rstrip('\r\n').split('\t')
+                if len(fields) < 5:
+                    continue
+                entries.append((fields[0],) + tuple(int(value)
+                                                    for value in fields[1:5]))
+        return cls(filename, entries)
+
+    @classmethod
+    def open(cls, filename):
+        """Load the index of *filename* if it has one, otherwise build it.
+
+        An index older than *filename* may no longer describe it, so it is
+        rebuilt (and rewritten) as though it were missing.
+        """
+        index_filename = filename + '.fai'
+        if (os.path.isfile(index_filename) and os.path.getmtime(index_filename)
+                >= os.path.getmtime(filename)):
+            return cls.load(filename)
+        return cls.build(filename)
+
+    def close(self):
+        """Close the FASTA file."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def length(self, name):
+        """Return the number of bases in the sequence called *name*."""
+        return self._entries[name][0]
+
+    def fetch(self, name, start=0, end=None):
+        """Return bases *start* to *end* of sequence *name* as a
+        ``FASTASequence``.
+
+        *start* and *end* count from 0 and *end* is excluded, as with a
+        Python slice. *end* defaults to (and is clipped to) the end of the
+        sequence. The identifier of the result is the region in samtools
+        notation, counting from 1: ``name:start+1-end``.
+
+        KeyError is raised if there is no sequence called *name*, and
+        ValueError if the region is empty.
+        """
+        length, offset, linebases, linewidth = self._entries[name]
+        if end is None or end > length:
+            end = length
+        if start < 0 or start >= end:
+            raise ValueError('Empty region {}:{}-{}'.format(name, start+1,
+                                                             end))
+
+        first = offset + start // linebases * linewidth + start % linebases
+        last = offset + (end-1) // linebases * linewidth + (end-1) % linebases
+        self._file.seek(first)
+        data = self._file.read(last - first + 1)
+        sequence = data.replace(b'\n', b'').replace(b'\r', b'')
+        return FASTASequence(sequence.decode('ascii'),
+                             identifier='{}:{}-{}'.format(name, start+1, end))
+
+    def region(self, region):
+        """Return the region named by a samtools-style string, such as
+        'chr7:55,000,000-55,001,000', as a ``FASTASequence``.
+
+        Positions count from 1 and include both ends. A bare name fetches the
+        whole sequence, and 'name:start' fetches from *start* to the end.
+        """
+        name, colon, span = region.rpartition(':')
+        if not colon or name not in self._entries:
+            return self.fetch(region)
+        start, dash, end = span.replace(',', '').partition('-')
+        return self.fetch(name, int(start) - 1, int(end) if end else None)
+
+    def sequences(self):
+        """Generate every whole sequence in the file as a ``FASTASequence``,
+        so that a ``FASTAIndex`` can be used as the *genome* of an index.
+        Identifiers are the bare sequence names."""
+        for name in self._names:
+            sequence = self.fetch(name).sequence
+            yield FASTASequence(sequence, identifier=name)
+
+
+def _scan(filename):
+    """Return the list of .fai entries describing *filename*."""
+    entries = []
+    current = None
+    offset = 0
+
+    with open(filename, 'rb') as infile:
+        for line in infile:
+            width = len(line)
+            if line.startswith(b'>'):
+                if current:
+                    entries.append(_entry(current))
+                name = line[1:].split()
+                current = {
+                    'name': name[0].decode('utf-8') if name else '',
+                    'length': 0,
+                    'offset': offset + width,
+                    'linebases': 0,
+                    'linewidth': 0,
+                    'ended': False,
+                }
+            elif current is None:
+                if line.strip():
+                    raise ValueError('Misformatted FASTA file {}'.format(
+                                                                  filename))
+            else:
+                # Only the last line of a sequence may be short (or blank)
+                bases = len(line.rstrip(b'\r\n'))
+                if not bases:
+                    current['ended'] = True
+                elif current['ended'] or bases > current['linebases'] > 0:
+                    raise ValueError('Sequence {} in {} has lines of '
+                        'differing lengths'.format(current['name'], filename))
+                elif not current['linebases']:
+                    current['linebases'] = bases
+                    current['linewidth'] = width
+                elif bases < current['linebases']:
+                    current['ended'] = True
+                current['length'] += bases
+            offset += width
+
+    if current:
+        entries.append(_entry(current))
+    return entries
+
+def _entry(current):
+    """Turn the scanning state of one sequence in to a .fai entry."""
+    return (current['name'], current['length'], current['offset'],
+            current['linebases'], current['linewidth'])
@@ -0,0 +1,134 @@
+# faidx_test.py - unit tests for faidx.py
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""This module provides unit tests for the ``tigerlily.sequences.faidx``
+module.
+
+As with all unit test modules, the tests it contains can be executed in many
+ways, but most easily by going to the project root dir and executing
+``python3 setup.py nosetests``.
+"""
+
+import unittest
+import tempfile
+import os
+import shutil
+
+from tigerlily.sequences.faidx import FASTAIndex
+
+class FASTAIndexTests(unittest.TestCase):
+    """Test harness for ``tigerlily.sequences.faidx.FASTAIndex`` class.
+    """
+
+    def setUp(self):
+        """Create the testing environment"""
+        self.test_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.test_dir)
+
+        self.bases = 'GATTACAGATTACAGA'
+        self._write('test.fa', '>chr1 first\nGATTACAGAT\nTACAGA\n'
+                               '>chr2\nCCGG\n')
+
+    def tearDown(self):
+        """Remove the testing environment"""
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.test_dir)
+
+    def test_region(self):
+        "faidx.py: Test parsing samtools-style region strings"
+        with FASTAIndex.build('test.fa') as index:
+            region = index.region('chr1:9-13')
+            self.assertEqual(region.sequence, self.bases[8:13])
+            self.assertEqual(region.identifier, 'chr1:9-13')
+            self.assertEqual(index.region('chr1:1-1').sequence, 'G')
+            self.assertEqual(index.region('chr1:1,0-1,6').sequence,
+                             self.bases[9:16])
+            self.assertEqual(index.region('chr1:12').sequence,
+                             self.bases[11:])
+            self.assertEqual(index.region('chr1').sequence, self.bases)
+            self.assertEqual(index.region('chr2').identifier, 'chr2:1-4')
+
+            # Ends past the sequence are clipped; starts past it are empty
+            region = index.region('chr1:15-1,000')
+            self.assertEqual(region.sequence, self.bases[14:])
+            self.assertEqual(region.identifier, 'chr1:15-16')
+            self.assertRaises(ValueError, index.region, 'chr1:17-20')
+            self.assertRaises(ValueError, index.region, 'chr1:5-4')
+            self.assertRaises(KeyError, index.region, 'chr3:1-2')
+
+    def test_differing_lines(self):
+        "faidx.py: Test rejecting sequences with differing line lengths"
+        self._write('bad.fa', '>chr1\nGATTA\nCAG\nATTACA\n')
+        self.assertRaises(ValueError, FASTAIndex.build, 'bad.fa')
+        self._write('bad.fa', '>chr1\nGATTA\nCAGATT\nACA\n')
+        self.assertRaises(ValueError, FASTAIndex.build, 'bad.fa')
+        self._write('bad.fa', '>chr1\nGATTA\n\nCAGAT\n')
+        self.assertRaises(ValueError, FASTAIndex.build, 'bad.fa')
+        self.assertFalse(os.path.exists('bad.fa.fai'))
+
+    def test_load(self):
+        "faidx.py: Test loading an existing .fai, and rebuilding stale ones"
+        FASTAIndex.build('test.fa').close()
+        with open('test.fa.fai') as infile:
+            entries = infile.read()
+        with FASTAIndex.load('test.fa') as index:
+            self.assertEqual(list(index), ['chr1', 'chr2'])
+            self.assertEqual(index.length('chr1'), 16)
+            self.assertEqual(index.fetch('chr2', 1).sequence, 'CGG')
+
+        # A different index file is used as given, without checking it
+        self._write('other.fai', 'chr2\t2\t36\t4\t5\n')
+        with FASTAIndex.load('test.fa', 'other.fai') as index:
+            self.assertEqual(list(index), ['chr2'])
+            self.assertEqual(index.fetch('chr2').sequence, 'CC')
+
+        # open() uses an up to date index, and rebuilds an older one
+        self._write('test.fa.fai', 'chr1\t4\t12\t10\t11\n')
+        with FASTAIndex.open('test.fa') as index:
+            self.assertEqual(list(index), ['chr1'])
+        mtime = os.path.getmtime('test.fa')
+        os.utime('test.fa.fai', (mtime - 10, mtime - 10))
+        with FASTAIndex.open('test.fa') as index:
+            self.assertEqual(list(index), ['chr1', 'chr2'])
+            self.assertEqual(index.region('chr1').sequence, self.bases)
+        with open('test.fa.fai') as infile:
+            self.assertEqual(infile.read(), entries)
+
+    def test_crlf(self):
+        "faidx.py: Test indexing files with CRLF line endings"
+        self._write('crlf.fa', '>chr1 first\r\nGATTACAGAT\r\nTACAGA\r\n'
+                               '>chr2\r\nCCGG\r\n')
+        with FASTAIndex.build('crlf.fa') as index:
+            with open('crlf.fa.fai') as infile:
+                self.assertEqual(infile.read(),
+                                 'chr1\t16\t13\t10\t12\nchr2\t4\t40\t4\t6\n')
+            for start in range(16):
+                for end in range(start + 1, 17):
+                    self.assertEqual(index.fetch('chr1', start, end).sequence,
+                                     self.bases[start:end])
+            self.assertEqual(index.region('chr2:2-4').sequence, 'CGG')
+
+    def _write(self, filename, text):
+        "write *text* to *filename* exactly, without translating newlines"
+        with open(filename, 'w', newline='') as out:
+            out.write(text)
@@ -27,11 +27,22 @@ contain any comments (only a single identifier line is allowed), and that '>'
 is the only valid identifier character (not ';').
 """
 
-import re
-import textwrap
+import os
+import mmap
+import collections
+import multiprocessing
 
 
-from tigerlily.sequences.sequence import FormattedSequence
+from tigerlily.sequences.sequence import FormattedSequence, PolymerSequence
+
+# The number of characters parseFASTA reads from a file at a time.
+PARSE_BLOCK_SIZE = 2**20
+
+# The approximate number of bytes parsed by each task of parseFASTAParallel.
+PARALLEL_CHUNK_SIZE = 2**24
+
+# The approximate number of characters written at a time by writeFASTA.
+WRITE_BUFFER_SIZE = 2**20
 
 class FASTASequence(FormattedSequence):
     r"""Container for a single FASTA Sequence.
@@ -63,6 +74,8 @@ class FASTASequence(FormattedSequence):
     
     """
     
+    __slots__ = ('_sequence', '_identifier')
+
     # The FASTA format often specified a maximum line width. This is that.
     MAX_LINE_WIDTH = 79
     ALLOWED_NUCLEIC_CHARS = 'ATGCUN'
@@ -74,15 +87,17 @@ class FASTASequence(FormattedSequence):
         # Note that for FASTA, unlike other formats, an identifier is REQUIRED
 
         # Check the sequence to make sure it conforms to NCBI-reduced
-        all_allowed = ''.join(set(
-            self.ALLOWED_NUCLEIC_CHARS + self.ALLOWED_NUCLEIC_CHARS.lower() + 
-            self.ALLOWED_AMINO_CHARS + self.ALLOWED_AMINO_CHARS.lower()))
-
-        if not re.match(r'[{}]+'.format(all_allowed),sequence):
+        if not self.validate(sequence):
             raise ValueError('FASTA sequence contains bad chars')
 
         self._sequence = sequence
         self._identifier = identifier
+
+    @classmethod
+    def _allowed_chars(cls):
+        """Either case of the allowed nucleic and amino characters."""
+        allowed = cls.ALLOWED_NUCLEIC_CHARS + cls.ALLOWED_AMINO_CHARS
+        return allowed.upper() + allowed.lower()
     
     @property
     def sequence(self):
@@ -103,33 +118,102 @@ class FASTASequence(FormattedSequence):
         # Note that FASTA sequences are often times megabases-long. These
         # sequences will perform poorly in generating a single string.
         # Instead, you may wish to use the FASTA-specific 'write' method.
-        return ">{id}\n{seq}\n".format(
-            id=self.identifier,
-            seq = '\n'.join(textwrap.wrap(self.sequence,
-                                               width=self.MAX_LINE_WIDTH)),
-        )
+        wrapped = ''.join(_wrapped_blocks(self._sequence, self.MAX_LINE_WIDTH,
+                                          WRITE_BUFFER_SIZE))
+        return ">{id}\n{seq}".format(id=self.identifier, seq=wrapped or '\n')
 
-    def write(self,file):
+    def write(self,file,buffer_size=None):
         """Write this FASTA sequence to the opened file object.
 
         Note that this function has the same result as writing the output of
-        .format(). However, this function will outperform* that approach for
+        .format(). However, this function will outperform that approach for
         large sequences (such as reference genomes stored in FASTA format),
         because this function doesn't store the entire sequence in memory a
         second time like .format() does (for text wrapping purposes).
-        
-        *: OK, the performance will be mostly identical, it's just that the
-           memory footprint should be much smaller.
+
+        The wrapped lines are written in blocks of about *buffer_size*
+        characters (by default ``WRITE_BUFFER_SIZE``), so a chromosome takes
+        a few hundred calls to ``file.write`` rather than millions.
         """
-    
-        seq = self.sequence
+
+        seq = self._sequence
         if not seq:
             raise ValueError('Empty or invalid sequence: "{}"'.format(seq))
-        
+
         file.write('>{}\n'.format(self.identifier))
 
-        for i in range(0,len(seq),self.MAX_LINE_WIDTH):
-            file.write('{}\n'.format(seq[i:i+self.MAX_LINE_WIDTH]))
+        for block in _wrapped_blocks(seq, self.MAX_LINE_WIDTH,
+                                     buffer_size or WRITE_BUFFER_SIZE):
+            file.write(block)
+
+
+class BinaryFASTASequence(FASTASequence):
+    r"""A ``FASTASequence`` whose sequence is stored as ASCII ``bytes``.
+
+    These are produced by ``parseFASTABinary``. The bytes are available,
+    undecoded, as ``data``; ``sequence`` decodes them to a ``str`` each time
+    it is read, so code that only needs the raw bases should use ``data``.
+    *sequence* may be given as ``str`` or any bytes-like object.
+
+    Slices are cut from the bytes, so taking windows of a chromosome never
+    decodes the whole of it.
+
+    >>> seq = BinaryFASTASequence(b'GATTACA', identifier='seq1')
+    >>> seq.data
+    b'GATTACA'
+    >>> seq.format()
+    '>seq1\nGATTACA\n'
+    >>> seq[2:5].data, seq[-1].sequence
+    (b'TTA', 'A')
+    """
+
+    __slots__ = ()
+
+    def __init__(self,sequence,identifier):
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii')
+        sequence = bytes(sequence)
+
+        if not self.validate(sequence):
+            raise ValueError('FASTA sequence contains bad chars')
+
+        self._sequence = sequence
+        self._identifier = identifier
+
+    @classmethod
+    def trusted(cls,sequence,identifier=None):
+        """Create a BinaryFASTASequence without validating *sequence*, which
+        may be a ``str`` or bytes-like object."""
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii')
+        return super().trusted(bytes(sequence),identifier)
+
+    @property
+    def sequence(self):
+        """The sequence of this BinaryFASTASequence, decoded to ``str``."""
+        return self._sequence.decode('ascii')
+
+    @property
+    def data(self):
+        """The sequence of this BinaryFASTASequence as ``bytes``."""
+        return self._sequence
+
+    def __getitem__(self,key):
+        """Slice the bytes of the sequence, without decoding the rest.
+
+        >>> BinaryFASTASequence(b'GATTACA', identifier='seq1')[7]
+        Traceback (most recent call last):
+            ...
+        IndexError: sequence index out of range
+        """
+        if not isinstance(key, slice):
+            try:
+                key = range(len(self._sequence))[key]
+            except IndexError:
+                raise IndexError('sequence index out of range') from None
+            key = slice(key, key + 1)
+        return type(self)(self._sequence[key],
+                          identifier='{}_subseq'.format(self._identifier))
 
 
 def parseFASTA(file=None,data=None):
@@ -142,6 +226,11 @@ def parseFASTA(file=None,data=None):
     object opened for reading in non-binary mode (such that ``file.read()`` will
     produce ``str`` objects).
 
+    The input is consumed in blocks of ``PARSE_BLOCK_SIZE`` characters and each
+    sequence is generated as soon as it is complete, so only about one record
+    is ever held in memory, however large the file is. A '>' starts a new
+    record only at the beginning of a line.
+
     >>> example_data = (">seq1\n"
     ... "CATTTACGGTACGTGATCTTACGATGCTAGCTTTGTACTAC\n"
     ... ">seq2\n"
@@ -173,29 +262,222 @@ def parseFASTA(file=None,data=None):
     True
     True
 
+    Records may be far larger than a block:
+
+    >>> big = ">big\n" + "ACGT" * PARSE_BLOCK_SIZE + "\n>small\nAC\n"
+    >>> [len(s.sequence) for s in parseFASTA(data=big)]
+    [4194304, 2]
+
+    Windows line endings are removed:
+
+    >>> [(s.identifier, s.sequence) for s in
+    ...  parseFASTA(data=">seq1\r\nCATT\r\nTACG\r\n")]
+    [('seq1', 'CATTTACG')]
+
     """
 
     if (file and data) or (not file and not data):
         raise ValueError('You must specify either file or data, but not both')
         
     if file:
-        data = file.read()
-
-    if not data[0] == '>':
-        raise ValueError('Misformatted FASTA {}'.format(data))
+        blocks = iter(lambda: file.read(PARSE_BLOCK_SIZE), '')
+    else:
+        blocks = (data[i:i+PARSE_BLOCK_SIZE]
+                  for i in range(0,len(data),PARSE_BLOCK_SIZE))
 
-    for seq_data in data[1:].split('>'):
-        all_lines = seq_data.split('\n')
-        ident = all_lines[0]
-        seq = ''.join(all_lines[1:])
+    for ident, seq in _parse_records(blocks, ''):
         yield FASTASequence(sequence=seq,identifier=ident)
+
+
+def parseFASTABinary(file=None,data=None):
+    r"""Parse FASTA from bytes, generating ``BinaryFASTASequence`` objects.
+
+    This is the binary counterpart of ``parseFASTA``: *data* may be
+    ``bytes``, ``bytearray`` or ``memoryview``, and *file* must be opened in
+    binary mode (such that ``file.read()`` will produce ``bytes``). The text
+    is never decoded, and each sequence is kept as ``bytes``. Identifiers are
+    decoded from UTF-8 and '\r' line endings are removed.
+
+    >>> example_data = b">seq1\r\nCATTTACGG\r\nTACG\r\n>seq2\r\nTTAGG\r\n"
+    >>> seqs = list(parseFASTABinary(data=memoryview(example_data)))
+    >>> seqs[0].identifier, seqs[0].data
+    ('seq1', b'CATTTACGGTACG')
+    >>> seqs[1].sequence
+    'TTAGG'
+    """
+
+    if (file and data) or (not file and not data):
+        raise ValueError('You must specify either file or data, but not both')
+
+    if file:
+        blocks = iter(lambda: file.read(PARSE_BLOCK_SIZE), b'')
+    else:
+        blocks = (bytes(data[i:i+PARSE_BLOCK_SIZE])
+                  for i in range(0,len(data),PARSE_BLOCK_SIZE))
+
+    for ident, seq in _parse_records(blocks, b''):
+        yield BinaryFASTASequence(sequence=seq,
+                                  identifier=ident.decode('utf-8'))
+
+
+def parseFASTAParallel(filename, workers=None, binary=False, convert=None,
+                       chunk_size=None):
+    r"""Parse the FASTA file *filename* with a pool of worker processes.
+
+    The file is cut in to chunks of about *chunk_size* bytes (by default
+    ``PARALLEL_CHUNK_SIZE``), each ending just before a line that starts with
+    '>', so that no record is split between chunks. *workers* processes
+    (by default, one per CPU) each parse and validate whole chunks, and the
+    sequences are generated in the order they appear in the file. At most two
+    chunks per worker are parsed ahead of the caller, which bounds memory.
+
+    If *binary* is True the chunks are parsed with ``parseFASTABinary``,
+    otherwise with ``parseFASTA``. If *convert* is a ``PolymerSequence``
+    subclass, such as ``NucleicSequence``, each sequence is converted to it
+    by the workers, so that its validation also runs in parallel.
+
+    The results are the same as those of ``parseFASTA`` on the whole file.
+
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'example.fa')
+    >>> with open(filename, 'w') as out:
+    ...     for i in range(100):
+    ...         size = out.write('>seq{}\nGATTACA\nTTAC\n'.format(i))
+    >>> seqs = list(parseFASTAParallel(filename, workers=2, chunk_size=100))
+    >>> with open(filename) as infile:
+    ...     [(s.identifier, s.sequence) for s in seqs] == [
+    ...         (s.identifier, s.sequence) for s in parseFASTA(file=infile)]
+    True
+    """
+    jobs = [(filename, start, end, binary, convert)
+            for start, end in _record_chunks(filename,
+                                             chunk_size or PARALLEL_CHUNK_SIZE)]
+    if not jobs:
+        raise ValueError('Misformatted FASTA: no sequences found')
+
+    with multiprocessing.Pool(workers) as pool:
+        ahead = 2 * (workers or multiprocessing.cpu_count())
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_parse_chunk, (job,)))
+            if len(pending) >= ahead:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def _record_chunks(filename, chunk_size):
+    """Return (start, end) byte ranges of *filename*, each of about
+    *chunk_size* bytes and each starting at the beginning of a record."""
+    with open(filename, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if not size:
+            return []
+        data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            chunks = []
+            start = 0
+            while start < size:
+                end = data.find(b'\n>', start + max(chunk_size, 1) - 1)
+                end = size if end == -1 else end + 1
+                chunks.append((start, end))
+                start = end
+            return chunks
+        finally:
+            data.close()
+
+def _parse_chunk(job):
+    """Worker for ``parseFASTAParallel``: parse one chunk of a file."""
+    filename, start, end, binary, convert = job
+    with open(filename, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+
+    if binary:
+        sequences = parseFASTABinary(data=data)
+    else:
+        sequences = parseFASTA(data=data.decode('utf-8'))
+    if convert is not None:
+        return [seq.convert(convert) for seq in sequences]
+    return list(sequences)
+
+
+def _parse_records(blocks, empty):
+    """Generate (identifier, sequence) for each record of FASTA text.
+
+    *blocks* generates the text in pieces of any size, either all ``str`` or
+    all ``bytes``, and *empty* is the empty value of the same type. The
+    results are of that type as well. '\r' line endings are removed from both
+    the identifier and the sequence.
+    """
+    newline, marker, cr = (('\n', '>', '\r') if isinstance(empty, str)
+                           else (b'\n', b'>', b'\r'))
+
+    def record(ident, pieces):
+        return ident.rstrip(cr), empty.join(pieces).replace(cr, empty)
+
+    ident = None        # identifier of the record being read
+    pieces = []         # sequence text of the record being read
+    header = None       # a header line which continues in to the next block
+    line_start = True   # whether the next character starts a line
+
+    for block in blocks:
+        lines = block.split(newline)
+        last = len(lines) - 1
+        text = []       # sequence lines of the current record in this block
+        for i, line in enumerate(lines):
+            complete = i < last
+            if header is not None:
+                header += line
+                line = header
+            elif not (line_start and line.startswith(marker)):
+                # Sequence text. The lines of each block are joined together,
+                # and the blocks of a record joined once it is complete.
+                if ident is None and (line or complete):
+                    raise ValueError('Misformatted FASTA {}'.format(line))
+                text.append(line)
+                line = None
+
+            if line is not None:
+                if complete:
+                    pieces.append(empty.join(text))
+                    text = []
+                    if ident is not None:
+                        yield record(ident, pieces)
+                    ident = line[1:]
+                    pieces = []
+                    header = None
+                else:
+                    header = line
+
+            if complete:
+                line_start = True
+            elif lines[i]:
+                line_start = False
+        pieces.append(empty.join(text))
+
+    if header is not None:
+        if ident is not None:
+            yield record(ident, pieces)
+        ident = header[1:]
+        pieces = []
+    if ident is None:
+        raise ValueError('Misformatted FASTA: no sequences found')
+    yield record(ident, pieces)
         
 
-def writeFASTA(file, *seqs):
+def writeFASTA(file, *seqs, buffer_size=None):
     """Write an arbitray amount of sequences to an open writable file object.
 
     The sequences in *seqs* will be converted to ``FASTASequence`` objects
-    first, and then printed using the ``write`` method.
+    first (unless they already are one), and then written just as the
+    ``write`` method would. Any member of *seqs* may also be an iterable of
+    sequences, such as the generator returned by ``parseFASTA``, which is
+    consumed as it is written.
+
+    The output of many sequences is gathered in to blocks of about
+    *buffer_size* characters (by default ``WRITE_BUFFER_SIZE``), so small
+    sequences cost a fraction of a call to ``file.write`` each.
 
     The result is a valid FASTA-formatted file.
 
@@ -204,10 +486,57 @@ def writeFASTA(file, *seqs):
     >>> writeFASTA(sys.stdout, NucleicSequence('ATTTCGAT'))
     >Unknown
     ATTTCGAT
+    >>> writeFASTA(sys.stdout, (NucleicSequence(s, identifier=s)
+    ...                         for s in ('AC', 'GT')), buffer_size=4)
+    >AC
+    AC
+    >GT
+    GT
     """
-
+    buffer_size = buffer_size or WRITE_BUFFER_SIZE
+    width = FASTASequence.MAX_LINE_WIDTH
+    pending = []
+    pending_size = 0
+
+    for seq in _each_sequence(seqs):
+        if not isinstance(seq, FASTASequence):
+            seq = seq.convert(FASTASequence)
+        text = seq._sequence
+        if not text:
+            raise ValueError('Empty or invalid sequence: "{}"'.format(text))
+
+        header = '>{}\n'.format(seq.identifier)
+        pending.append(header)
+        pending_size += len(header)
+        for block in _wrapped_blocks(text, width, buffer_size):
+            pending.append(block)
+            pending_size += len(block)
+            if pending_size >= buffer_size:
+                file.write(''.join(pending))
+                pending = []
+                pending_size = 0
+
+    if pending:
+        file.write(''.join(pending))
+
+def _each_sequence(seqs):
+    """Generate the sequences in *seqs*, expanding any iterables of them."""
     for seq in seqs:
-        seq.convert(FASTASequence).write(file)
-    # Yup. That simple.
+        if isinstance(seq, PolymerSequence):
+            yield seq
+        else:
+            yield from seq
+
+def _wrapped_blocks(seq, width, buffer_size):
+    """Generate *seq* (a ``str`` or ASCII ``bytes``) wrapped to lines of
+    *width* characters, each line ending in a newline, in blocks of about
+    *buffer_size* characters. Bytes are decoded a block at a time."""
+    step = max(1, buffer_size // (width + 1)) * width
+    for start in range(0, len(seq), step):
+        chunk = seq[start:start+step]
+        if not isinstance(chunk, str):
+            chunk = chunk.decode('ascii')
+        yield '\n'.join([chunk[i:i+width]
+                         for i in range(0, len(chunk), width)]) + '\n'
             
         
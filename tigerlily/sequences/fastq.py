@@ -0,0 +1,300 @@
+# fastq.py - FASTQ formatted sequencing reads
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Support for the FASTQ format of sequencing reads.
+
+Each FASTQ record is four lines: '@' and the identifier, the bases, '+'
+(optionally repeating the identifier) and one quality character per base.
+Qualities are stored as they appear in the file; ``FASTQSequence.qualities``
+decodes them as Phred scores. Records wrapped over several lines, which the
+format allows but sequencers never produce, are not supported.
+"""
+
+from tigerlily.sequences.sequence import FormattedSequence, PolymerSequence
+from tigerlily.sequences.batch import ReadBatch
+
+# The number of characters parseFASTQ reads from a file at a time.
+PARSE_BLOCK_SIZE = 2**20
+
+# The number of reads in each batch generated by parseFASTQBatches.
+BATCH_SIZE = 1000
+
+# The approximate number of characters written at a time by writeFASTQ.
+WRITE_BUFFER_SIZE = 2**20
+
+class FASTQSequence(FormattedSequence):
+    r"""Container for a single FASTQ read and its base qualities.
+
+    *quality* must have exactly one character per base. If it is omitted (as
+    it is when another type of sequence is converted to FASTQ) every base gets
+    the quality ``FASTQSequence.DEFAULT_QUALITY``.
+
+    >>> read = FASTQSequence('GATTACA', identifier='read1',
+    ...                      quality='IIIII#!')
+    >>> read.format()
+    '@read1\nGATTACA\n+\nIIIII#!\n'
+    >>> read.qualities()
+    [40, 40, 40, 40, 40, 2, 0]
+    >>> read[4:].quality
+    'I#!'
+    """
+
+    __slots__ = ('_sequence', '_identifier', '_quality')
+
+    # Each base must be one of these (in either case)
+    ALLOWED_CHARS = 'ACGTUN'
+    DEFAULT_QUALITY = 'I'
+
+    def __init__(self,sequence,identifier,quality=None):
+        if quality is None:
+            quality = self.DEFAULT_QUALITY * len(sequence)
+        if len(quality) != len(sequence):
+            raise ValueError('FASTQ quality is not the same length as the '
+                             'sequence')
+        if not self.validate(sequence):
+            raise ValueError('FASTQ sequence contains bad chars')
+
+        self._sequence = sequence
+        self._identifier = identifier
+        self._quality = quality
+
+    @classmethod
+    def _allowed_chars(cls):
+        """Either case of the allowed bases."""
+        return cls.ALLOWED_CHARS.upper() + cls.ALLOWED_CHARS.lower()
+
+    @classmethod
+    def trusted(cls,sequence,identifier=None,quality=None):
+        """Create a FASTQSequence without validating *sequence*. *quality*
+        is still required to match its length."""
+        if quality is None:
+            quality = cls.DEFAULT_QUALITY * len(sequence)
+        if len(quality) != len(sequence):
+            raise ValueError('FASTQ quality is not the same length as the '
+                             'sequence')
+        read = super().trusted(sequence,identifier)
+        read._quality = quality
+        return read
+
+    @property
+    def sequence(self):
+        """The bases of this FASTQSequence."""
+        return self._sequence
+
+    @property
+    def identifier(self):
+        """The identifier of this FASTQSequence."""
+        return self._identifier
+
+    @property
+    def quality(self):
+        """The quality string of this FASTQSequence, one character per base.
+        """
+        return self._quality
+
+    def qualities(self,offset=33):
+        """Return the quality of each base as a list of Phred scores.
+
+        *offset* is the character code of quality 0 - 33 for Sanger and
+        Illumina 1.8+ files, 64 for older Illumina files.
+        """
+        return [ord(c) - offset for c in self._quality]
+
+    def __getitem__(self,key):
+        """Slice the read and its qualities together."""
+        return type(self)(sequence=self._sequence[key],
+                          identifier='{}_subseq'.format(self._identifier),
+                          quality=self._quality[key])
+
+    def _format(self):
+        """Internal function to get a format string from this sequence"""
+        return '@{}\n{}\n+\n{}\n'.format(self._identifier, self._sequence,
+                                         self._quality)
+
+    def write(self,file):
+        """Write this FASTQ read to the opened file object."""
+        file.write(self._format())
+
+
+def parseFASTQ(file=None,data=None):
+    r"""Parse the given file or data and generate ``FASTQSequence`` objects.
+
+    As with ``parseFASTA``, you must specify either *file* (opened in text
+    mode) or *data* (a ``str``) and not both. The input is consumed in blocks
+    of ``PARSE_BLOCK_SIZE`` characters, so files of any size are parsed in
+    constant memory. As with ``parseFASTA``, '\r' line endings are removed.
+
+    >>> example_data = ("@read1\n"
+    ... "GATTACA\n"
+    ... "+\n"
+    ... "IIIIIII\n"
+    ... "@read2 lane 4\n"
+    ... "TTAGN\n"
+    ... "+read2 lane 4\n"
+    ... "II#I!\n"
+    ... )
+    >>> reads = list(parseFASTQ(data=example_data))
+    >>> [(r.identifier, r.sequence, r.quality) for r in reads]
+    [('read1', 'GATTACA', 'IIIIIII'), ('read2 lane 4', 'TTAGN', 'II#I!')]
+    >>> reads = parseFASTQ(data="@r1\r\nACGT\r\n+\r\nIIII\r\n")
+    >>> [(r.identifier, r.sequence, r.quality) for r in reads]
+    [('r1', 'ACGT', 'IIII')]
+    """
+    for lines, count in _line_blocks(file, data):
+        yield from _records(lines, count)
+
+def parseFASTQBatches(file=None,data=None,batch_size=None,columnar=False):
+    """Generate lists of at most *batch_size* (by default ``BATCH_SIZE``)
+    ``FASTQSequence`` objects parsed from *file* or *data*.
+
+    Each list can be handed straight to ``FixedTree.align_batch`` (or the
+    ``align_batch`` of any other index). If *columnar* is True each batch is
+    instead a ``ReadBatch``, which stores the reads in a few shared buffers
+    rather than as one object each.
+
+    >>> data = ''.join('@r{}\\nACGT\\n+\\nIIII\\n'.format(i) for i in range(5))
+    >>> [len(batch) for batch in parseFASTQBatches(data=data, batch_size=2)]
+    [2, 2, 1]
+    >>> next(parseFASTQBatches(data=data, columnar=True)).identifier(3)
+    'r3'
+    """
+    batch_size = batch_size or BATCH_SIZE
+    if columnar:
+        yield from _column_batches(file, data, batch_size)
+        return
+    batch = []
+    for read in parseFASTQ(file=file,data=data):
+        batch.append(read)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _column_batches(file, data, batch_size):
+    """Generate ``ReadBatch`` objects of *batch_size* reads built straight
+    from the parsed lines, without creating a ``FASTQSequence`` per read."""
+    sequences, identifiers, qualities = [], [], []
+    for lines, count in _line_blocks(file, data):
+        _check_records(lines, count)
+        sequences += lines[1:count:4]
+        identifiers += [header[1:] for header in lines[0:count:4]]
+        qualities += lines[3:count:4]
+        while len(sequences) >= batch_size:
+            yield ReadBatch.from_columns(sequences[:batch_size],
+                                         identifiers[:batch_size],
+                                         qualities[:batch_size])
+            del sequences[:batch_size]
+            del identifiers[:batch_size]
+            del qualities[:batch_size]
+    if sequences:
+        yield ReadBatch.from_columns(sequences, identifiers, qualities)
+
+def writeFASTQ(file, *seqs, buffer_size=None):
+    r"""Write any number of sequences to an open writable file as FASTQ.
+
+    Sequences which are not ``FASTQSequence`` objects are converted first, and
+    so get the default quality. As with ``writeFASTA``, any member of *seqs*
+    may also be an iterable of sequences, and output is gathered in to blocks
+    of about *buffer_size* (by default ``WRITE_BUFFER_SIZE``) characters.
+
+    >>> import sys
+    >>> from tigerlily.sequences import NucleicSequence
+    >>> writeFASTQ(sys.stdout, NucleicSequence('ATTTCGAT'))
+    @Unknown
+    ATTTCGAT
+    +
+    IIIIIIII
+    """
+    buffer_size = buffer_size or WRITE_BUFFER_SIZE
+    pending = []
+    pending_size = 0
+
+    for seq in seqs:
+        for read in ([seq] if isinstance(seq, PolymerSequence) else seq):
+            if not isinstance(read, FASTQSequence):
+                read = read.convert(FASTQSequence)
+            text = read._format()
+            pending.append(text)
+            pending_size += len(text)
+            if pending_size >= buffer_size:
+                file.write(''.join(pending))
+                pending = []
+                pending_size = 0
+
+    if pending:
+        file.write(''.join(pending))
+
+def _line_blocks(file, data):
+    """Generate ``(lines, count)`` pairs, where the first *count* of *lines*
+    are whole FASTQ records read from *file* or *data*, with any carriage
+    returns removed (no quality is ever a carriage return)."""
+    if (file and data) or (not file and not data):
+        raise ValueError('You must specify either file or data, but not both')
+
+    if file:
+        blocks = iter(lambda: file.read(PARSE_BLOCK_SIZE), '')
+    else:
+        blocks = (data[i:i+PARSE_BLOCK_SIZE]
+                  for i in range(0,len(data),PARSE_BLOCK_SIZE))
+
+    pending = ''
+    for block in blocks:
+        lines = (pending + block.replace('\r', '')).split('\n')
+        # Keep the unfinished line and any incomplete record for later
+        complete = (len(lines) - 1) // 4 * 4
+        pending = '\n'.join(lines[complete:])
+        yield lines, complete
+
+    lines = pending.split('\n')
+    while lines and not lines[-1]:
+        lines.pop()
+    if len(lines) % 4:
+        raise ValueError('Misformatted FASTQ: truncated record {}'.format(
+                                                                  lines[0]))
+    yield lines, len(lines)
+
+def _check_records(lines, count):
+    """Raise ``ValueError`` unless the first *count* of *lines* are well
+    formed FASTQ records with valid bases and one quality per base.
+
+    The bases of every record are validated together, so that the reads can
+    then be created without validating each again.
+    """
+    bad = FASTQSequence.validate_many(lines[1:count:4])
+    if bad:
+        raise ValueError('FASTQ sequence contains bad chars: {}'.format(
+                                                        lines[4*bad[0]]))
+    for i in range(0, count, 4):
+        header, sequence, separator, quality = lines[i:i+4]
+        if not header.startswith('@') or not separator.startswith('+'):
+            raise ValueError('Misformatted FASTQ record {}'.format(header))
+        if len(sequence) != len(quality):
+            raise ValueError('FASTQ quality is not the same length as the '
+                             'sequence: {}'.format(header))
+
+def _records(lines, count):
+    """Generate a ``FASTQSequence`` for each group of four in the first
+    *count* of *lines*."""
+    _check_records(lines, count)
+    for i in range(0, count, 4):
+        yield FASTQSequence.trusted(lines[i+1], lines[i][1:], lines[i+3])
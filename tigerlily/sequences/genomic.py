@@ -20,7 +20,6 @@
 #   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import re
 import string
 
 from tigerlily.sequences.sequence import PolymerSequence
@@ -29,6 +28,13 @@ from tigerlily.utility import *
 
 COMPLEMENT_TRANS = str.maketrans('atgcATGC','tacgTACG')
 
+# IUPAC_CODES - the bases matched by each IUPAC nucleotide code
+IUPAC_CODES = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT',
+}
+
 class NucleicSequence(PolymerSequence):
     """Container for nucleic (chromosomal DNA) sequences.
     
@@ -70,9 +76,13 @@ class NucleicSequence(PolymerSequence):
     ValueError: Invalid nucleic sequence format: CAGTTACTm
     """
 
-    
+
+    __slots__ = ('_sequence', '_identifier')
+
+    ALLOWED_CHARS = 'ATGC'
+
     def __init__(self,sequence,identifier=None):
-        if not re.match(r'[ATGC]+$',sequence):
+        if not self.validate(sequence):
             raise ValueError('Invalid nucleic sequence format: {}'.format(
                                                     sequence))
 
@@ -195,10 +205,7 @@ class NucleicSequence(PolymerSequence):
         # Before worrying about use_control_codes, just get the full
         # translation.
 
-        aseq=''.join(GENETIC_CODE_CODON[self.sequence[i:i+3]]
-                     for i in range(reading_frame-1,len(self.sequence),3)
-                     if len(self.sequence)-i >= 3
-                    )
+        aseq = _translate_frame(_base_codes(self), reading_frame-1)
 
         if use_control_codes:
             if not 'M' in aseq:
@@ -211,6 +218,31 @@ class NucleicSequence(PolymerSequence):
             aseq = aseq[first_m_pos+1:next_stop_pos]
 
         return AminoSequence(aseq,identifier=self.identifier)
+
+    def translate_frames(self):
+        """Return all six translations of this sequence: reading frames 1, 2
+        and 3 of the sequence and then of its reverse complement.
+
+        The bases are encoded once and each frame is translated with a
+        handful of whole-sequence operations, so this is much faster than
+        six calls to translate(). Codons containing anything but A, C, G and
+        T (or U) translate to X.
+
+        >>> nucleic = NucleicSequence('CATGGTATGTTTTGGGTTTAGAAACGT')
+        >>> for frame in nucleic.translate_frames():
+        ...     print(frame.sequence)
+        HGMFWV*KR
+        MVCFGFRN
+        WYVLGLET
+        TFLNPKHTM
+        RF*TQNIP
+        VSKPKTYH
+        """
+        codes = _base_codes(self)
+        rc_codes = codes[::-1].translate(_COMPLEMENT_CODES)
+        return [AminoSequence(_translate_frame(strand, frame),
+                              identifier=self.identifier)
+                for strand in (codes, rc_codes) for frame in range(3)]
             
             
 
@@ -219,6 +251,11 @@ class AminoSequence(PolymerSequence):
 
     Each member of the sequence must be one of ABCDEFGHIKLMNOPQRSTUVWYZX*
     """
+
+    __slots__ = ('_sequence', '_identifier')
+
+    ALLOWED_CHARS = 'ABCDEFGHIKLMNOPQRSTUVWYZX*'
+    ALLOW_EMPTY = True
     
     def __init__(self,sequence,identifier=None):
         """Create a new AminoSequence, and validates the sequence.
@@ -237,7 +274,7 @@ class AminoSequence(PolymerSequence):
             ...
         ValueError: invalid character in AminoSequence
         """
-        if not re.match(r'[ABCDEFGHIKLMNOPQRSTUVWYZX*]*$',sequence):
+        if not self.validate(sequence):
             raise ValueError('invalid character in AminoSequence')
 
         self._sequence = sequence
@@ -277,10 +314,140 @@ class AminoSequence(PolymerSequence):
         8
         >>> 'AATGATTGT' in trans
         True
+
+        For anything but short sequences there are far too many translations
+        to generate them all - see back_translations().
         """
-        for trans in _translations(self.sequence):
-            yield NucleicSequence(trans,identifier='{}_translation'.format(
-                                                            self.identifier))
+        identifier = '{}_translation'.format(self.identifier)
+        for trans in self.back_translations():
+            yield NucleicSequence(trans,identifier=identifier)
+
+    def back_translations(self):
+        """Return the ``BackTranslations`` of this sequence: every nucleic
+        sequence that could translate in to it, without generating them."""
+        return BackTranslations(self.sequence)
+
+
+class BackTranslations:
+    """The nucleic sequences which could translate in to an amino sequence.
+
+    Back-translations are counted, ranked and generated without building
+    them all, so even a long peptide, with more back-translations than could
+    ever be listed, can be counted, sampled or searched for. The
+    back-translations are ordered as if every position chose its codon from
+    its ``codon_sets`` entry (which is sorted), the last position changing
+    fastest. *sequence* is a ``str`` of amino acids; besides the amino acids
+    of the genetic code, B (N or D), Z (Q or E) and X (anything) are allowed.
+
+    >>> back = BackTranslations('MKW*')
+    >>> len(back)
+    6
+    >>> back.codon_sets
+    (('ATG',), ('AAA', 'AAG'), ('TGG',), ('TAA', 'TAG', 'TGA'))
+    >>> back[4], back.index('ATGAAGTGGTAG')
+    ('ATGAAGTGGTAG', 4)
+    >>> list(back)[:2]
+    ['ATGAAATGGTAA', 'ATGAAATGGTAG']
+    >>> BackTranslations('LSR' * 10).count
+    221073919720733357899776
+    """
+
+    def __init__(self,sequence):
+        codon_sets = []
+        for amino in sequence:
+            if amino not in _AMINO_CODONS:
+                raise ValueError('Amino acid {} can not be back-translated'
+                                 .format(amino))
+            codon_sets.append(_AMINO_CODONS[amino])
+        self.codon_sets = tuple(codon_sets)
+
+        # The number of translations of everything after each position.
+        strides = [1]
+        for codons in reversed(self.codon_sets):
+            strides.append(strides[-1] * len(codons))
+        self.count = strides.pop()
+        self._strides = strides[::-1]
+
+    @property
+    def codon_masks(self):
+        """The codon set of each position as an ``int`` with bit *i* set for
+        each allowed codon whose 2-bit codes (A=0, C=1, G=2, T=3) read as
+        the number *i* - the encoding of ``NucleicSequence.translate_frames``.
+        """
+        return tuple(sum(1 << _codon_index(codon) for codon in codons)
+                     for codons in self.codon_sets)
+
+    def __len__(self):
+        """The number of back-translations. As this may be too large for
+        ``len()``, use ``count`` for long sequences."""
+        return self.count
+
+    def __getitem__(self,rank):
+        """Return the back-translation at position *rank*."""
+        if rank < 0:
+            rank += self.count
+        if not 0 <= rank < self.count:
+            raise IndexError('back-translation rank out of range')
+        codons = []
+        for codon_set, stride in zip(self.codon_sets, self._strides):
+            digit, rank = divmod(rank, stride)
+            codons.append(codon_set[digit])
+        return ''.join(codons)
+
+    def index(self,sequence):
+        """Return the position of the back-translation *sequence*, raising
+        ValueError if it is not one."""
+        if len(sequence) != 3 * len(self.codon_sets):
+            raise ValueError('{} is not a back-translation'.format(sequence))
+        rank = 0
+        for i, (codon_set, stride) in enumerate(zip(self.codon_sets,
+                                                    self._strides)):
+            try:
+                rank += codon_set.index(sequence[3*i:3*i+3]) * stride
+            except ValueError:
+                raise ValueError('{} is not a back-translation'.format(
+                                                            sequence)) from None
+        return rank
+
+    def __contains__(self,sequence):
+        try:
+            self.index(sequence)
+        except ValueError:
+            return False
+        return True
+
+    def sample(self,random=None):
+        """Return a back-translation chosen uniformly at random (using the
+        ``random.Random`` instance *random*, if given)."""
+        if random is None:
+            import random
+        return ''.join(random.choice(codons) for codons in self.codon_sets)
+
+    def __iter__(self):
+        """Generate every back-translation in order.
+
+        The codons are kept in one buffer and each step only rewrites the
+        codons which change - on average little more than one.
+        """
+        buffer = bytearray(''.join(codons[0] for codons in self.codon_sets),
+                           'ascii')
+        choices = [[codon.encode('ascii') for codon in codons]
+                   for codons in self.codon_sets]
+        digits = [0] * len(choices)
+        while True:
+            yield buffer.decode('ascii')
+            position = len(choices) - 1
+            while position >= 0:
+                digits[position] += 1
+                if digits[position] < len(choices[position]):
+                    break
+                digits[position] = 0
+                buffer[3*position:3*position+3] = choices[position][0]
+                position -= 1
+            if position < 0:
+                return
+            buffer[3*position:3*position+3] = \
+                choices[position][digits[position]]
 
         
 def reverse_complement(sequence):
@@ -296,21 +463,44 @@ def reverse_complement(sequence):
     """
     return sequence[::-1].translate(COMPLEMENT_TRANS)
 
-def _translations(sequence):
-    """Recursively return generate all possible translations of the amino seq.
-
-    See AminoSequence.translations() for further details.
+def _base_codes(sequence):
+    """Return the 2-bit code (A=0, C=1, G=2, T=3) of each base of the
+    ``NucleicSequence`` *sequence* as bytes, with 4 for anything else."""
+    if hasattr(sequence, 'codes'):
+        return sequence.codes()
+    return sequence.sequence.encode('ascii', 'replace').translate(_BASE_CODES)
+
+def _translate_frame(codes, offset, table=None):
+    """Translate the codons of *codes* (from ``_base_codes``) starting at
+    *offset*, returning a ``str`` of amino acids.
+
+    Every third code of a frame is read as one big-endian integer, and the
+    three integers are combined in to the 6-bit index of each codon with
+    shifts and ORs - as no code exceeds 3, no bits cross from one byte to the
+    next. Codons containing a code of 4 get index 64 or more. The table
+    ``_CODON_AMINOS`` (or *table*) then turns the indexes in to amino acids in
+    one pass.
     """
-    prefixes = GENETIC_CODE_AMINO[sequence[0]]
-    suffix = sequence[1:]
-    
-    if suffix:
-        for prefix in prefixes:
-            for suf in _translations(suffix):
-                yield '{}{}'.format(prefix,suf)
-    else:
-        for prefix in prefixes:
-            yield prefix
+    count = max(0, (len(codes) - offset) // 3)
+    end = offset + 3*count
+    invalid = None
+    if codes.translate(None, b'\x00\x01\x02\x03'):
+        invalid = codes.translate(_INVALID)
+        codes = codes.translate(_LOW_BITS)
+
+    index = 0
+    for k in range(3):
+        index = (index << 2) | int.from_bytes(codes[offset+k:end:3], 'big')
+    if invalid is not None:
+        for k in range(3):
+            index |= int.from_bytes(invalid[offset+k:end:3], 'big') << 6
+    return index.to_bytes(count, 'big').translate(table or _CODON_AMINOS).decode(
+                                                                    'ascii')
+
+def _codon_index(codon):
+    """Return the 6-bit index of *codon* used by ``_CODON_AMINOS``."""
+    return sum('ACGT'.index(base) << shift
+               for base, shift in zip(codon, (4, 2, 0)))
 
 
 #### Genetic Code matrix   ####
@@ -373,3 +563,22 @@ def _generate_inverse_gc_matrix(matrix):
 # GENETIC_CODE_CODON - the genetic code, going from codon to amino acid
 GENETIC_CODE_CODON = _generate_inverse_gc_matrix(GENETIC_CODE_AMINO)
 
+# Tables for _translate_frame: letters to 2-bit codes (4 for anything else),
+# codes to their complements, codes to 0-3 and to an invalid flag, and 7-bit
+# codon indexes (64 and up for invalid codons) to amino acids.
+_BASE_CODES = bytes('ACGT'.find(chr(c).upper().replace('U', 'T')) % 5
+                    for c in range(256))
+_COMPLEMENT_CODES = bytes.maketrans(b'\x00\x01\x02\x03', b'\x03\x02\x01\x00')
+_LOW_BITS = bytes(c if c < 4 else 0 for c in range(256))
+_INVALID = bytes(0 if c < 4 else 1 for c in range(256))
+_CODON_AMINOS = bytes(ord(GENETIC_CODE_CODON[''.join(
+                          'ACGT'[i >> shift & 3] for shift in (4, 2, 0))])
+                      if i < 64 else ord('X') for i in range(256))
+
+# The sorted codons of each amino acid which can be back-translated,
+# including the ambiguity codes B (Asx), Z (Glx) and X (any).
+_AMINO_CODONS = {amino: tuple(sorted(codons))
+                 for amino, codons in GENETIC_CODE_AMINO.items()}
+_AMINO_CODONS['B'] = tuple(sorted(_AMINO_CODONS['N'] + _AMINO_CODONS['D']))
+_AMINO_CODONS['Z'] = tuple(sorted(_AMINO_CODONS['Q'] + _AMINO_CODONS['E']))
+_AMINO_CODONS['X'] = tuple(sorted(GENETIC_CODE_CODON))
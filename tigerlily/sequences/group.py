@@ -0,0 +1,192 @@
+# group.py - Groups of sequences in one contiguous buffer
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Groups of named sequences, such as the chromosomes of a genome.
+
+A ``PolymerSequenceGroup`` holds every sequence of a genome in one buffer of
+bases with a table of offsets and identifiers, like a ``ReadBatch`` (which it
+extends). Unlike the generator returned by ``GRCGenome.sequences()`` it can be
+read any number of times, so an index that makes several passes over a
+genome - or several indexes built from the same genome - parse the FASTA
+files only once. Groups can be stored to disk and memory-mapped back, and
+pickle cheaply for worker processes.
+
+>>> import os, tempfile
+>>> from tigerlily.sequences import FASTASequence
+>>> group = createGenomicSequenceGroup([FASTASequence('GATTACA', 'chr1'),
+...                                     FASTASequence('CCGGNA', 'chr2')])
+>>> len(group), group.names()
+(2, ['chr1', 'chr2'])
+>>> group['chr2'].sequence
+'CCGGNA'
+>>> filename = os.path.join(tempfile.mkdtemp(), 'genome.group')
+>>> group.store(filename)
+>>> stored = PolymerSequenceGroup.load(filename)
+>>> [(seq.identifier, seq.data) for seq in stored.sequences()]
+[('chr1', b'GATTACA'), ('chr2', b'CCGGNA')]
+"""
+
+from tigerlily.sequences.batch import ReadBatch
+from tigerlily.sequences.fasta import BinaryFASTASequence
+from tigerlily.utility.mapped import (store_arrays, load_arrays,
+    pack_strings, unpack_strings)
+
+# Identifies files written by PolymerSequenceGroup.store, and their layout.
+GROUP_MAGIC = b'TLSG'
+GROUP_VERSION = 1
+
+class PolymerSequenceGroup(ReadBatch):
+    """A reusable group of sequences stored in one contiguous buffer.
+
+    *sequences* may be any iterable of sequences, or anything with a
+    ``sequences()`` method such as a ``GRCGenome``. Sequences are fetched by
+    position or by identifier with ``group[key]``, and ``sequences()``
+    generates them all in order, so a group can be given as the *genome* of
+    any index.
+
+    Sequences of a group built in memory are ``SequenceView`` objects sharing
+    its buffer. Those of a group opened with ``load()`` are
+    ``BinaryFASTASequence`` objects, whose bytes are copied out of the
+    memory-mapped file when each is requested.
+    """
+
+    def __init__(self, sequences=(), intern=False):
+        if hasattr(sequences, 'sequences'):
+            sequences = sequences.sequences()
+        self._filename = None
+        self._positions = None
+        super().__init__(sequences, intern=intern)
+
+    def append(self, read, identifier=None, quality=None):
+        """Add a sequence to the group. Groups opened with ``load()`` are
+        read-only."""
+        if self._filename is not None:
+            raise ValueError('Sequence group {} is read-only'.format(
+                                                            self._filename))
+        super().append(read, identifier, quality)
+        self._positions = None
+
+    def __getitem__(self, key):
+        """Return the sequence at position *key*, or with identifier *key*.
+        """
+        if isinstance(key, str):
+            key = self.index(key)
+        if self._filename is None:
+            return super().__getitem__(key)
+        start, end = self._span(key)
+        return BinaryFASTASequence.trusted(bytes(self._bases[start:end]),
+                                           self._identifiers[key])
+
+    def __contains__(self, identifier):
+        return identifier in self._name_positions()
+
+    def index(self, identifier):
+        """Return the position of the first sequence called *identifier*,
+        raising KeyError if there is none."""
+        return self._name_positions()[identifier]
+
+    def names(self):
+        """Return the list of sequence identifiers, in order."""
+        return list(self._identifiers)
+
+    def _name_positions(self):
+        """Return the dict of positions by identifier, building it the first
+        time it is needed."""
+        if self._positions is None:
+            self._positions = {}
+            for position, name in enumerate(self._identifiers):
+                self._positions.setdefault(name, position)
+        return self._positions
+
+    def store(self, filename):
+        """Write the group to *filename*, to be memory-mapped by ``load()``.
+
+        Bases must be ASCII. If *filename* already exists, EnvironmentError
+        will be raised.
+        """
+        self._flush()
+        bases = self._bases
+        if isinstance(bases, str):
+            bases = bases.encode('ascii')
+        qualities = self._qualities
+        if isinstance(qualities, str):
+            qualities = qualities.encode('ascii')
+        name_ends, names = pack_strings(['' if name is None else name
+                                         for name in self._identifiers])
+        store_arrays(filename, GROUP_MAGIC,
+                     [GROUP_VERSION, qualities is not None],
+                     [self._ends, bases, name_ends, names, qualities or b''])
+
+    @classmethod
+    def load(cls, filename):
+        """Open a group written by ``store()``, without reading its bases in
+        to memory. The result is read-only, and pickles as just its filename.
+        """
+        (version, has_qualities), arrays = load_arrays(filename, GROUP_MAGIC)
+        if version != GROUP_VERSION:
+            raise ValueError('File {} is a sequence group of unknown version '
+                             '{}'.format(filename, version))
+        group = cls()
+        group._ends = arrays[0]
+        group._bases = arrays[1]
+        group._identifiers = unpack_strings(arrays[2], arrays[3])
+        group._qualities = arrays[4] if has_qualities else None
+        group._filename = filename
+        return group
+
+    def __reduce__(self):
+        """Pickle a stored group as its filename, and any other group as its
+        buffers - either way without a pickled object per sequence."""
+        if self._filename is not None:
+            return (type(self).load, (self._filename,))
+        self._flush()
+        return (_unpickle_group, (type(self), self._bases, self._qualities,
+                                  self._ends, self._identifiers))
+
+
+def createGenomicSequenceGroup(sequences, intern=False):
+    """Return a ``PolymerSequenceGroup`` of *sequences* (as for the group's
+    constructor), checking that each is a nucleic sequence.
+
+    Bases may be A, C, G, T or N in either case, so soft-masked genomes are
+    accepted; ValueError is raised for anything else.
+    """
+    group = PolymerSequenceGroup(sequences, intern=intern)
+    group._flush()
+    if group._bases.translate(_GENOMIC_DELETIONS):
+        bad = next(name for name, bases in zip(group.names(), group.strings())
+                   if bases.translate(_GENOMIC_DELETIONS))
+        raise ValueError('Sequence {} is not a nucleic sequence'.format(bad))
+    return group
+
+def _unpickle_group(cls, bases, qualities, ends, identifiers):
+    """Rebuild a group pickled by ``PolymerSequenceGroup.__reduce__``."""
+    group = cls()
+    group._bases = bases
+    group._qualities = qualities
+    group._ends = ends
+    group._identifiers = identifiers
+    return group
+
+# A str.translate table deleting every base allowed in a genomic group.
+_GENOMIC_DELETIONS = str.maketrans('', '', 'ACGTNacgtn')
@@ -0,0 +1,178 @@
+# orf.py - Open reading frame detection
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""Find the open reading frames of whole genomes.
+
+An open reading frame (ORF) here runs from a start codon (ATG) to the next
+stop codon in the same frame, including the stop codon. Where a frame has
+several start codons before a stop, only the first is used, so ORFs never
+overlap within a frame. ORFs with no stop codon before the end of the
+sequence are not reported.
+
+``findORFs`` reads each sequence in chunks of ``ORF_CHUNK_SIZE`` bases and
+scans all six frames of a chunk before moving on, so neither the translation
+nor the reverse complement of a whole chromosome is ever built. Reverse
+strand ORFs are found while reading the forward strand, by translating each
+codon straight to the amino acid of its reverse complement.
+"""
+
+from tigerlily.sequences.sequence import PolymerSequence
+from tigerlily.sequences.genomic import (GENETIC_CODE_CODON, _BASE_CODES,
+    _translate_frame,
+)
+
+# The default least number of codons (from the start codon up to but
+# excluding the stop codon) in a reported ORF.
+MINIMUM_ORF_LENGTH = 100
+
+# The number of bases findORFs scans at a time. Must be a multiple of 3.
+ORF_CHUNK_SIZE = 3 * 2**20
+
+def findORFs(sequences, minimum_length=None, chunk_size=None):
+    """Generate every ORF of at least *minimum_length* codons (by default
+    ``MINIMUM_ORF_LENGTH``) in *sequences*, in all six frames.
+
+    *sequences* may be a single sequence, any iterable of sequences, or an
+    object with a ``sequences()`` method such as a ``GRCGenome``. Each ORF is
+    the tuple (identifier, start, end, strand, frame):
+
+        * *start* and *end* are the 0-based, end-excluded positions of the
+          ORF on the forward strand, including its stop codon;
+        * *strand* is True for the forward strand and False for the reverse
+          complement, as in alignments;
+        * *frame* is 0, 1 or 2: the offset of the ORF's codons from the start
+          of its strand.
+
+    ORFs are generated a chunk at a time, in no particular order within each
+    chunk.
+
+    >>> from tigerlily.sequences import NucleicSequence
+    >>> seq = NucleicSequence('CCATGAAATTTTAGGCTATTTCATGG', identifier='s')
+    >>> sorted(findORFs(seq, minimum_length=2))
+    [('s', 2, 14, True, 2), ('s', 15, 24, False, 2)]
+    """
+    if hasattr(sequences, 'sequences'):
+        sequences = sequences.sequences()
+    elif isinstance(sequences, PolymerSequence):
+        sequences = [sequences]
+    if minimum_length is None:
+        minimum_length = MINIMUM_ORF_LENGTH
+    chunk_size = -(-(chunk_size or ORF_CHUNK_SIZE) // 3) * 3
+
+    for sequence in sequences:
+        yield from _sequence_orfs(sequence, minimum_length, chunk_size)
+
+def _sequence_orfs(sequence, minimum_length, chunk_size):
+    """Generate the ORFs of one sequence for ``findORFs``."""
+    identifier = sequence.identifier
+    length, chunks = _chunk_codes(sequence, chunk_size)
+
+    # The scanning state of each of the three codon phases: the codon index
+    # of the first start codon of an unfinished forward ORF, and of the
+    # latest reverse strand stop codon and the start codon following it.
+    forward_start = [None] * 3
+    reverse_stop = [None] * 3
+    reverse_start = [None] * 3
+    found = []
+
+    for number, codes in enumerate(chunks):
+        base = number * chunk_size // 3
+        for phase in range(3):
+            forward = _translate_frame(codes, phase)
+            start = forward_start[phase]
+            position = 0
+            while True:
+                if start is None:
+                    m = forward.find('M', position)
+                    if m < 0:
+                        break
+                    start = base + m
+                    position = m
+                s = forward.find('*', position)
+                if s < 0:
+                    break
+                if base + s - start >= minimum_length:
+                    found.append((start, base + s, True, phase))
+                start = None
+                position = s + 1
+            forward_start[phase] = start
+
+            reverse = _translate_frame(codes, phase, _REVERSE_CODON_AMINOS)
+            stop, start = reverse_stop[phase], reverse_start[phase]
+            position = 0
+            while True:
+                s = reverse.find('*', position)
+                if stop is not None:
+                    m = reverse.rfind('M', position, len(reverse) if s < 0
+                                                     else s)
+                    if m >= 0:
+                        start = base + m
+                if s < 0:
+                    break
+                if start is not None and start - stop >= minimum_length:
+                    found.append((stop, start, False, phase))
+                stop, start = base + s, None
+                position = s + 1
+            reverse_stop[phase], reverse_start[phase] = stop, start
+
+        yield from _orf_records(found, identifier, length)
+        found = []
+
+    for phase in range(3):
+        stop, start = reverse_stop[phase], reverse_start[phase]
+        if start is not None and start - stop >= minimum_length:
+            found.append((stop, start, False, phase))
+    yield from _orf_records(found, identifier, length)
+
+def _orf_records(found, identifier, length):
+    """Turn the (first codon, last codon, strand, phase) of each ORF in
+    *found* in to an ORF record, given the *length* of the sequence (on which
+    the frame of reverse strand ORFs depends)."""
+    for first, last, strand, phase in found:
+        start, end = 3*first + phase, 3*last + phase + 3
+        frame = phase if strand else (length - end) % 3
+        yield (identifier, start, end, strand, frame)
+
+def _chunk_codes(sequence, chunk_size):
+    """Return the length of *sequence* and a generator of its 2-bit codes
+    ``chunk_size`` bases at a time. Each chunk runs on 2 bases in to the
+    next, so that every codon starting in a chunk is complete."""
+    if hasattr(sequence, 'codes'):
+        # Packed sequences slice without copying, then decode each slice.
+        chunks = (sequence[start:start+chunk_size+2].codes()
+                  for start in range(0, len(sequence), chunk_size))
+        return len(sequence), chunks
+
+    data = getattr(sequence, 'data', None) or sequence.sequence
+    chunks = (data[start:start+chunk_size+2] for start in range(0, len(data),
+                                                                chunk_size))
+    if isinstance(data, str):
+        chunks = (chunk.encode('ascii', 'replace') for chunk in chunks)
+    return len(data), (chunk.translate(_BASE_CODES) for chunk in chunks)
+
+
+# The amino acid of the reverse complement of each forward codon index, in
+# the layout of genomic._CODON_AMINOS.
+_REVERSE_CODON_AMINOS = bytes(ord(GENETIC_CODE_CODON[''.join(
+                              'TGCA'[i >> shift & 3] for shift in (0, 2, 4))])
+                              if i < 64 else ord('X') for i in range(256))
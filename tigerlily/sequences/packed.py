@@ -0,0 +1,264 @@
+# packed.py - Nucleic sequences stored with 2 bits per base
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""A ``NucleicSequence`` which stores its bases packed 4 to a byte.
+
+Each base is stored as a 2-bit code (A=0, C=1, G=2, T=3), the same codes used
+by ``tigerlily.index.kmer``. Runs of N are stored separately, as a list of
+(start, end) ranges, with code 0 in their place. The packed bytes and the N
+ranges are never modified, so any number of sequences can share them:
+
+    * slicing with a step of 1 returns a view of the same bytes;
+    * ``reverse``, ``complement`` and ``reverse_complement`` return a view
+      with a flag flipped, since reversing is just reading the other way and
+      the complement of a code is ``3 - code``;
+    * ``sequence`` decodes the bases each time it is read, so nothing but the
+      packed bytes is kept.
+
+Packing and unpacking treat the codes as one large integer, so that the work
+is done by C loops instead of one Python operation per base.
+"""
+
+import array
+import re
+from bisect import bisect_right
+
+from tigerlily.sequences.genomic import NucleicSequence
+
+# Translate tables between letters and 2-bit codes (with 4 for N).
+_ENCODE = bytes.maketrans(b'ACGTN', b'\x00\x01\x02\x03\x00')
+_DECODE = bytes.maketrans(b'\x00\x01\x02\x03', b'ACGT')
+_DECODE_COMPLEMENT = bytes.maketrans(b'\x00\x01\x02\x03', b'TGCA')
+_COMPLEMENT_CODES = bytes.maketrans(b'\x00\x01\x02\x03', b'\x03\x02\x01\x00')
+
+class PackedNucleicSequence(NucleicSequence):
+    """A ``NucleicSequence`` holding 2 bits per base.
+
+    *sequence* may be a ``str`` or ASCII ``bytes`` of the bases A, C, G, T and
+    N, which are packed immediately. Otherwise this behaves exactly like a
+    ``NucleicSequence`` (except that N is allowed).
+
+    >>> seq = PackedNucleicSequence('GATTACANNNCAT', identifier='seq1')
+    >>> len(seq), seq.sequence
+    (13, 'GATTACANNNCAT')
+    >>> seq[4:11].sequence
+    'ACANNNC'
+    >>> seq.reverse_complement().sequence
+    'ATGNNNTGTAATC'
+    >>> seq.reverse_complement()[1:5].complement().sequence
+    'ACNN'
+    >>> list(seq[:4].codes())
+    [2, 0, 3, 3]
+    >>> seq.packed_size()
+    4
+    """
+
+    __slots__ = ('_packed', '_n_starts', '_n_ends', '_start', '_length',
+                 '_reversed', '_complemented')
+
+    ALLOWED_CHARS = 'ACGTN'
+
+    def __init__(self,sequence,identifier=None):
+        if isinstance(sequence, str):
+            data = sequence.encode('ascii', 'replace')
+        else:
+            data = bytes(sequence)
+        if not self.validate(data):
+            raise ValueError('Invalid nucleic sequence format: {}'.format(
+                                                    sequence))
+
+        runs = [match.span() for match in re.finditer(b'N+', data)]
+        self._packed = _pack(data.translate(_ENCODE))
+        self._n_starts = array.array('Q', [start for start, end in runs])
+        self._n_ends = array.array('Q', [end for start, end in runs])
+        self._start = 0
+        self._length = len(data)
+        self._reversed = False
+        self._complemented = False
+        self._identifier = identifier
+
+    @classmethod
+    def trusted(cls,sequence,identifier=None):
+        """Packing checks the bases anyway, so this is the same as creating
+        a ``PackedNucleicSequence`` normally."""
+        return cls(sequence,identifier)
+
+    def _view(self, start, length, reversed, complemented):
+        """Return a sequence sharing this one's packed bases."""
+        view = object.__new__(type(self))
+        view._packed = self._packed
+        view._n_starts = self._n_starts
+        view._n_ends = self._n_ends
+        view._start = start
+        view._length = length
+        view._reversed = reversed
+        view._complemented = complemented
+        view._identifier = self._identifier
+        return view
+
+    def __len__(self):
+        return self._length
+
+    def packed_size(self):
+        """Return the number of bytes of packed bases this sequence uses
+        (which may be shared with other sequences)."""
+        return len(self._packed)
+
+    @property
+    def sequence(self):
+        """The bases of this sequence, decoded to a ``str``."""
+        data = _unpack(self._packed, self._start, self._start + self._length)
+        data = data.translate(_DECODE_COMPLEMENT if self._complemented
+                              else _DECODE)
+        data = self._mask(bytearray(data), b'N')
+        if self._reversed:
+            data = data[::-1]
+        return data.decode('ascii')
+
+    def codes(self):
+        """Return the 2-bit code of each base (in reading order) as
+        ``bytes``, with 4 for N. This is the encoding of
+        ``tigerlily.index.kmer``.
+        """
+        data = _unpack(self._packed, self._start, self._start + self._length)
+        if self._complemented:
+            data = data.translate(_COMPLEMENT_CODES)
+        data = self._mask(bytearray(data), b'\x04')
+        if self._reversed:
+            data = data[::-1]
+        return bytes(data)
+
+    def _mask(self, data, fill):
+        """Overwrite the N runs falling in this view of *data* with *fill*.
+        """
+        start, end = self._start, self._start + self._length
+        first = bisect_right(self._n_ends, start)
+        for i in range(first, len(self._n_starts)):
+            run_start, run_end = self._n_starts[i], self._n_ends[i]
+            if run_start >= end:
+                break
+            run_start, run_end = max(run_start, start), min(run_end, end)
+            data[run_start-start:run_end-start] = fill * (run_end - run_start)
+        return data
+
+    def __getitem__(self,key):
+        """Slice the sequence. Slices with a step of 1 share the packed bases
+        and take constant time; other keys decode only the bases they cover.
+
+        >>> seq = PackedNucleicSequence('GATTACANNNCAT').reverse_complement()
+        >>> seq.sequence
+        'ATGNNNTGTAATC'
+        >>> seq[0].sequence, seq[4].sequence, seq[-1].sequence
+        ('A', 'N', 'C')
+        >>> seq[::2].sequence, seq[10:1:-3].sequence
+        ('AGNTTAC', 'AGN')
+        """
+        if not isinstance(key, slice):
+            return type(self)(self._base(key),
+                              identifier='{}_subseq'.format(self.identifier))
+        if key.step not in (None, 1):
+            positions = range(*key.indices(self._length))
+            if not positions:
+                return self[0:0]
+            low = min(positions[0], positions[-1])
+            high = max(positions[0], positions[-1]) + 1
+            bases = self[low:high].sequence[positions[0]-low::key.step]
+            return type(self)(bases,
+                              identifier='{}_subseq'.format(self.identifier))
+        begin, end, step = key.indices(self._length)
+        end = max(begin, end)
+        if self._reversed:
+            start = self._start + self._length - end
+        else:
+            start = self._start + begin
+        view = self._view(start, end - begin, self._reversed,
+                          self._complemented)
+        view._identifier = '{}_subseq'.format(self.identifier)
+        return view
+
+    def _base(self,index):
+        """Return the base at *index* as a one letter ``str``."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('sequence index out of range')
+        if self._reversed:
+            position = self._start + self._length - 1 - index
+        else:
+            position = self._start + index
+        run = bisect_right(self._n_ends, position)
+        if run < len(self._n_starts) and self._n_starts[run] <= position:
+            return 'N'
+        code = _unpack(self._packed, position, position + 1)
+        return code.translate(_DECODE_COMPLEMENT if self._complemented
+                              else _DECODE).decode('ascii')
+
+    def view(self,start=0,end=None,forward=True):
+        """Return bases *start* to *end* (of the reverse complement if
+        *forward* is False). Packed sequences are already views, so this is
+        just a slice."""
+        view = self[start:end]
+        return view if forward else view.reverse_complement()
+
+    def reverse(self):
+        """Return the reverse of this sequence, without copying it."""
+        return self._view(self._start, self._length, not self._reversed,
+                          self._complemented)
+
+    def complement(self):
+        """Return the complement of this sequence, without copying it."""
+        return self._view(self._start, self._length, self._reversed,
+                          not self._complemented)
+
+    def reverse_complement(self):
+        """Return the reverse complement of this sequence, without copying
+        it."""
+        return self._view(self._start, self._length, not self._reversed,
+                          not self._complemented)
+
+
+def _pack(codes):
+    """Pack *codes* (bytes of values 0 to 3) 4 to a byte, first base in the
+    highest bits.
+
+    Each of the four interleaved slices of *codes* is read as a big-endian
+    integer. Since no byte of those integers exceeds 3, shifting by 2, 4 or 6
+    bits never carries in to the next byte, so OR-ing the shifted integers
+    packs every byte at once.
+    """
+    padded = codes + bytes(-len(codes) % 4)
+    value = 0
+    for k in range(4):
+        value |= int.from_bytes(padded[k::4], 'big') << (6 - 2*k)
+    return value.to_bytes(len(padded) // 4, 'big')
+
+def _unpack(packed, start, end):
+    """Return the codes of bases *start* to *end* of *packed* as bytes."""
+    first = start // 4
+    chunk = packed[first:(end + 3) // 4]
+    size = len(chunk)
+    value = int.from_bytes(chunk, 'big')
+    mask = int.from_bytes(b'\x03' * size, 'big')
+    codes = bytearray(4 * size)
+    for k in range(4):
+        codes[k::4] = ((value >> (6 - 2*k)) & mask).to_bytes(size, 'big')
+    return bytes(codes[start - 4*first:end - 4*first])
@@ -50,10 +50,19 @@ class RawSequence(sequence.FormattedSequence):
 
     """
 
+    __slots__ = ('_sequence', '_identifier', '_line')
+
     def __init__(self,sequence,identifier=None):
         self._sequence = sequence
         self._identifier = identifier
-    
+        self._line = None
+
+    @classmethod
+    def trusted(cls,sequence,identifier=None):
+        """Raw sequences are never validated, so this is the same as creating
+        a ``RawSequence`` normally."""
+        return cls(sequence,identifier)
+
     @property
     def sequence(self):
         return self._sequence
@@ -63,6 +72,10 @@ class RawSequence(sequence.FormattedSequence):
         # Maybe there is an identifier even though this is Raw?
         if self._identifier is not None:
             return self._identifier
+        # Sequences from parseRaw are named after their line, but the name is
+        # only made when it is asked for.
+        if self._line is not None:
+            return 'RawSeq_Line{}'.format(self._line)
         # Nothing worked, use the default.
         return super().identifier
 
@@ -126,5 +139,7 @@ def parseRaw(file=None,data=None):
         seq = line.rstrip()
         if not seq:
             continue
-        yield RawSequence(seq,identifier='RawSeq_Line{}'.format(line_num))
+        raw = RawSequence(seq)
+        raw._line = line_num
+        yield raw
 
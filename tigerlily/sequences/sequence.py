@@ -35,6 +35,16 @@ class PolymerSequence(metaclass=abc.ABCMeta):
     See the documentation for this module for examples on using this class.
     """
 
+    # Sequences are often created by the million, so no class in this package
+    # gives its instances a __dict__.
+    __slots__ = ()
+
+    # The characters a sequence may contain, or None to allow anything. Checked
+    # by validate(); subclasses may instead override _allowed_chars().
+    ALLOWED_CHARS = None
+    # Whether the empty sequence is valid.
+    ALLOW_EMPTY = False
+
     @abc.abstractmethod
     def __init__(self,sequence=None,identifier=None):
         """All subclasses of ``PolymerSequence`` must have an initializer which
@@ -77,6 +87,92 @@ class PolymerSequence(metaclass=abc.ABCMeta):
         """
         return 'Unknown' # Use if all else fails. :)
 
+    @classmethod
+    def _allowed_chars(cls):
+        """Return the ``str`` of characters a sequence of this class may
+        contain, or None if any are allowed."""
+        return cls.ALLOWED_CHARS
+
+    @classmethod
+    def _deletions(cls):
+        """Return the allowed characters as ASCII ``bytes``, for deleting them
+        with ``bytes.translate``, or None if any are allowed. The result is
+        cached on each class."""
+        allowed = cls._allowed_chars()
+        cached = cls.__dict__.get('_DELETIONS')
+        if cached is None or cached[0] != allowed:
+            cached = (allowed, None if allowed is None
+                               else allowed.encode('ascii'))
+            cls._DELETIONS = cached
+        return cached[1]
+
+    @classmethod
+    def validate(cls,sequence):
+        """Return True if *sequence* (a ``str`` or bytes-like object) is valid
+        as the sequence of this class.
+
+        Every allowed character is deleted with one ``bytes.translate`` call,
+        and the sequence is valid if nothing is left - much cheaper than a
+        regular expression.
+
+        >>> from tigerlily.sequences import NucleicSequence
+        >>> NucleicSequence.validate('GATTACA'), NucleicSequence.validate('GAX')
+        (True, False)
+        >>> NucleicSequence.validate(memoryview(b'ACGT'))
+        True
+        """
+        deletions = cls._deletions()
+        if deletions is None:
+            return True
+        if not sequence:
+            return cls.ALLOW_EMPTY
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        elif not isinstance(sequence, bytes):
+            sequence = bytes(sequence)
+        return not sequence.translate(None, deletions)
+
+    @classmethod
+    def validate_many(cls,sequences):
+        """Return the positions in *sequences* of every sequence that is not
+        valid for this class (so an empty list if all of them are).
+
+        The sequences are checked together in one pass when they are all
+        valid, which is much faster than calling validate() on each of many
+        short reads.
+
+        >>> from tigerlily.sequences import NucleicSequence
+        >>> NucleicSequence.validate_many(['ACGT', 'GATTACA', 'CAT'])
+        []
+        >>> NucleicSequence.validate_many(['ACGT', 'GAXTACA', '', 'CAT'])
+        [1, 2]
+        """
+        if cls._deletions() is None:
+            return []
+        sequences = list(sequences)
+        if not sequences:
+            return []
+        joined = sequences[0][:0].join(sequences)
+        if cls.ALLOW_EMPTY or all(sequences):
+            if cls.validate(joined):
+                return []
+        return [i for i, sequence in enumerate(sequences)
+                if not cls.validate(sequence)]
+
+    @classmethod
+    def trusted(cls,sequence,identifier=None):
+        """Create a sequence of this class without validating *sequence*.
+
+        Only use this for sequences already known to be valid, such as those
+        checked with validate_many(), or converted from a class which allows
+        fewer characters. Subclasses which store more than a sequence and an
+        identifier override this.
+        """
+        seq = cls.__new__(cls)
+        seq._sequence = sequence
+        seq._identifier = identifier
+        return seq
+
     def convert(self,to_type):
         """Return this sequence as an instance of to_type.
 
@@ -85,8 +181,13 @@ class PolymerSequence(metaclass=abc.ABCMeta):
 
         No checking is made to ensure that to_type is a subclass of
         PolymerSequence, but it would probably be bad to pass in a type that
-        isn't a PolymerSequence type.
+        isn't a PolymerSequence type. If to_type declares its own
+        ALLOWED_CHARS (or trusted()) and every character this sequence's class
+        allows is also allowed by to_type, the sequence is not validated
+        again. Otherwise to_type is always created through its constructor.
         """
+        if _accepts(to_type, type(self)):
+            return to_type.trusted(self.sequence,identifier=self.identifier)
         return to_type(sequence=self.sequence,identifier=self.identifier)
 
     def __getitem__(self,key):
@@ -98,6 +199,108 @@ class PolymerSequence(metaclass=abc.ABCMeta):
         return type(self)(sequence=self.sequence[key],
                           identifier='{}_subseq'.format(self.identifier))
 
+    def view(self,start=0,end=None,forward=True):
+        """Return a ``SequenceView`` of bases *start* to *end* of this
+        sequence, which shares its bases instead of copying them."""
+        return SequenceView(self,start=start,end=end,forward=forward)
+
+
+class SequenceView(PolymerSequence):
+    """A read-only window on to part of another sequence, which copies none
+    of its bases.
+
+    A view holds a reference to the string of bases of *sequence* (any
+    ``PolymerSequence``, another ``SequenceView`` or a ``str``) along with the
+    offset and length of the window. Bases are only copied when ``sequence``
+    is read, so windows and regions can be cut from a chromosome without any
+    allocation per slice. If *forward* is False the view is of the reverse
+    complement of the window. The identifier defaults to that of *sequence*
+    with '_subseq' appended, and is likewise only built when it is read.
+
+    >>> from tigerlily.sequences import NucleicSequence
+    >>> chromosome = NucleicSequence('GATTACAGATTACA', identifier='chr1')
+    >>> view = chromosome.view(3, 9)
+    >>> len(view), view.sequence, view.identifier
+    (6, 'TACAGA', 'chr1_subseq')
+    >>> view.reverse_complement().sequence
+    'TCTGTA'
+    >>> view.reverse_complement()[1:3].sequence
+    'CT'
+    >>> view.convert(NucleicSequence).sequence
+    'TACAGA'
+    """
+
+    __slots__ = ('_text', '_start', '_length', '_forward', '_identifier',
+                 '_parent')
+
+    def __init__(self,sequence,identifier=None,start=0,end=None,
+                 forward=True):
+        if isinstance(sequence, SequenceView):
+            text, offset, length = (sequence._text, sequence._start,
+                                    sequence._length)
+            parent_forward = sequence._forward
+        else:
+            text = sequence if isinstance(sequence, str) else sequence.sequence
+            offset, length, parent_forward = 0, len(text), True
+
+        start, end, step = slice(start, end).indices(length)
+        end = max(start, end)
+        if not parent_forward:
+            start, end = length - end, length - start
+
+        self._text = text
+        self._start = offset + start
+        self._length = end - start
+        self._forward = forward == parent_forward
+        self._identifier = identifier
+        self._parent = sequence
+
+    @property
+    def sequence(self):
+        """The bases of this view, copied in to a new ``str``."""
+        bases = self._text[self._start:self._start+self._length]
+        if not self._forward:
+            from tigerlily.sequences.genomic import reverse_complement
+            bases = reverse_complement(bases)
+        return bases
+
+    @property
+    def identifier(self):
+        """The identifier of this view."""
+        if self._identifier is None:
+            if isinstance(self._parent, str):
+                return super().identifier
+            return '{}_subseq'.format(self._parent.identifier)
+        return self._identifier
+
+    @property
+    def start(self):
+        """The offset of the first base of this view in the original
+        string of bases (whichever strand the view is of)."""
+        return self._start
+
+    @property
+    def forward(self):
+        """False if this view is of the reverse complement strand."""
+        return self._forward
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self,key):
+        """Slices with a step of 1 return another view; other slices copy."""
+        if isinstance(key, slice) and key.step in (None, 1):
+            return SequenceView(self, start=key.start, end=key.stop)
+        return SequenceView(self.sequence[key], identifier=self.identifier)
+
+    def reverse_complement(self):
+        """Return a view of the reverse complement of this view."""
+        view = SequenceView(self)
+        view._forward = not self._forward
+        view._identifier = self._identifier
+        view._parent = self._parent
+        return view
+
 
 class FormattedSequence(PolymerSequence,metaclass=abc.ABCMeta):
     """Abstract base class for PolymerSequence objects which can be formatted.
@@ -106,7 +309,9 @@ class FormattedSequence(PolymerSequence,metaclass=abc.ABCMeta):
     format. In particular, they support a  .format() method and a .write()
     method.
     """
-    
+
+    __slots__ = ()
+
     def format(self,to_type=None):
         """Return a string representing this sequence in the perscribed format.
 
@@ -152,3 +357,36 @@ class FormattedSequence(PolymerSequence,metaclass=abc.ABCMeta):
         raise NotImplementedError('Attempt to call abstract method `write`')
 
 
+# Whether each (to_type, from_type) pair of classes needs no validation when
+# converting, keyed with the allowed characters of both in case they change.
+_ACCEPTS = {}
+
+def _accepts(to_type, from_type):
+    """Return True if every sequence valid for *from_type* is valid for
+    *to_type*, so ``convert`` can use ``to_type.trusted``.
+
+    Only classes which themselves declare ``ALLOWED_CHARS``,
+    ``_allowed_chars`` or ``trusted`` qualify: any other class may set up its
+    instances in its own ``__init__``, which ``trusted`` would skip.
+    """
+    if not (isinstance(to_type, type) and issubclass(to_type, PolymerSequence)
+            and issubclass(from_type, PolymerSequence)):
+        return False
+    if not any(name in vars(to_type) for name in _TRUSTED_DECLARATIONS):
+        return False
+    key = (to_type, from_type, to_type._allowed_chars(),
+           from_type._allowed_chars())
+    if key not in _ACCEPTS:
+        to_allowed, from_allowed = key[2], key[3]
+        if to_allowed is None:
+            # Anything is valid, but only a class's own trusted() knows how
+            # to create it without its constructor.
+            _ACCEPTS[key] = 'trusted' in vars(to_type)
+        else:
+            _ACCEPTS[key] = (from_allowed is not None
+                and set(from_allowed) <= set(to_allowed)
+                and (to_type.ALLOW_EMPTY or not from_type.ALLOW_EMPTY))
+    return _ACCEPTS[key]
+
+# The class attributes which show that a class supports trusted().
+_TRUSTED_DECLARATIONS = ('ALLOWED_CHARS', '_allowed_chars', 'trusted')
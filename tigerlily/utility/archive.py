@@ -115,9 +115,13 @@ class Archive:
         else:
             return self.tarfile.extractfile(member)
 
-    def getfasta(self):
+    def getfasta(self,binary=False):
         """Generate every member of the archive that looks like it is a
         FASTA file as a file-like object.
+
+        The members are opened in text mode unless *binary* is True, in which
+        case they produce undecoded ``bytes`` (suitable for
+        ``tigerlily.sequences.parseFASTABinary``).
         """
 
         if self.zipfile:
@@ -126,13 +130,15 @@ class Archive:
                 if (info.filename.endswith('.fasta') or
                     info.filename.endswith('.fa')):
                     filobj = self.zipfile.open(name)
-                    yield io.TextIOWrapper(filobj,encoding='utf-8')
+                    yield (filobj if binary else
+                           io.TextIOWrapper(filobj,encoding='utf-8'))
         else:
             for member in self.tarfile.getmembers():
                 if member.isfile() and (member.name.endswith('.fasta') or
                                         member.name.endswith('.fa')):
                     filobj = self.tarfile.extractfile(member)
-                    yield io.TextIOWrapper(filobj,encoding='utf-8')
+                    yield (filobj if binary else
+                           io.TextIOWrapper(filobj,encoding='utf-8'))
         
 
     def getnofasta(self):
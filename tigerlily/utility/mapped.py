@@ -0,0 +1,168 @@
+# mapped.py - Flat binary files of typed arrays, opened with mmap.
+# Authors:
+#   * Erich Blume <blume.erich@gmail.com>
+#
+# Copyright 2011 Erich Blume <blume.erich@gmail.com>
+#
+#   This file is part of Tiger Lily.
+#
+#   Tiger Lily is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Tiger Lily is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with Tiger Lily.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Tools for storing typed arrays in a flat file and mapping them back.
+
+Large indexes are much cheaper to open if they never have to be deserialized.
+``store_arrays`` writes a short header followed by each array's raw machine
+representation (aligned to 8 bytes), and ``load_arrays`` opens that file with
+``mmap`` and hands back a ``memoryview`` over each array. Nothing is copied or
+decoded until it is actually indexed, and every process that maps the same
+file shares its pages through the operating system's page cache.
+
+>>> import array, os, tempfile
+>>> filename = os.path.join(tempfile.mkdtemp(), 'example.arrays')
+>>> store_arrays(filename, b'TEST', [1, 2],
+...              [array.array('I', [10, 20, 30]), b'ACGT'])
+>>> header, (numbers, text) = load_arrays(filename, b'TEST')
+>>> header
+[1, 2]
+>>> list(numbers)
+[10, 20, 30]
+>>> bytes(text[1:3])
+b'CG'
+"""
+
+import os
+import struct
+import mmap
+import array
+
+# Written in native byte order so that a mismatched machine can be detected.
+BYTE_ORDER_MARK = 0x01020304
+
+_PREAMBLE = struct.Struct('=4sIII')
+_HEADER_VALUE = struct.Struct('=Q')
+_ARRAY_ENTRY = struct.Struct('=QQ4sI')
+_ALIGNMENT = 8
+
+
+def store_arrays(filename, magic, header, arrays):
+    """Write the integer list *header* and each of *arrays* to *filename*.
+
+    *magic* is a 4-byte ``bytes`` object identifying the kind of file, which
+    ``load_arrays`` will check. Each member of *arrays* must be either an
+    ``array.array`` or a bytes-like object (which is stored as unsigned bytes).
+
+    If *filename* already exists, EnvironmentError will be raised.
+    """
+    if os.path.exists(filename):
+        raise EnvironmentError('File {} already exists.'.format(filename))
+    if len(magic) != 4:
+        raise ValueError('magic must be exactly 4 bytes')
+
+    entries = []
+    offset = _aligned(_PREAMBLE.size + _HEADER_VALUE.size*len(header) +
+                      _ARRAY_ENTRY.size*len(arrays))
+    for data in arrays:
+        typecode = data.typecode if isinstance(data, array.array) else 'B'
+        view = memoryview(data).cast('B')
+        entries.append((offset, len(view), typecode, view))
+        offset = _aligned(offset + len(view))
+
+    with open(filename, 'wb') as out:
+        out.write(_PREAMBLE.pack(magic, BYTE_ORDER_MARK, len(header),
+                                 len(arrays)))
+        for value in header:
+            out.write(_HEADER_VALUE.pack(value))
+        for start, length, typecode, view in entries:
+            out.write(_ARRAY_ENTRY.pack(start, length,
+                                        typecode.encode('ascii'),
+                                        array.array(typecode).itemsize))
+        for start, length, typecode, view in entries:
+            out.write(b'\0' * (start - out.tell()))
+            out.write(view)
+
+
+def load_arrays(filename, magic):
+    """Map *filename* in to memory and return ``(header, arrays)``.
+
+    *header* is the list of integers given to ``store_arrays`` and *arrays* is
+    a list of read-only ``memoryview`` objects, one per stored array, cast to
+    the original array's type. The views keep the mapping open.
+
+    ValueError is raised if the file does not start with *magic* or was
+    written on a machine with a different byte order or word size.
+    """
+    with open(filename, 'rb') as infile:
+        buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    found, mark, num_header, num_arrays = _PREAMBLE.unpack_from(buffer, 0)
+    if found != magic:
+        raise ValueError('File {} is not of the expected type'.format(
+                                                                 filename))
+    if mark != BYTE_ORDER_MARK:
+        raise ValueError('File {} was stored with a different byte '
+                         'order'.format(filename))
+
+    position = _PREAMBLE.size
+    header = []
+    for i in range(num_header):
+        header.append(_HEADER_VALUE.unpack_from(buffer, position)[0])
+        position += _HEADER_VALUE.size
+
+    view = memoryview(buffer)
+    arrays = []
+    for i in range(num_arrays):
+        start, length, typecode, itemsize = _ARRAY_ENTRY.unpack_from(buffer,
+                                                                    position)
+        position += _ARRAY_ENTRY.size
+        typecode = typecode.rstrip(b'\0').decode('ascii')
+        if array.array(typecode).itemsize != itemsize:
+            raise ValueError('File {} was stored with a different word '
+                             'size'.format(filename))
+        arrays.append(view[start:start+length].cast(typecode))
+
+    return header, arrays
+
+
+def pack_strings(strings):
+    """Pack a list of strings in to ``(ends, data)`` for ``store_arrays``.
+
+    *data* holds every string encoded as UTF-8 back to back, and *ends* is an
+    ``array.array`` of the offset just past each one.
+
+    >>> ends, data = pack_strings(['chr1', 'chrX'])
+    >>> unpack_strings(ends, data)
+    ['chr1', 'chrX']
+    """
+    data = bytearray()
+    ends = array.array('Q')
+    for string in strings:
+        data.extend(string.encode('utf-8'))
+        ends.append(len(data))
+    return ends, bytes(data)
+
+
+def unpack_strings(ends, data):
+    """Return the list of strings packed by ``pack_strings``."""
+    strings = []
+    start = 0
+    for end in ends:
+        strings.append(bytes(data[start:end]).decode('utf-8'))
+        start = end
+    return strings
+
+
+def _aligned(offset):
+    """Round *offset* up to the next multiple of the array alignment."""
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT